@@ -0,0 +1,237 @@
+"""
+Local stand-in for the ABB cloud API, serving the endpoints used by abb_api
+with synthetic payloads (benchmarks/payloads.py), a configurable latency and
+error rate, so that the backend can be load tested without the real cloud:
+
+    python benchmarks/abb_simulator.py --port 8100 --latency 0.2 --error-rate 0.01
+    ABB_API_URL=http://127.0.0.1:8100 <backend command>
+
+Any client id and secret are accepted by /Auth/ConnectAccount, the other
+endpoints require one of the tokens it returned. All the accounts see the
+same sites and assets. The number of requests served for each endpoint is
+printed on exit.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src" / "digit"))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings.dev")
+
+import django  # noqa: E402
+
+django.setup()
+
+from abb import abb_api as abb  # noqa: E402
+
+import payloads  # noqa: E402
+
+
+@dataclass
+class SimulatorConfig:
+    latency: float = 0.1
+    jitter: float = 0.05
+    error_rate: float = 0.0
+    sites: int = 5
+    assets: int = 4
+    interval: timedelta = payloads.INTERVAL
+    token_ttl: int = 3600
+
+
+class Simulator:
+    """payloads and state of the simulated cloud, shared by the handlers"""
+
+    def __init__(self, config: SimulatorConfig) -> None:
+        self.config = config
+        self.tokens: set[str] = set()
+        self.requests: Counter = Counter()
+        self.lock = threading.Lock()
+        sites = payloads.sites_body(config.sites)
+        assets = payloads.motionassets_body(
+            config.sites * config.assets, sites=config.sites
+        )
+        site_assets = {site["siteId"]: [] for site in sites["payload"]}
+        for asset in assets["payload"]:
+            site_assets[asset["baseInfo"]["siteId"]].append(asset)
+        self.bodies = {
+            "/Site": encode(sites),
+            "/Subscription/All": encode(payloads.subscriptions_body(assets)),
+            "/InstalledBase/Type": encode(assets),
+            **{
+                f"/InstalledBase/Site/{siteId}": encode({"payload": site_payload})
+                for siteId, site_payload in site_assets.items()
+            },
+        }
+        self.measurements = lru_cache(maxsize=1024)(self._measurements)
+
+    def _measurements(self, assetId: str, start: str, end: str, type_ids: str) -> bytes:
+        return encode(
+            payloads.measurement_range_body(
+                assetId,
+                parse_datetime(start),
+                min(parse_datetime(end), datetime.now(timezone.utc)),
+                [int(type_id) for type_id in type_ids.split(",") if type_id],
+                self.config.interval,
+            )
+        )
+
+    def new_token(self) -> dict:
+        token = f"sim-{uuid.uuid4()}"
+        with self.lock:
+            self.tokens.add(token)
+        return {
+            "payload": {
+                "accessToken": token,
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "expiration": self.config.token_ttl,
+            },
+            "code": 0,
+            "message": "OK",
+        }
+
+    def count(self, endpoint: str) -> None:
+        with self.lock:
+            self.requests[endpoint] += 1
+
+
+def encode(body: dict) -> bytes:
+    return json.dumps(body).encode()
+
+
+def parse_datetime(value: str) -> datetime:
+    """the from/to params of /Measurement, in UTC"""
+    return datetime.strptime(value, abb.FMT_DT).replace(tzinfo=timezone.utc)
+
+
+INSTALLED_BASE_SITE = re.compile(r"^/InstalledBase/Site/\d+/(?P<siteId>[^/]+)$")
+INSTALLED_BASE_TYPE = re.compile(r"^/InstalledBase/Type/\d+$")
+
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    simulator: Simulator
+
+    def send_json(self, status: int, body: bytes) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def simulate(self, endpoint: str) -> bool:
+        """wait the latency, False if the request must fail"""
+        config = self.simulator.config
+        self.simulator.count(endpoint)
+        time.sleep(max(0.0, random.gauss(config.latency, config.jitter)))
+        if random.random() < config.error_rate:
+            self.send_json(503, b'{"code": 503, "message": "Service Unavailable"}')
+            return False
+        return True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path != "/Auth/ConnectAccount":
+            return self.send_json(404, b'{"code": 404, "message": "Not Found"}')
+        if self.simulate("/Auth/ConnectAccount"):
+            self.send_json(200, encode(self.simulator.new_token()))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        path = url.path
+        if match := INSTALLED_BASE_SITE.match(path):
+            endpoint = "/InstalledBase/Site"
+            path = f"{endpoint}/{match['siteId']}"
+        elif INSTALLED_BASE_TYPE.match(path):
+            endpoint = path = "/InstalledBase/Type"
+        else:
+            endpoint = path
+        if path not in self.simulator.bodies and path != "/Measurement":
+            return self.send_json(404, b'{"code": 404, "message": "Not Found"}')
+        token = self.headers.get("Authorization", "").removeprefix("Bearer ")
+        if token not in self.simulator.tokens:
+            return self.send_json(401, b'{"code": 401, "message": "Unauthorized"}')
+        if not self.simulate(endpoint):
+            return
+        if path == "/Measurement":
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            body = self.simulator.measurements(
+                params["motionAssetId"],
+                params["from"],
+                params["to"],
+                params.get("measurementTypeIds", ""),
+            )
+        else:
+            body = self.simulator.bodies[path]
+        self.send_json(200, body)
+
+    def log_message(self, *args):
+        pass
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument(
+        "--latency", type=float, default=0.1, help="mean seconds per response"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.05, help="std deviation of the latency"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="fraction of 503 responses"
+    )
+    parser.add_argument("--sites", type=int, default=5, help="sites per account")
+    parser.add_argument("--assets", type=int, default=4, help="assets per site")
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=payloads.INTERVAL.total_seconds() / 60,
+        help="minutes between two measurement points, sets the payload size",
+    )
+    parser.add_argument(
+        "--token-ttl", type=int, default=3600, help="seconds a token is valid"
+    )
+    args = parser.parse_args()
+
+    SimulatorHandler.simulator = Simulator(
+        SimulatorConfig(
+            latency=args.latency,
+            jitter=args.jitter,
+            error_rate=args.error_rate,
+            sites=args.sites,
+            assets=args.assets,
+            interval=timedelta(minutes=args.interval),
+            token_ttl=args.token_ttl,
+        )
+    )
+    server = ThreadingHTTPServer((args.host, args.port), SimulatorHandler)
+    server.daemon_threads = True
+    print(f"ABB cloud simulator on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        for endpoint, count in sorted(SimulatorHandler.simulator.requests.items()):
+            print(f"{endpoint:<24} {count:>8}")
+
+
+if __name__ == "__main__":
+    main()
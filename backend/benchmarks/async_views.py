@@ -0,0 +1,263 @@
+"""
+Concurrency of the sync (DRF) and of the async (abb.async_views) views on one
+worker: the application runs in process and the ABB cloud simulator
+(benchmarks/abb_simulator.py) answers after a fixed latency. The sites are
+reloaded from the cloud at every request (READ_DATA_FROM_ABB_CLOUD), so each
+one waits on an upstream call.
+
+A sync view holds a thread while it waits, so a worker has at most as many
+sync requests in flight as it has threads: the sync views are served by the
+WSGI handler on a pool of --threads threads, as by a gthread worker. The
+async views are served by the ASGI handler, behind httpx's ASGI transport.
+On an ASGI server the sync views would get a thread per request from asgiref
+instead, bounded only by the memory and the DB connections of the worker.
+
+For each variant N clients send requests back to back for a while, and the
+throughput, the latencies, the peak number of requests in flight in the
+application and in the simulator, and the peak number of threads of the
+worker are reported:
+
+    python benchmarks/async_views.py [--clients 50] [--threads 8] [--duration 10]
+        [--latency 0.5]
+
+Run it against PostgreSQL, as in docker-compose: each request stores the
+sites, and SQLite fails some of the concurrent writes with lock errors.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARKS_DIR.parent / "src" / "digit"))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings.dev")
+
+import django  # noqa: E402
+
+django.setup()
+
+import httpx  # noqa: E402
+
+from datetime import datetime, timedelta, timezone  # noqa: E402
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth.models import User  # noqa: E402
+from django.core.asgi import get_asgi_application  # noqa: E402
+from django.core.wsgi import get_wsgi_application  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.urls import path  # noqa: E402
+from rest_framework_simplejwt.tokens import AccessToken  # noqa: E402
+
+from abb import abb_api as abb, async_views, models, views  # noqa: E402
+
+import abb_simulator  # noqa: E402
+
+urlpatterns = [
+    path("sync/site/", views.SiteView.as_view()),
+    path("async/site/", async_views.sites),
+]
+
+
+class Gauge:
+    """current and peak number of something, shared by threads"""
+
+    def __init__(self) -> None:
+        self.current = self.peak = 0
+        self.lock = threading.Lock()
+
+    def __enter__(self) -> None:
+        with self.lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+
+    def __exit__(self, *exc_info) -> None:
+        with self.lock:
+            self.current -= 1
+
+    def reset(self) -> None:
+        with self.lock:
+            self.peak = self.current
+
+
+UPSTREAM = Gauge()
+
+
+class GaugedHandler(abb_simulator.SimulatorHandler):
+    def simulate(self, endpoint: str) -> bool:
+        with UPSTREAM:
+            return super().simulate(endpoint)
+
+
+def worker_threads() -> int:
+    """threads of the worker, the ones serving the simulator excluded"""
+    return sum(
+        1
+        for thread in threading.enumerate()
+        if "process_request_thread" not in thread.name
+    )
+
+
+@dataclass
+class Result:
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+    in_flight: int = 0
+    upstream: int = 0
+    threads: int = 0
+    elapsed: float = 0.0
+
+
+async def run(
+    url: str, token: str, clients: int, duration: float, threads: int = None
+) -> Result:
+    """
+    serve url for duration seconds to clients, with the WSGI handler on a pool
+    of threads if any, else with the ASGI handler
+    """
+    result = Result()
+    in_flight = Gauge()
+    headers = {"Authorization": f"Bearer {token}"}
+
+    if threads:
+        wsgi = get_wsgi_application()
+
+        def counted(environ, start_response):
+            with in_flight:
+                return wsgi(environ, start_response)
+
+        pool = ThreadPoolExecutor(threads)
+        http = httpx.Client(
+            transport=httpx.WSGITransport(app=counted), base_url="http://testserver"
+        )
+        loop = asyncio.get_running_loop()
+
+        async def get() -> httpx.Response:
+            return await loop.run_in_executor(
+                pool, partial(http.get, url, headers=headers)
+            )
+
+    else:
+        asgi = get_asgi_application()
+
+        async def counted(scope, receive, send):
+            with in_flight:
+                await asgi(scope, receive, send)
+
+        http = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=counted),
+            base_url="http://testserver",
+            timeout=None,
+        )
+
+        async def get() -> httpx.Response:
+            return await http.get(url, headers=headers)
+
+    async def sample_threads(deadline: float) -> None:
+        while time.monotonic() < deadline:
+            result.threads = max(result.threads, worker_threads())
+            await asyncio.sleep(0.01)
+
+    async def client(deadline: float) -> None:
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            rsp = await get()
+            result.latencies.append(time.perf_counter() - start)
+            if rsp.status_code != 200:
+                result.errors += 1
+
+    UPSTREAM.reset()
+    start = time.monotonic()
+    deadline = start + duration
+    try:
+        await asyncio.gather(
+            sample_threads(deadline), *(client(deadline) for _ in range(clients))
+        )
+    finally:
+        result.elapsed = time.monotonic() - start
+        if threads:
+            http.close()
+            pool.shutdown()
+        else:
+            await http.aclose()
+    result.in_flight, result.upstream = in_flight.peak, UPSTREAM.peak
+    return result
+
+
+def setup(simulator: abb_simulator.Simulator) -> str:
+    """create the user and the account, return the JWT of the user"""
+    user = User.objects.create_user(username="bench")
+    token = simulator.new_token()["payload"]["accessToken"]
+    models.Account.objects.create(
+        user=user,
+        username="bench",
+        token=token,
+        token_expiration=datetime.now(timezone.utc) + timedelta(hours=1),
+    )
+    return str(AccessToken.for_user(user))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument(
+        "--threads", type=int, default=8, help="threads serving the sync views"
+    )
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument(
+        "--latency", type=float, default=0.5, help="seconds per ABB cloud response"
+    )
+    args = parser.parse_args()
+
+    simulator = abb_simulator.Simulator(
+        abb_simulator.SimulatorConfig(latency=args.latency, jitter=0)
+    )
+    GaugedHandler.simulator = simulator
+    server = ThreadingHTTPServer(("127.0.0.1", 0), GaugedHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    abb.API_URL = f"http://127.0.0.1:{server.server_port}"
+    settings.ROOT_URLCONF = __name__
+    views.RELOAD = True
+
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        token = setup(simulator)
+        print(
+            f"{args.clients} clients, {args.threads} threads for the sync views, "
+            f"{args.duration:.0f}s, ABB cloud latency {args.latency * 1000:.0f} ms"
+        )
+        print(
+            f"{'views':<7} {'requests':>9} {'errors':>7} {'req/s':>7} "
+            f"{'p50 ms':>8} {'p95 ms':>8} {'in flight':>10} {'upstream':>9} "
+            f"{'threads':>8}"
+        )
+        for variant, threads in (("sync", args.threads), ("async", None)):
+            result = asyncio.run(
+                run(f"/{variant}/site/", token, args.clients, args.duration, threads)
+            )
+            quantiles = statistics.quantiles(result.latencies, n=20)
+            print(
+                f"{variant:<7} {len(result.latencies):>9} {result.errors:>7} "
+                f"{len(result.latencies) / result.elapsed:>7.1f} "
+                f"{statistics.median(result.latencies) * 1000:>8.0f} "
+                f"{quantiles[-1] * 1000:>8.0f} {result.in_flight:>10} "
+                f"{result.upstream:>9} {result.threads:>8}"
+            )
+    finally:
+        connection.close()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""
+Per-call latency of the ABB cloud calls with and without the pooled session.
+
+A local stub server stands in for API_URL, so the numbers only show the cost
+of opening a new TCP connection per call (the TLS handshake against the real
+cloud makes the difference bigger).
+
+    python benchmarks/http_session.py [calls]
+"""
+import os
+import statistics
+import sys
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src" / "digit"))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings.dev")
+
+import django  # noqa: E402
+import requests  # noqa: E402
+
+django.setup()
+
+from abb import abb_api as abb, models  # noqa: E402
+
+PAYLOAD = b'{"payload": [], "code": 0, "message": "OK"}'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(PAYLOAD)))
+        self.end_headers()
+        self.wfile.write(PAYLOAD)
+
+    def log_message(self, *args):
+        pass
+
+
+def measure(calls: int, session) -> list[float]:
+    account = models.Account(username="bench", token="token")
+    timings = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        abb.get_all_subscriptions(account, session)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main(calls: int = 500):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    abb.API_URL = f"http://127.0.0.1:{server.server_port}"
+    # the requests module helpers open a new connection per call, as before
+    results = {
+        "requests.get": measure(calls, requests),
+        "AbbSession": measure(calls, abb.get_session()),
+    }
+    server.shutdown()
+    print(f"{'client':<15}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for name, timings in results.items():
+        p95 = statistics.quantiles(timings, n=20)[-1]
+        print(
+            f"{name:<15}{statistics.mean(timings):>10.3f}"
+            f"{statistics.median(timings):>10.3f}{p95:>10.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
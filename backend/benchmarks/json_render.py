@@ -0,0 +1,135 @@
+"""
+Time to serialize and render the responses of the ABB views with DRF
+(serializer.data and JSONRenderer) against the fast path of abb.renderers
+(compiled serializer, encoded with orjson or the stdlib json module), for
+reports and asset lists of realistic sizes.
+
+    python benchmarks/json_render.py
+"""
+import gc
+import json
+import os
+import sys
+import time
+
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src" / "digit"))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings.dev")
+
+import django  # noqa: E402
+
+django.setup()
+
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+
+from abb import abb_api as abb, models, renderers, serializers  # noqa: E402
+
+SITE = models.Site(
+    siteId="9AAS491472V5330",
+    siteName="Fertitalia - Villa Bartolomea",
+    country="ITALY",
+    countryCode="IT",
+    address="località Serragli 1",
+    city="Villa Bartolomea",
+    latitude=45.07167,
+    longitude=11.35701,
+)
+
+
+def make_asset(i: int) -> models.MotionAsset:
+    return models.MotionAsset(
+        motionAssetId=f"e197cdae-b6f3-5fa7-a3e0-{i:012d}",
+        assetId=str(30000 + i),
+        assetTypeId="1",
+        assetType="Motor",
+        assetName=f"coclea di ricircolo {i}",
+        baseAPI=1,
+        description="coclea",
+        organizationName="Acque Veronesi",
+        assetOwner="marco@piccolisergio.it",
+        serialNumber=f"S2A{i:07d}",
+        assetGroupId=17705,
+        site=SITE,
+        sync_status=models.MotionAsset.SYNC_OK,
+        synced_at=datetime(2022, 3, 1, 12, 30, tzinfo=timezone.utc),
+    )
+
+
+def make_report(points: int) -> abb.AssetReport:
+    start = datetime(2022, 1, 1, tzinfo=timezone.utc)
+    measurements = [
+        abb.CombinedPoint(
+            start + timedelta(minutes=i),
+            (i % 97) / 7,
+            (i % 89) / 7,
+            None if i % 10 else (i % 83) / 7,
+            60.0,
+            float(i),
+        )
+        for i in range(points)
+    ]
+    report = abb.ReportData(points, points / 60, 6.8, 6.2, 5.9, 0, 0)
+    return abb.AssetReport(
+        make_asset(0), start, measurements[-1].tstamp, measurements, report
+    )
+
+
+def drf(serializer_class, instance) -> bytes:
+    return JSONRenderer().render(serializer_class(instance).data)
+
+
+def fast(serializer_class, instance) -> bytes:
+    return renderers.FastJSONRenderer().render(
+        renderers.serialize(serializer_class, instance)
+    )
+
+
+def fast_stdlib(serializer_class, instance) -> bytes:
+    with mock.patch.object(renderers, "orjson", None):
+        return fast(serializer_class, instance)
+
+
+def timed(func, *args, repeat: int = 3) -> tuple[bytes, float]:
+    best = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def main() -> None:
+    cases = [
+        (f"report {n} points", serializers.AssetReportSerializer, make_report(n))
+        for n in (720, 8640, 44640)
+    ] + [
+        (
+            f"{n} assets",
+            serializers.AssetsSerializer,
+            {"assets": [make_asset(i) for i in range(n)]},
+        )
+        for n in (50, 500)
+    ]
+    print(
+        f"{'':<20} {'KB':>7} {'drf ms':>8} {'fast ms':>8} "
+        f"{'json ms':>8} {'speedup':>8} {'identical':>9}"
+    )
+    for name, serializer_class, instance in cases:
+        expected, drf_s = timed(drf, serializer_class, instance)
+        body, fast_s = timed(fast, serializer_class, instance)
+        stdlib_body, stdlib_s = timed(fast_stdlib, serializer_class, instance)
+        assert json.loads(body) == json.loads(expected)
+        assert stdlib_body == expected
+        print(
+            f"{name:<20} {len(expected) / 1024:>7.0f} {drf_s * 1000:>8.1f} "
+            f"{fast_s * 1000:>8.1f} {stdlib_s * 1000:>8.1f} "
+            f"{drf_s / fast_s:>7.1f}x {str(body == expected):>9}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""
+Load test of the /api/abb/ endpoints: N simulated users, each with its own
+JWT and ABB account, browse the dashboard as the frontend does (sites, then
+the assets of a site, then the report of an asset) for a given duration, and
+the throughput and the p50/p95/p99 latencies of each endpoint are reported.
+
+The driver must use the settings (database, SECRET_KEY) of the backend under
+test. With --setup it creates the loadtest-<i> users and syncs their
+accounts from the ABB cloud simulator, which ABB_API_URL must point to:
+
+    python benchmarks/abb_simulator.py --port 8100 &
+    export ABB_API_URL=http://127.0.0.1:8100
+    gunicorn -w 1 -k uvicorn.workers.UvicornWorker config.asgi:application &
+    python benchmarks/load_driver.py --setup --users 50 --duration 60
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src" / "digit"))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings.dev")
+
+import django  # noqa: E402
+
+django.setup()
+
+import httpx  # noqa: E402
+import requests  # noqa: E402
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth.models import User  # noqa: E402
+from rest_framework_simplejwt.tokens import AccessToken  # noqa: E402
+
+from abb import abb_api as abb, models, sync  # noqa: E402
+
+USERNAME = "loadtest-{}"
+PRODUCTION_API_URL = "https://api.conditionmonitoring.motion.abb.com"
+
+
+def retry(func, *args, attempts: int = 5):
+    """call func, again if it fails on the errors injected by the simulator"""
+    for attempt in range(attempts):
+        try:
+            return func(*args)
+        except requests.HTTPError:
+            if attempt == attempts - 1:
+                raise
+
+
+def setup_users(count: int) -> None:
+    """create the users and their accounts, and sync them from the simulator"""
+    if abb.API_URL == PRODUCTION_API_URL:
+        sys.exit("Point ABB_API_URL to the ABB cloud simulator to run --setup")
+    accounts = []
+    for i in range(count):
+        user, _ = User.objects.get_or_create(username=USERNAME.format(i))
+        account, _ = models.Account.objects.get_or_create(
+            user=user, defaults={"username": user.username, "password": "loadtest"}
+        )
+        accounts.append(account)
+    from_date, _ = abb.get_last_complete_month()
+    to_date = datetime.now(timezone.utc)
+    synced = set()
+    for account in accounts:
+        api = sync.create_account_api(account, rate_limit=1000)
+        # every account of the simulator sees the same assets
+        for asset in retry(sync.sync_account_inventory, api):
+            if asset.pk not in synced:
+                retry(sync.sync_asset, api, asset, from_date, to_date)
+                synced.add(asset.pk)
+        api.session.close()
+    print(f"{count} users ready, {len(synced)} assets synced")
+
+
+def get_tokens(count: int) -> list[str]:
+    users = list(
+        User.objects.filter(
+            username__in=[USERNAME.format(i) for i in range(count)]
+        ).order_by("pk")
+    )
+    if len(users) < count:
+        sys.exit(f"Only {len(users)} load test users, run with --setup")
+    return [str(AccessToken.for_user(user)) for user in users]
+
+
+class Stats:
+    def __init__(self) -> None:
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.statuses: dict[str, Counter] = defaultdict(Counter)
+
+    def add(self, endpoint: str, latency: float, status: str) -> None:
+        self.latencies[endpoint].append(latency)
+        self.statuses[endpoint][status] += 1
+
+    def summary(self, elapsed: float) -> dict[str, dict]:
+        endpoints = {**self.latencies, "total": sum(self.latencies.values(), [])}
+        summary = {}
+        for endpoint, latencies in endpoints.items():
+            if not latencies:
+                continue
+            if endpoint == "total":
+                statuses = sum(self.statuses.values(), Counter())
+            else:
+                statuses = self.statuses[endpoint]
+            quantiles = (
+                statistics.quantiles(latencies, n=100, method="inclusive")
+                if len(latencies) > 1
+                else latencies * 99
+            )
+            summary[endpoint] = {
+                "requests": len(latencies),
+                "errors": sum(
+                    count
+                    for status, count in statuses.items()
+                    if status not in ("200", "304")
+                ),
+                "rps": len(latencies) / elapsed,
+                "p50": quantiles[49],
+                "p95": quantiles[94],
+                "p99": quantiles[98],
+                "max": max(latencies),
+                "statuses": dict(statuses),
+            }
+        return summary
+
+
+class DashboardUser:
+    """a dashboard user, revalidating the responses it got like the browser"""
+
+    def __init__(
+        self, client: httpx.AsyncClient, token: str, stats: Stats, args
+    ) -> None:
+        self.client = client
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.stats = stats
+        self.args = args
+        self.etags: dict[str, str] = {}
+        self.bodies: dict[str, dict] = {}
+
+    async def get(self, endpoint: str, url: str, params: dict = None):
+        headers = self.headers
+        key = f"{url}?{params}"
+        if self.args.revalidate and key in self.etags:
+            headers = {**headers, "If-None-Match": self.etags[key]}
+        start = time.perf_counter()
+        try:
+            rsp = await self.client.get(url, headers=headers, params=params)
+        except httpx.HTTPError as e:
+            self.stats.add(endpoint, time.perf_counter() - start, type(e).__name__)
+            return None
+        self.stats.add(endpoint, time.perf_counter() - start, str(rsp.status_code))
+        if rsp.status_code == 304:
+            return self.bodies[key]
+        if rsp.status_code != 200:
+            return None
+        body = rsp.json()
+        if self.args.revalidate and "ETag" in rsp.headers:
+            self.etags[key] = rsp.headers["ETag"]
+            self.bodies[key] = body
+        return body
+
+    async def browse(self, deadline: float) -> None:
+        while time.monotonic() < deadline:
+            sites = await self.get("sites", "/api/abb/site/")
+            if sites and sites["sites"]:
+                siteId = random.choice(sites["sites"])["siteId"]
+                assets = await self.get("assets", f"/api/abb/site/{siteId}/")
+                if assets and assets["assets"]:
+                    asset = random.choice(assets["assets"])
+                    params = {}
+                    if self.args.max_points:
+                        params["max_points"] = self.args.max_points
+                    await self.get(
+                        "report",
+                        f"/api/abb/site/{siteId}/asset/{asset['motionAssetId']}/",
+                        params,
+                    )
+                if self.args.site_reports:
+                    await self.get("site_reports", f"/api/abb/site/{siteId}/reports/")
+            await asyncio.sleep(random.expovariate(1 / self.args.think))
+
+
+async def run(tokens: list[str], args) -> tuple[Stats, float]:
+    stats = Stats()
+    limits = httpx.Limits(max_connections=len(tokens))
+    async with httpx.AsyncClient(
+        base_url=args.url, limits=limits, timeout=args.timeout
+    ) as client:
+        start = time.monotonic()
+        deadline = start + args.ramp_up + args.duration
+
+        async def start_user(i: int, token: str) -> None:
+            # users are started evenly during the ramp up
+            await asyncio.sleep(args.ramp_up * i / len(tokens))
+            await DashboardUser(client, token, stats, args).browse(deadline)
+
+        await asyncio.gather(*(start_user(i, t) for i, t in enumerate(tokens)))
+        elapsed = time.monotonic() - start
+    return stats, elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument(
+        "--ramp-up", type=float, default=5, help="seconds to start all the users"
+    )
+    parser.add_argument(
+        "--think", type=float, default=1, help="mean seconds between two pages"
+    )
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--max-points", type=int, help="max_points of the reports")
+    parser.add_argument(
+        "--site-reports", action="store_true", help="also load the site reports"
+    )
+    parser.add_argument(
+        "--revalidate",
+        action="store_true",
+        help="send If-None-Match with the ETags received, as the frontend",
+    )
+    parser.add_argument("--setup", action="store_true", help="create the users")
+    parser.add_argument("--json", type=Path, help="save the results in this file")
+    args = parser.parse_args()
+
+    if args.setup:
+        setup_users(args.users)
+    tokens = get_tokens(args.users)
+    stats, elapsed = asyncio.run(run(tokens, args))
+    summary = stats.summary(elapsed)
+
+    print(f"\n{args.users} users, {elapsed:.0f}s, ABB cloud at {settings.ABB_API_URL}")
+    print(
+        f"{'endpoint':<14} {'requests':>9} {'errors':>7} {'req/s':>8} "
+        f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+    )
+    for endpoint, row in summary.items():
+        print(
+            f"{endpoint:<14} {row['requests']:>9} {row['errors']:>7} "
+            f"{row['rps']:>8.1f} {row['p50'] * 1000:>8.0f} {row['p95'] * 1000:>8.0f} "
+            f"{row['p99'] * 1000:>8.0f} {row['max'] * 1000:>8.0f}"
+        )
+    if args.json:
+        args.json.write_text(
+            json.dumps({"users": args.users, "elapsed": elapsed, "results": summary})
+        )
+
+
+if __name__ == "__main__":
+    main()
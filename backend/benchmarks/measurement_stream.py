@@ -0,0 +1,105 @@
+"""
+Peak memory and time to parse a Measurement response whole (rsp.json() and
+parse_asset_measurements) against the streaming parser, for date ranges of
+growing width. The body is built before the measure starts, as it would be
+downloaded; the streaming parser reads it in STREAM_CHUNK_SIZE chunks.
+
+    python benchmarks/measurement_stream.py [days ...]
+"""
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src" / "digit"))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings.dev")
+
+import django  # noqa: E402
+
+django.setup()
+
+from abb import abb_api as abb  # noqa: E402
+
+# one point every INTERVAL for each measurement type
+INTERVAL = timedelta(minutes=5)
+
+
+def make_body(days: int) -> bytes:
+    start = datetime(2022, 1, 1, tzinfo=timezone.utc)
+    timestamps = [
+        (start + INTERVAL * i).isoformat()
+        for i in range(int(timedelta(days=days) / INTERVAL))
+    ]
+    measurements = [
+        {
+            "baseInfo": {
+                "measurementTypeId": str(type_id),
+                "measurementTypeName": name,
+                "unit": "",
+                "startTime": timestamps[0],
+                "endTime": timestamps[-1],
+            },
+            "dataPoints": [
+                {"measurementValue": f"{i % 1000 / 7:.4f}", "timestamp": t}
+                for i, t in enumerate(timestamps)
+            ],
+        }
+        for name, type_id in abb.MEASUREMENT_TYPES.items()
+    ]
+    body = {
+        "payload": [
+            {
+                "baseInfo": {"assetId": "30879", "assetName": "bench"},
+                "measurements": measurements,
+            }
+        ]
+    }
+    return json.dumps(body).encode()
+
+
+def parse_whole(body: bytes) -> int:
+    data = abb.parse_asset_measurements(json.loads(body.decode()))
+    return sum(1 for measure in data.measurements for _ in measure.data)
+
+
+def parse_stream(body: bytes) -> int:
+    size = abb.STREAM_CHUNK_SIZE
+    chunks = (body[i : i + size] for i in range(0, len(body), size))
+    return sum(1 for _ in abb.iter_measurement_points(chunks))
+
+
+def measure(func, body: bytes) -> tuple[int, float, float]:
+    """return the points parsed by func, its peak memory in MB and seconds"""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    points = func(body)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return points, peak / 2**20, elapsed
+
+
+def main(days: list[int]) -> None:
+    print(
+        f"{'days':>5} {'points':>9} {'body MB':>8} "
+        f"{'whole MB':>9} {'stream MB':>10} {'whole s':>8} {'stream s':>9}"
+    )
+    for n in days:
+        body = make_body(n)
+        points, whole_mb, whole_s = measure(parse_whole, body)
+        streamed, stream_mb, stream_s = measure(parse_stream, body)
+        assert streamed == points
+        print(
+            f"{n:>5} {points:>9} {len(body) / 2**20:>8.1f} "
+            f"{whole_mb:>9.1f} {stream_mb:>10.2f} {whole_s:>8.2f} {stream_s:>9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [7, 30, 90, 365])
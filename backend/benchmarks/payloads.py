@@ -0,0 +1,178 @@
+"""
+Synthetic ABB cloud responses, shaped as the samples recorded in the
+docstrings of abb.abb_api, and a requests adapter serving them so that the
+API functions run offline with their real HTTP and parsing code.
+"""
+import io
+import json
+
+from datetime import datetime, timedelta, timezone
+from typing import Iterable
+from urllib.parse import urlparse
+
+import requests
+
+from abb import abb_api as abb
+
+START = datetime(2022, 1, 1, tzinfo=timezone.utc)
+
+# one point every INTERVAL for each measurement type
+INTERVAL = timedelta(minutes=5)
+
+
+def measurement_body(days: int) -> dict:
+    """/Measurement response with a point every INTERVAL for days"""
+    return measurement_range_body("30879", START, START + timedelta(days=days))
+
+
+def measurement_range_body(
+    assetId: str,
+    start: datetime,
+    end: datetime,
+    type_ids: Iterable[int] = None,
+    interval: timedelta = INTERVAL,
+) -> dict:
+    """
+    /Measurement response with the points in [start, end] of the measurement
+    types, at the multiples of interval since the epoch, so that a request
+    starting after a point never returns it again
+    """
+    types = {str(type_id): name for name, type_id in abb.MEASUREMENT_TYPES.items()}
+    if type_ids is not None:
+        types = {str(type_id): types.get(str(type_id), "") for type_id in type_ids}
+    step = int(interval.total_seconds())
+    first = -(-int(start.timestamp()) // step)
+    ticks = range(first, int(end.timestamp()) // step + 1)
+    timestamps = [
+        datetime.fromtimestamp(tick * step, timezone.utc).isoformat() for tick in ticks
+    ]
+    measurements = [
+        {
+            "baseInfo": {
+                "measurementTypeId": type_id,
+                "measurementTypeName": name,
+                "unit": "mm/s RMS",
+                "startTime": start.isoformat(),
+                "endTime": end.isoformat(),
+            },
+            "dataPoints": [
+                {"measurementValue": f"{tick % 1000 / 7:.4f}", "timestamp": t}
+                for tick, t in zip(ticks, timestamps)
+            ],
+        }
+        for type_id, name in types.items()
+    ]
+    return {
+        "payload": [
+            {
+                "baseInfo": {"assetId": assetId, "assetName": f"coclea {assetId}"},
+                "measurements": measurements,
+            }
+        ]
+    }
+
+
+def sites_body(count: int) -> dict:
+    """/Site response with count sites"""
+    return {
+        "payload": [
+            {
+                "siteId": f"9AAS{i:011d}",
+                "siteName": f"Depuratore {i}",
+                "country": "ITALY",
+                "countryCode": "IT",
+                "address": "località Serragli 1",
+                "city": "Villa Bartolomea",
+                "latitude": "45.07167",
+                "longitude": "11.35701",
+            }
+            for i in range(count)
+        ]
+    }
+
+
+def subscriptions_body(assets: dict) -> dict:
+    """/Subscription/All response with a trial subscription per asset"""
+    return {
+        "payload": [
+            {
+                "motionAssetId": asset["baseInfo"]["motionAssetId"],
+                "serialNumber": asset["baseInfo"]["serialNumber"],
+                "contractNumber": "20210901-4693441",
+                "startDate": "0001-01-01T00:00:00",
+                "expirationDate": "1970-01-01T00:00:00Z",
+                "isTrial": True,
+                "trialPeriodEndDate": "2022-02-28T23:59:59.999Z",
+                "featureList": ["Condition monitoring", "Alarm Management"],
+            }
+            for asset in assets["payload"]
+        ]
+    }
+
+
+def motionassets_body(count: int, sites: int = 10) -> dict:
+    """/InstalledBase response with count assets spread over sites"""
+    return {
+        "payload": [
+            {
+                "baseInfo": {
+                    "motionAssetId": f"e197cdae-b6f3-5fa7-a3e0-{i:012d}",
+                    "assetId": str(30000 + i),
+                    "assetTypeId": "1",
+                    "assetTypeVersion": None,
+                    "assetType": "Motor",
+                    "assetFamily": None,
+                    "assetName": f"coclea di ricircolo {i}",
+                    "baseAPI": 1,
+                    "description": "coclea",
+                    "siteId": f"9AAS{i % sites:011d}",
+                    "siteName": f"Depuratore {i % sites}",
+                    "organizationName": "Acque Veronesi",
+                    "assetOwner": "marco@piccolisergio.it",
+                    "serialNumber": f"S2A{i:07d}",
+                    "assetGroupId": 17705,
+                },
+                "assetProperties": [
+                    {
+                        "assetPropertyName": "portalUrl",
+                        "propertyValues": [
+                            {
+                                "name": "PortalUrl",
+                                "propertyValue": "https://smartsensor.abb.com/"
+                                f"asset-properties?id={30000 + i}",
+                                "unit": None,
+                            }
+                        ],
+                    }
+                ],
+            }
+            for i in range(count)
+        ]
+    }
+
+
+class PayloadAdapter(requests.adapters.BaseAdapter):
+    """answer the requests by URL path with the JSON bodies given"""
+
+    def __init__(self, bodies: dict[str, dict]) -> None:
+        super().__init__()
+        self.bodies = {path: json.dumps(body).encode() for path, body in bodies.items()}
+
+    def send(self, request, **kwargs):
+        rsp = requests.Response()
+        rsp.status_code = 200
+        rsp.headers["Content-Type"] = "application/json"
+        rsp.encoding = "utf-8"
+        rsp.raw = io.BytesIO(self.bodies[urlparse(request.url).path])
+        rsp.request = request
+        rsp.url = request.url
+        return rsp
+
+    def close(self):
+        pass
+
+
+def payload_session(bodies: dict[str, dict]) -> requests.Session:
+    session = requests.Session()
+    session.mount(abb.API_URL, PayloadAdapter(bodies))
+    return session
@@ -0,0 +1,117 @@
+"""
+CPU time of elaborate_report_data against the previous point-by-point
+implementation, on synthetic series of the 5 report measurement types. The
+previous implementation reads lists of points, elaborate_report_data reads
+the MeasurementSeries returned by the local store and by the parser. The
+benchmark fails if elaborate_report_data is the slower one.
+
+    python benchmarks/report_engine.py [points ...]
+"""
+import gc
+import os
+import random
+import sys
+import time
+
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src" / "digit"))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings.dev")
+
+import django  # noqa: E402
+
+django.setup()
+
+from abb import abb_api as abb, models  # noqa: E402
+
+
+def make_measurements(points: int) -> abb.AssetMeasurements:
+    start = datetime(2022, 1, 1, tzinfo=timezone.utc)
+    # the report is computed from the local store, which returns datetimes
+    timestamps = [start + timedelta(minutes=i) for i in range(points)]
+    measurements = []
+    for name, type_id in abb.MEASUREMENT_TYPES.items():
+        info = abb.MeasurementInfo(str(type_id), name, "", "", "")
+        data = [abb.MeasurementPoint(random.random(), t) for t in timestamps]
+        measurements.append(abb.Measurement(info, data))
+    return abb.AssetMeasurements("30879", "bench", measurements)
+
+
+def to_series(data: abb.AssetMeasurements) -> abb.AssetMeasurements:
+    """the measurements as stored, in MeasurementSeries"""
+    measurements = []
+    for m in data.measurements:
+        series = abb.MeasurementSeries()
+        for point in m.data:
+            series.append(point.timestamp, point.value)
+        measurements.append(abb.Measurement(m.info, series))
+    return abb.AssetMeasurements(data.assetId, data.assetName, measurements)
+
+
+def legacy_elaborate_report_data(data: abb.AssetMeasurements) -> abb.AssetReport:
+    datalen = min([len(m.data) for m in data.measurements])
+    resdata = []
+    report_arrays = defaultdict(list)
+    for i in range(datalen):
+        vals = {}
+        for m in data.measurements:
+            tipe = m.info.measurementTypeId
+            if tipe in abb.MEASUREMENT_TYPES_IDS:
+                key = abb.MEASUREMENT_TYPES_IDS[tipe]
+                value = m.data[i].value
+                vals[key] = value
+                report_arrays[key].append(value)
+        else:
+            key = "tstamp"
+            value = m.data[i].timestamp
+            vals[key] = value
+            report_arrays[key].append(value)
+        resdata.append(abb.CombinedPoint(**vals))
+    report_vals = abb.ReportData(
+        max(report_arrays["tot_time"]),
+        sum(report_arrays["run_time"]) / 60,
+        sum(report_arrays["acc_x"]) / len(report_arrays["acc_x"]),
+        sum(report_arrays["acc_y"]) / len(report_arrays["acc_y"]),
+        sum(report_arrays["acc_z"]) / len(report_arrays["acc_z"]),
+        0,
+        0,
+    )
+    start_date = report_arrays["tstamp"][0]
+    end_date = report_arrays["tstamp"][-1]
+    return abb.AssetReport(None, start_date, end_date, resdata, report_vals)
+
+
+def timed(func, *args):
+    # objects created by previous runs must not slow down the collector
+    gc.collect()
+    gc.freeze()
+    start = time.process_time()
+    result = func(*args)
+    elapsed = time.process_time() - start
+    gc.unfreeze()
+    return result, elapsed
+
+
+def main(*sizes: int):
+    asset = models.MotionAsset(motionAssetId="bench", assetId="30879")
+    print(f"{'points':>10}{'legacy s':>12}{'columnar s':>12}{'report s':>12}")
+    for points in sizes or (10_000, 100_000, 1_000_000):
+        data = make_measurements(points)
+        legacy, legacy_time = timed(legacy_elaborate_report_data, data)
+        report, report_time = timed(abb.elaborate_report_data, to_series(data), asset)
+        # aggregates alone, without building the CombinedPoint list
+        columns = abb.get_report_columns(report.measurements)
+        _, aggregate_time = timed(abb.compute_report_data, columns)
+        assert report.report == legacy.report
+        assert report.measurements == legacy.measurements
+        print(
+            f"{points:>10}{legacy_time:>12.3f}{report_time:>12.3f}"
+            f"{aggregate_time:>12.4f}"
+        )
+        assert report_time <= legacy_time, "elaborate_report_data regressed"
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
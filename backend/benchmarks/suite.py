@@ -0,0 +1,343 @@
+"""
+Micro-benchmarks of the hot paths of abb.abb_api on synthetic ABB payloads
+(benchmarks/payloads.py), runnable offline at several data sizes:
+
+- parsing of the Measurement responses, whole and streamed
+- elaborate_report_data, and the report values from the daily rollups
+- the upserts of get_sites and get_motionassets, inserting new rows and
+  re-saving unchanged ones, on a test database
+- AssetReportSerializer, with DRF and with abb.renderers
+
+The results are saved in benchmarks/results/<commit>.json and can be
+compared with the ones of another commit, exiting with status 1 when a
+benchmark got slower than the threshold:
+
+    python benchmarks/suite.py [--filter NAME] [--repeat N]
+    python benchmarks/suite.py --compare benchmarks/results/<commit>.json
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARKS_DIR.parent / "src" / "digit"))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings.dev")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.db import connection  # noqa: E402
+
+from abb import abb_api as abb, models, renderers, serializers  # noqa: E402
+
+import payloads  # noqa: E402
+
+RESULTS_DIR = BENCHMARKS_DIR / "results"
+
+
+@dataclass
+class Case:
+    """run is timed, reset restores the state before each run untimed"""
+
+    run: Callable[[], Any]
+    reset: Optional[Callable[[], None]] = None
+
+
+@dataclass
+class Benchmark:
+    name: str
+    sizes: tuple[int, ...]
+    setup: Callable[[int], Case]
+
+
+BENCHMARKS: list[Benchmark] = []
+
+
+def benchmark(name: str, sizes: tuple[int, ...]):
+    """register a function returning the Case to time for a size"""
+
+    def decorator(setup: Callable[[int], Case]) -> Callable[[int], Case]:
+        BENCHMARKS.append(Benchmark(name, sizes, setup))
+        return setup
+
+    return decorator
+
+
+def get_account() -> models.Account:
+    return models.Account(
+        pk=1,
+        username="bench",
+        token="token",
+        token_expiration=datetime.now(timezone.utc) + timedelta(days=1),
+    )
+
+
+@benchmark("get_asset_measurements days", (7, 30, 90))
+def bench_get_asset_measurements(days: int) -> Case:
+    session = payloads.payload_session(
+        {"/Measurement": payloads.measurement_body(days)}
+    )
+    return Case(
+        lambda: abb.get_asset_measurements(get_account(), "30879", session=session)
+    )
+
+
+@benchmark("stream_asset_measurements days", (7, 30, 90))
+def bench_stream_asset_measurements(days: int) -> Case:
+    session = payloads.payload_session(
+        {"/Measurement": payloads.measurement_body(days)}
+    )
+
+    def run():
+        points = abb.stream_asset_measurements(get_account(), "30879", session=session)
+        return sum(1 for _ in points)
+
+    return Case(run)
+
+
+@benchmark("elaborate_report_data points", (10_000, 100_000))
+def bench_elaborate_report_data(points: int) -> Case:
+    timestamps = [payloads.START + timedelta(minutes=i) for i in range(points)]
+    measurements = [
+        abb.Measurement(
+            abb.MeasurementInfo(str(type_id), name, "", "", ""),
+            [abb.MeasurementPoint(i % 97 / 7, t) for i, t in enumerate(timestamps)],
+        )
+        for name, type_id in abb.MEASUREMENT_TYPES.items()
+    ]
+    data = abb.AssetMeasurements("30879", "bench", measurements)
+    asset = models.MotionAsset(motionAssetId="bench", assetId="30879")
+    return Case(lambda: abb.elaborate_report_data(data, asset))
+
+
+@benchmark("get_rollup_report days", (31, 92, 366))
+def bench_get_rollup_report(days: int) -> Case:
+    site, _ = models.Site.objects.get_or_create(siteId="bench", siteName="bench")
+    asset, _ = models.MotionAsset.objects.get_or_create(
+        motionAssetId="bench", assetId="30879", site=site
+    )
+    asset.daily_rollups.all().delete()
+    models.MotionAssetDailyRollup.objects.bulk_create(
+        models.MotionAssetDailyRollup(
+            asset=asset,
+            day=(payloads.START + timedelta(days=day)).date(),
+            measurementTypeId=type_id,
+            count=288,
+            sum=288.0 * day,
+            min=0.0,
+            max=float(day),
+            last=float(day),
+            first_timestamp=payloads.START + timedelta(days=day),
+            last_timestamp=payloads.START + timedelta(days=day, hours=23),
+        )
+        for day in range(days)
+        for type_id in abb.MEASUREMENT_TYPES.values()
+    )
+    end = payloads.START + timedelta(days=days)
+    return Case(lambda: abb.get_rollup_report(asset, payloads.START, end))
+
+
+def delete_inventory() -> None:
+    models.MotionAsset.objects.all().delete()
+    models.Site.objects.all().delete()
+
+
+@benchmark("get_sites insert sites", (10, 100, 1000))
+def bench_get_sites_insert(count: int) -> Case:
+    session = payloads.payload_session({"/Site": payloads.sites_body(count)})
+    account = models.Account.objects.get(pk=1)
+    return Case(lambda: abb.get_sites(account, session), reset=delete_inventory)
+
+
+@benchmark("get_sites unchanged sites", (10, 100, 1000))
+def bench_get_sites_unchanged(count: int) -> Case:
+    session = payloads.payload_session({"/Site": payloads.sites_body(count)})
+    account = models.Account.objects.get(pk=1)
+    delete_inventory()
+    abb.get_sites(account, session)
+    return Case(lambda: abb.get_sites(account, session))
+
+
+@benchmark("get_motionassets insert assets", (10, 100, 1000))
+def bench_get_motionassets_insert(count: int) -> Case:
+    session = payloads.payload_session(
+        {"/InstalledBase/Type/1": payloads.motionassets_body(count)}
+    )
+    return Case(
+        lambda: abb.get_motionassets(get_account(), session=session),
+        reset=delete_inventory,
+    )
+
+
+@benchmark("get_motionassets unchanged assets", (10, 100, 1000))
+def bench_get_motionassets_unchanged(count: int) -> Case:
+    session = payloads.payload_session(
+        {"/InstalledBase/Type/1": payloads.motionassets_body(count)}
+    )
+    delete_inventory()
+    abb.get_motionassets(get_account(), session=session)
+    return Case(lambda: abb.get_motionassets(get_account(), session=session))
+
+
+def make_report(points: int) -> abb.AssetReport:
+    site = models.Site(siteId="9AAS491472V5330", siteName="Depuratore")
+    asset = models.MotionAsset(
+        motionAssetId="e197cdae", assetId="30879", assetName="coclea", site=site
+    )
+    measurements = [
+        abb.CombinedPoint(
+            payloads.START + timedelta(minutes=i),
+            i % 97 / 7,
+            i % 89 / 7,
+            None if i % 10 else i % 83 / 7,
+            60.0,
+            float(i),
+        )
+        for i in range(points)
+    ]
+    report = abb.ReportData(points, points / 60, 6.8, 6.2, 5.9, 0, 0)
+    return abb.AssetReport(
+        asset, measurements[0].tstamp, measurements[-1].tstamp, measurements, report
+    )
+
+
+@benchmark("AssetReportSerializer drf points", (720, 8640, 44640))
+def bench_report_serializer_drf(points: int) -> Case:
+    report = make_report(points)
+    return Case(lambda: serializers.AssetReportSerializer(report).data)
+
+
+@benchmark("AssetReportSerializer fast points", (720, 8640, 44640))
+def bench_report_serializer_fast(points: int) -> Case:
+    report = make_report(points)
+    return Case(lambda: renderers.serialize(serializers.AssetReportSerializer, report))
+
+
+def measure(case: Case, repeat: int) -> list[float]:
+    """seconds taken by each of repeat runs, after a warm up one"""
+    timings = []
+    for i in range(repeat + 1):
+        if case.reset:
+            case.reset()
+        gc.collect()
+        start = time.perf_counter()
+        case.run()
+        elapsed = time.perf_counter() - start
+        if i:
+            timings.append(elapsed)
+    return timings
+
+
+def git_commit() -> tuple[str, bool]:
+    """short hash of HEAD and whether the tree has uncommitted changes"""
+
+    def git(*args: str) -> str:
+        return subprocess.run(
+            ["git", *args], cwd=BENCHMARKS_DIR, capture_output=True, text=True
+        ).stdout.strip()
+
+    return git("rev-parse", "--short", "HEAD") or "unknown", bool(
+        git("status", "--porcelain", "--untracked-files=no")
+    )
+
+
+def run(name_filter: str, repeat: int) -> Iterator[tuple[str, dict]]:
+    """yield the timings of the benchmarks, run on a test database"""
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        user = User.objects.create_user(username="bench")
+        models.Account.objects.create(pk=1, user=user, username="bench")
+        for bench in BENCHMARKS:
+            if name_filter and name_filter not in bench.name:
+                continue
+            for size in bench.sizes:
+                timings = measure(bench.setup(size), repeat)
+                yield f"{bench.name}={size}", {
+                    "min": min(timings),
+                    "median": statistics.median(timings),
+                    "runs": len(timings),
+                }
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--filter", default="", help="run the benchmarks matching")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per size")
+    parser.add_argument("--compare", type=Path, help="results of a previous run")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="relative slowdown of the fastest run reported as a regression",
+    )
+    parser.add_argument(
+        "--no-save", action="store_true", help="don't store the results"
+    )
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())["results"]
+    print(f"{'benchmark':<46} {'min ms':>10} {'median ms':>10} {'baseline':>9}")
+    results = {}
+    regressions = []
+    for key, result in run(args.filter, args.repeat):
+        results[key] = result
+        change = ""
+        if key in baseline:
+            # the fastest run is the least disturbed by the rest of the system
+            ratio = result["min"] / baseline[key]["min"]
+            change = f"{ratio:>8.2f}x"
+            if ratio > 1 + args.threshold:
+                regressions.append(key)
+                change += " slower"
+        print(
+            f"{key:<46} {result['min'] * 1000:>10.2f} "
+            f"{result['median'] * 1000:>10.2f} {change}"
+        )
+
+    commit, dirty = git_commit()
+    if not args.no_save:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        path = RESULTS_DIR / f"{commit}{'-dirty' if dirty else ''}.json"
+        path.write_text(
+            json.dumps(
+                {
+                    "commit": commit,
+                    "dirty": dirty,
+                    "date": datetime.now(timezone.utc).isoformat(),
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "database": connection.vendor,
+                    "repeat": args.repeat,
+                    "results": results,
+                },
+                indent=2,
+            )
+        )
+        print(f"\nResults saved in {path}")
+    if regressions:
+        print(f"{len(regressions)} regressions over {args.threshold:.0%}:")
+        for key in regressions:
+            print(f"  {key}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
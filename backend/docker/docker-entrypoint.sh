@@ -49,6 +49,7 @@ local     : Start django using a prod ready gunicorn server
 dev       : Start a normal Django development server
 bash      : Start a bash shell
 manage    : Start manage.py
+abb-sync  : Run the background sync of the ABB cloud data
 python    : Run a python command
 shell     : Start a Django Python shell
 celery    : Run celery
@@ -85,8 +86,16 @@ case "$1" in
     local)
         wait_for_postgres
         run_setup_commands_if_configured
+        # the workers share their metrics in this directory, see abb/metrics.py
+        export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/digit-metrics}"
+        rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+        mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
         exec gunicorn --workers=3 -b 0.0.0.0:"${PORT}" -k uvicorn.workers.UvicornWorker digit.config.asgi:application
     ;;
+    abb-sync)
+        wait_for_postgres
+        exec python /digit/backend/src/digit/manage.py abb_sync "${@:2}"
+    ;;
     bash)
         exec /bin/bash "${@:2}"
     ;;
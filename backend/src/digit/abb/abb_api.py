@@ -1,21 +1,38 @@
 import logging
+import os
 import requests
+import threading
+import time
 
+from array import array
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from collections.abc import Sequence
 from copy import copy
-from dataclasses import dataclass
-from datetime import datetime, timedelta, timezone
+from dataclasses import asdict, dataclass, replace
+from datetime import date, datetime, timedelta, timezone
 from enum import Enum
-from functools import wraps
-from typing import Optional
+from functools import cached_property, wraps
+from itertools import chain, islice, repeat
+from operator import itemgetter
+from typing import Iterable, Iterator, Optional
 
-from . import models
+import numpy as np
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q, Sum
+from django.db.models.functions import TruncDate
+from requests.adapters import HTTPAdapter
+
+from . import cache, metrics, models, profiling, resilience
+from .json_stream import JsonStream
 
 
 logger = logging.getLogger(__name__)
 
 
-API_URL = "https://api.conditionmonitoring.motion.abb.com"
+API_URL = settings.ABB_API_URL
 
 HEADERS = {
     "Accept": "text/plain",
@@ -63,6 +80,155 @@ MEASUREMENT_TYPES = {
 FMT_DT = "%Y-%m-%dT%H:%M:%S"
 FMT_POINT_DT = f"{FMT_DT}%z"
 
+# max number of rows written per query in the local store
+STORE_BATCH_SIZE = 1000
+
+# max number of days of daily rollups recomputed per query
+ROLLUP_BATCH_DAYS = 31
+
+# bytes read at a time from the streamed Measurement responses
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# tokens are refreshed when they expire within this margin, so that requests
+# in flight never use an expired one
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
+
+class RateLimiter:
+    """
+    token bucket shared by threads: allows rate calls per second on average
+    with bursts of at most burst calls, acquire() sleeps until a call is allowed
+    """
+
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._last) * self.rate
+            )
+            self._last = now
+            # the call is booked now, waiting callers queue behind it
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class AbbSession(requests.Session):
+    """
+    requests.Session with a bounded pool of keep-alive connections to the ABB
+    cloud and a default timeout applied to every request, optionally rate
+    limited. The idempotent requests failing transiently are retried and the
+    requests made for an account go through its circuit breaker, see
+    abb.resilience.
+    """
+
+    def __init__(
+        self,
+        pool_size: int,
+        timeout: tuple[float, float],
+        rate_limiter: RateLimiter = None,
+    ) -> None:
+        super().__init__()
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        breaker = resilience.get_current_breaker()
+        retries = 0
+        if method.upper() in resilience.IDEMPOTENT_METHODS:
+            retries = settings.ABB_API_RETRIES
+        for attempt in range(retries + 1):
+            if breaker:
+                breaker.check()
+            try:
+                rsp = self._send(method, url, **kwargs)
+            except resilience.TRANSIENT_ERRORS as e:
+                if breaker:
+                    breaker.record_failure()
+                if attempt == retries:
+                    raise
+                error = e
+            else:
+                if not resilience.is_retryable_status(rsp.status_code):
+                    if breaker:
+                        breaker.record_success()
+                    return rsp
+                if breaker:
+                    breaker.record_failure()
+                if attempt == retries:
+                    return rsp
+                error = f"status {rsp.status_code}"
+                rsp.close()
+            delay = resilience.get_backoff(attempt)
+            logger.warning("Retrying %s %s in %.2fs: %s", method, url, delay, error)
+            time.sleep(delay)
+
+    def _send(self, method, url, **kwargs):
+        """make a single attempt of a request, recording it"""
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+        start = time.perf_counter()
+        rsp = None
+        try:
+            rsp = super().request(method, url, **kwargs)
+            return rsp
+        finally:
+            duration = time.perf_counter() - start
+            status = size = None
+            if rsp is not None:
+                status = rsp.status_code
+                if kwargs.get("stream"):
+                    size = rsp.headers.get("Content-Length")
+                    size = size and int(size)
+                else:
+                    size = len(rsp.content)
+            profiling.record_call(
+                method, rsp.url if rsp is not None else url, status, duration, size
+            )
+            metrics.observe_call(status, duration, size)
+
+
+_session: Optional[AbbSession] = None
+_session_pid: Optional[int] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> AbbSession:
+    """
+    return the HTTP session shared by all the threads of the current process.
+    A new one is created after a fork, connections can't be shared by workers
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                _session = AbbSession(
+                    pool_size=settings.ABB_API_POOL_SIZE,
+                    timeout=(
+                        settings.ABB_API_CONNECT_TIMEOUT,
+                        settings.ABB_API_READ_TIMEOUT,
+                    ),
+                )
+                _session_pid = pid
+    return _session
+
+
+class NoMeasurementsError(ValueError):
+    """the local store has no measurements of the asset in the range"""
+
 
 class MotionAssetTypeId(Enum):
     MOTIONASSET = 1
@@ -95,10 +261,58 @@ class MeasurementPoint:
     timestamp: datetime  # "2020-06-11T08:34:38+00:00"
 
 
+class MeasurementSeries(Sequence):
+    """
+    Compact series of measurement points: values in an array('d') and
+    timestamps as int64 epoch seconds in an array('q'), 16 bytes per point.
+    It reads as a sequence of MeasurementPoint with UTC datetimes, built on
+    access.
+    """
+
+    __slots__ = ("timestamps", "values")
+
+    def __init__(
+        self, timestamps: Iterable[int] = (), values: Iterable[float] = ()
+    ) -> None:
+        self.timestamps = array("q", timestamps)
+        self.values = array("d", values)
+
+    def append(self, timestamp: datetime, value: float) -> None:
+        self.timestamps.append(int(timestamp.timestamp()))
+        self.values.append(value)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return MeasurementSeries(self.timestamps[index], self.values[index])
+        return MeasurementPoint(
+            value=self.values[index],
+            timestamp=datetime.fromtimestamp(self.timestamps[index], timezone.utc),
+        )
+
+    def __iter__(self) -> Iterator[MeasurementPoint]:
+        for timestamp, value in zip(self.timestamps, self.values):
+            yield MeasurementPoint(
+                value=value, timestamp=datetime.fromtimestamp(timestamp, timezone.utc)
+            )
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, MeasurementSeries):
+            return self.timestamps == other.timestamps and self.values == other.values
+        if isinstance(other, Sequence):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"MeasurementSeries({len(self)} points)"
+
+
 @dataclass
 class Measurement:
     info: MeasurementInfo
-    data: list[MeasurementPoint]
+    data: Sequence[MeasurementPoint]  # a MeasurementSeries when parsed or loaded
 
 
 @dataclass
@@ -136,16 +350,90 @@ class AssetReport:
     end_date: str
     measurements: list[CombinedPoint]
     report: ReportData
+    # computed from the stored measurements while the ABB cloud is failing
+    stale: bool = False
+
+
+@dataclass
+class AssetReportHeader:
+    """AssetReport without its measurements, sent before them when streamed"""
+
+    asset: models.MotionAsset
+    start_date: str
+    end_date: str
+    report: ReportData
+    stale: bool = False
+
+
+@dataclass(frozen=True)
+class DataVersion:
+    """
+    version of the stored data a response is computed from: key changes
+    whenever the data does, modified is the time of its last change
+    """
+
+    key: str
+    modified: Optional[datetime] = None
+
+
+@dataclass(frozen=True)
+class FetchWindow:
+    """a request of the measurement types in [start, end] to the ABB cloud"""
 
+    start: datetime
+    end: datetime
+    type_ids: tuple[int, ...]
 
-def update_token_if_needed(account) -> str:
-    """get token from ABB API"""
-    if not account.is_token_valid():
-        now = datetime.now(timezone.utc)
-        rsp = get_access_token(account.username, account.password)
-        account.token = rsp["accessToken"]
-        account.token_expiration = now + timedelta(seconds=rsp["expiration"])
-        account.save()
+
+@dataclass
+class FetchPlan:
+    """
+    the windows to fetch to store the measurements of an asset in a range:
+    the backfill ones precede the stored measurements, the forward ones
+    follow them. Once all of them are stored, the measurements of the asset
+    are stored without gaps since synced_from.
+    """
+
+    last_stored: dict[int, datetime]
+    backfill: list[FetchWindow]
+    forward: list[FetchWindow]
+    synced_from: datetime
+
+
+_token_locks: dict[int, threading.Lock] = {}
+_token_locks_lock = threading.Lock()
+
+
+def _get_token_lock(account_id: int) -> threading.Lock:
+    with _token_locks_lock:
+        return _token_locks.setdefault(account_id, threading.Lock())
+
+
+def update_token_if_needed(
+    account, session: requests.Session = None, rejected_token: str = None
+) -> str:
+    """
+    Get a new token from ABB API if the current one is about to expire or has
+    been rejected. Only one caller per account refreshes it: threads of the
+    same process wait on a lock, other processes on the account row lock, then
+    they all reuse the token stored by the first one.
+    """
+    if account.token != rejected_token and account.is_token_valid(TOKEN_REFRESH_MARGIN):
+        return account.token
+    with _get_token_lock(account.pk), transaction.atomic():
+        stored = models.Account.objects.select_for_update().get(pk=account.pk)
+        if stored.token == rejected_token or not stored.is_token_valid(
+            TOKEN_REFRESH_MARGIN
+        ):
+            now = datetime.now(timezone.utc)
+            rsp = get_access_token(account.username, account.password, session)
+            metrics.TOKEN_REFRESHES.inc()
+            stored.token = rsp["accessToken"]
+            stored.token_expiration = now + timedelta(seconds=rsp["expiration"])
+            stored.save(update_fields=["token", "token_expiration"])
+    account.token = stored.token
+    account.token_expiration = stored.token_expiration
+    return account.token
 
 
 def token_required(method):
@@ -153,26 +441,33 @@ def token_required(method):
 
     @wraps(method)
     def wrapper(self, *args, **kwargs):
-        update_token_if_needed(self.account)
-        try:
-            return method(self, *args, **kwargs)
-        except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 401:
-                update_token_if_needed(self.account)
+        with resilience.account_calls(self.account.pk):
+            token = update_token_if_needed(self.account, self.session)
+            try:
                 return method(self, *args, **kwargs)
-            raise
+            except requests.exceptions.HTTPError as e:
+                if e.response.status_code == 401:
+                    metrics.TOKEN_RETRIES.inc()
+                    update_token_if_needed(self.account, self.session, token)
+                    return method(self, *args, **kwargs)
+                raise
 
     return wrapper
 
 
 class AbbApi:
-    def __init__(self, account: models.Account) -> None:
+    def __init__(
+        self, account: models.Account, session: requests.Session = None
+    ) -> None:
         self.account: models.Account = account
+        self.session: requests.Session = session or get_session()
 
     @token_required
     def get_sites(self, force_reload: bool = False) -> list[models.Site]:
         if force_reload:
-            return get_sites(self.account)
+            sites = get_sites(self.account, self.session)
+            cache.invalidate(self.account)
+            return sites
         return models.Site.objects.filter(accounts__in=[self.account]).order_by(
             "siteName"
         )
@@ -183,27 +478,247 @@ class AbbApi:
     ) -> list[models.MotionAsset]:
         """get list of motion assets"""
         if force_reload:
-            return get_motionassets(self.account, siteId)
-        return models.MotionAsset.objects.filter(site__siteId=siteId)
+            assets = get_motionassets(self.account, siteId, session=self.session)
+            cache.invalidate(self.account)
+            return assets
+        # the site is serialized with each asset
+        return models.MotionAsset.objects.filter(
+            site__siteId=siteId, site__accounts=self.account
+        ).select_related("site")
 
     @token_required
-    def get_subscriptions(self) -> list[Subscription]:
-        return get_all_subscriptions(self.account)
+    def get_subscriptions(self, force_reload: bool = False) -> list[Subscription]:
+        """
+        the subscriptions of the account, read from the cache, where the
+        background sync refreshes them, and fetched if missing or force_reload
+        """
+        if force_reload:
+            subscriptions = get_all_subscriptions(self.account, self.session)
+            cache.store(self.account, "subscriptions", {}, subscriptions)
+            return subscriptions
+        return cache.get_or_set(
+            self.account,
+            "subscriptions",
+            {},
+            lambda: get_all_subscriptions(self.account, self.session),
+        )
 
     @token_required
     def get_asset_measurements(self, assetId: str) -> AssetMeasurements:
-        return get_asset_measurements(self.account, assetId)
+        return get_asset_measurements(self.account, assetId, session=self.session)
+
+    @token_required
+    def sync_asset_measurements(
+        self, assetId: str, from_date: datetime = None, to_date: datetime = None
+    ) -> int:
+        asset = get_account_asset(self.account, assetId)
+        return self._sync_asset_measurements(asset, from_date, to_date)
+
+    def _sync_asset_measurements(
+        self,
+        asset: models.MotionAsset,
+        from_date: datetime = None,
+        to_date: datetime = None,
+    ) -> int:
+        """store the new measurements of the asset, invalidating the cache"""
+        stored = sync_asset_measurements(
+            self.account, asset, from_date, to_date, self.session
+        )
+        if stored:
+            cache.invalidate(self.account)
+        return stored
+
+    def _sync_or_stale(
+        self, asset: models.MotionAsset, from_date: datetime, to_date: datetime
+    ) -> bool:
+        """
+        store the new measurements of the asset in [from_date, to_date). If the
+        ABB cloud is failing and some are already stored, they can be served
+        stale: returns True and fetches the new ones in the background
+        """
+        try:
+            self._sync_asset_measurements(asset, from_date, to_date)
+            return False
+        except requests.RequestException as e:
+            if not resilience.is_upstream_failure(e) or not has_stored_measurements(
+                asset, from_date, to_date
+            ):
+                raise
+            logger.warning("Serving stale measurements of asset %s: %s", asset.pk, e)
+            refresh_in_background(self.account, asset, from_date, to_date)
+            return True
+
+    @token_required
+    def stream_asset_report(
+        self,
+        assetId: str,
+        month: int = None,
+        year: int = None,
+        force_reload: bool = False,
+        from_date: datetime = None,
+        to_date: datetime = None,
+    ) -> tuple[AssetReportHeader, Iterator[CombinedPoint]]:
+        """
+        Like get_asset_report, or get_asset_range_report if from_date and
+        to_date are given, but the measurements are merged lazily while they
+        are consumed. The report is always computed from the local store.
+        """
+        asset = get_account_asset(self.account, assetId)
+        from_date, to_date, stale = self._sync_report_range(
+            asset, month, year, force_reload, from_date, to_date
+        )
+        header, points = stream_stored_asset_report(asset, from_date, to_date)
+        header.stale = stale
+        return header, points
+
+    @token_required
+    def get_asset_summary(
+        self,
+        assetId: str,
+        month: int = None,
+        year: int = None,
+        force_reload: bool = False,
+        from_date: datetime = None,
+        to_date: datetime = None,
+    ) -> AssetReportHeader:
+        """
+        Like stream_asset_report, but without the measurements: the report is
+        computed from the daily rollups, so a long range costs as few queries
+        as a month.
+        """
+        asset = get_account_asset(self.account, assetId)
+        from_date, to_date, stale = self._sync_report_range(
+            asset, month, year, force_reload, from_date, to_date
+        )
+        header = get_rollup_report(asset, from_date, to_date)
+        header.stale = stale
+        return header
+
+    def _sync_report_range(
+        self,
+        asset: models.MotionAsset,
+        month: int = None,
+        year: int = None,
+        force_reload: bool = False,
+        from_date: datetime = None,
+        to_date: datetime = None,
+    ) -> tuple[datetime, datetime, bool]:
+        """
+        the range of a report, from_date and to_date or the month, whose
+        measurements are fetched first if they aren't stored yet, and whether
+        the stored ones are stale
+        """
+        if from_date and to_date:
+            synced = is_asset_synced(asset, to_date, from_date)
+        else:
+            from_date, to_date = get_month_range(*get_report_month(month, year))
+            synced = is_asset_synced(asset, to_date, from_date)
+        stale = False
+        if force_reload or not synced:
+            stale = self._sync_or_stale(asset, from_date, to_date)
+        return from_date, to_date, stale
 
     @token_required
-    def get_asset_report(self, assetId: str) -> AssetReport:
-        orig_data = get_asset_measurements(self.account, assetId)
-        if not orig_data.measurements:
-            raise ValueError("No measurements found")
-        report_data = elaborate_report_data(orig_data)
-        return report_data
+    def get_asset_range_report(
+        self,
+        assetId: str,
+        from_date: datetime,
+        to_date: datetime,
+        force_reload: bool = False,
+    ) -> AssetReport:
+        """
+        Return the report of the asset for the measurements in [from_date,
+        to_date), computed from the local store. The missing measurements are
+        fetched from the ABB cloud first, a long range in parallel windows.
+        """
+        asset = get_account_asset(self.account, assetId)
+        stale = False
+        if force_reload or not is_asset_synced(asset, to_date, from_date):
+            stale = self._sync_or_stale(asset, from_date, to_date)
+        report = get_stored_asset_report(asset, from_date, to_date)
+        report.stale = stale
+        return report
+
+    @token_required
+    def get_asset_report(
+        self,
+        assetId: str,
+        month: int = None,
+        year: int = None,
+        force_reload: bool = False,
+    ) -> AssetReport:
+        """
+        Return the report of the asset for the given month, by default the last
+        complete one. Reports of closed months are computed once and then read
+        from their MotionAssetReport snapshot, unless force_reload is set.
+        Otherwise only the new measurements are fetched from the ABB cloud and
+        the report is computed from the local store.
+        """
+        asset = get_account_asset(self.account, assetId)
+        month, year = get_report_month(month, year)
+        if not force_reload:
+            report = load_report_snapshot(asset, month, year)
+            if report:
+                return report
+        from_date, to_date = get_month_range(month, year)
+        stale = False
+        if force_reload or not is_asset_synced(asset, to_date, from_date):
+            stale = self._sync_or_stale(asset, from_date, to_date)
+        report = get_stored_asset_report(asset, from_date, to_date)
+        report.stale = stale
+        # a stale report may lack measurements, it's computed again next time
+        if is_month_closed(month, year) and not stale:
+            save_report_snapshot(report, month, year)
+        return report
+
+
+def get_last_complete_month() -> tuple[datetime, datetime]:
+    """return the (start, end) UTC datetimes of the last complete month"""
+    end = datetime.now(timezone.utc).replace(
+        day=1, hour=0, minute=0, second=0, microsecond=0
+    )
+    start = (end - timedelta(days=1)).replace(day=1)
+    return start, end
+
 
+def get_month_range(month: int, year: int) -> tuple[datetime, datetime]:
+    """return the (start, end) UTC datetimes of the month"""
+    start = datetime(year, month, 1, tzinfo=timezone.utc)
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start, end
 
-def get_access_token(username: str, password: str) -> dict:
+
+def get_date_range(start: date, end: date) -> tuple[datetime, datetime]:
+    """return the (start, end) UTC datetimes of the days from start to end included"""
+    return (
+        datetime.combine(start, datetime.min.time(), timezone.utc),
+        datetime.combine(end + timedelta(days=1), datetime.min.time(), timezone.utc),
+    )
+
+
+def get_report_month(month: int = None, year: int = None) -> tuple[int, int]:
+    """return (month, year), the last complete month if not given"""
+    if month and year:
+        return month, year
+    start, _ = get_last_complete_month()
+    return start.month, start.year
+
+
+def is_month_closed(month: int, year: int) -> bool:
+    """closed months can't get new measurements, so their reports never change"""
+    _, end = get_month_range(month, year)
+    return end <= datetime.now(timezone.utc)
+
+
+def parse_timestamp(value: str) -> datetime:
+    """parse a measurement timestamp, e.g. "2020-06-11T08:34:38+00:00" """
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+@metrics.upstream_function
+def get_access_token(
+    username: str, password: str, session: requests.Session = None
+) -> dict:
     """
     login user to get the jwt token to use in api requests
     "payload": {
@@ -214,7 +729,8 @@ def get_access_token(username: str, password: str) -> dict:
     "code": 0,
     "message": "OK"
     """
-    rsp = requests.post(
+    session = session or get_session()
+    rsp = session.post(
         f"{API_URL}/Auth/ConnectAccount",
         headers=HEADERS,
         json={
@@ -226,11 +742,13 @@ def get_access_token(username: str, password: str) -> dict:
     return rsp.json()["payload"]
 
 
+@metrics.upstream_function
 def get_motionassets(
     account: models.Account,
     siteId: str = None,
     baseApi: int = 1,
     assetTypeId: int = MotionAssetTypeId.MOTIONASSET.value,
+    session: requests.Session = None,
 ) -> list[models.MotionAsset]:
     """
     Get the list of installed base data for the given assetType and assigned
@@ -287,31 +805,96 @@ def get_motionassets(
       ...,
       ]
     """
+    session = session or get_session()
     headers = {"Authorization": f"Bearer {account.token}", **HEADERS}
     if siteId:
-        rsp = requests.get(
+        rsp = session.get(
             f"{API_URL}/InstalledBase/Site/{baseApi}/{siteId}",
             headers=headers,
         )
     else:
-        rsp = requests.get(
+        rsp = session.get(
             f"{API_URL}/InstalledBase/Type/{assetTypeId}",
             headers=headers,
         )
     rsp.raise_for_status()
-    data = rsp.json().get("payload", [])
+    return save_motionassets(rsp.json().get("payload", []))
+
+
+def save_motionassets(data: list[dict]) -> list[models.MotionAsset]:
+    """
+    store the motion assets returned by the InstalledBase endpoints, creating
+    their missing sites, with a constant number of queries
+    """
+    sites = {}
     assets = []
+    fields = {"site"}
     for raw_asset in data:
         info = copy(raw_asset["baseInfo"])
-        site, _ = models.Site.objects.get_or_create(
-            siteId=info.pop("siteId"), siteName=info.pop("siteName")
+        siteId = info.pop("siteId")
+        site = sites.setdefault(
+            siteId, models.Site(siteId=siteId, siteName=info.pop("siteName"))
+        )
+        fields.update(info)
+        assets.append(models.MotionAsset(site=site, **info))
+    fields.discard("motionAssetId")
+    with transaction.atomic():
+        # existing sites are updated only by the Site endpoint
+        models.Site.objects.bulk_create(
+            sites.values(), batch_size=STORE_BATCH_SIZE, ignore_conflicts=True
         )
-        asset, _ = models.MotionAsset.objects.update_or_create(site=site, **info)
-        assets.append(asset)
+        bulk_upsert(models.MotionAsset, assets, fields)
     return assets
 
 
-def get_all_subscriptions(account: models.Account) -> list[Subscription]:
+def bulk_upsert(model, objs: list, fields: Iterable[str]) -> None:
+    """
+    insert or update by primary key the objs, with a constant number of
+    queries: one to read the existing rows, then a batched insert of the new
+    ones and a batched update of the changed ones, whose auto_now fields
+    are set to now.
+    Django 4.0 bulk_create can't update the rows on conflict.
+    """
+    objs = list({obj.pk: obj for obj in objs}.values())
+    fields = [model._meta.get_field(name) for name in fields]
+    existing = {
+        pk: values
+        for pk, *values in model.objects.filter(
+            pk__in=[obj.pk for obj in objs]
+        ).values_list("pk", *(field.attname for field in fields))
+    }
+    model.objects.bulk_create(
+        [obj for obj in objs if obj.pk not in existing],
+        batch_size=STORE_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    to_update = [
+        obj
+        for obj in objs
+        if obj.pk in existing
+        and existing[obj.pk]
+        != [field.to_python(getattr(obj, field.attname)) for field in fields]
+    ]
+    if to_update and fields:
+        auto_now = [
+            field
+            for field in model._meta.concrete_fields
+            if getattr(field, "auto_now", False)
+        ]
+        for obj in to_update:
+            for field in auto_now:
+                field.pre_save(obj, add=False)
+        model.objects.bulk_update(
+            to_update,
+            [field.name for field in fields + auto_now],
+            batch_size=STORE_BATCH_SIZE,
+        )
+
+
+@metrics.upstream_function
+def get_all_subscriptions(
+    account: models.Account, session: requests.Session = None
+) -> list[Subscription]:
     """
     return list of subscriptions
     {
@@ -334,7 +917,8 @@ def get_all_subscriptions(account: models.Account) -> list[Subscription]:
         ]
       },
     """
-    rsp = requests.get(
+    session = session or get_session()
+    rsp = session.get(
         f"{API_URL}/Subscription/All",
         headers={"Authorization": f"Bearer {account.token}", **HEADERS},
     )
@@ -343,7 +927,10 @@ def get_all_subscriptions(account: models.Account) -> list[Subscription]:
     return [Subscription(**subscription) for subscription in subscriptions]
 
 
-def get_sites(account: models.Account) -> list[models.Site]:
+@metrics.upstream_function
+def get_sites(
+    account: models.Account, session: requests.Session = None
+) -> list[models.Site]:
     """
     {
     "payload": [
@@ -360,24 +947,42 @@ def get_sites(account: models.Account) -> list[models.Site]:
       ...
       ]
     """
-    rsp = requests.get(
+    session = session or get_session()
+    rsp = session.get(
         f"{API_URL}/Site",
         headers={"Authorization": f"Bearer {account.token}", **HEADERS},
     )
-    data = rsp.json().get("payload", [])
-    sites = []
-    for raw_site in data:
-        site, _ = models.Site.objects.update_or_create(**raw_site)
-        site.accounts.add(account)
-        sites.append(site)
+    rsp.raise_for_status()
+    return save_sites(account, rsp.json().get("payload", []))
+
+
+def save_sites(account: models.Account, data: list[dict]) -> list[models.Site]:
+    """
+    store the sites returned by the Site endpoint and link them to account,
+    with a constant number of queries
+    """
+    sites = [models.Site(**raw_site) for raw_site in data]
+    fields = {key for raw_site in data for key in raw_site}
+    fields.discard("siteId")
+    SiteAccount = models.Site.accounts.through
+    with transaction.atomic():
+        bulk_upsert(models.Site, sites, fields)
+        SiteAccount.objects.bulk_create(
+            [SiteAccount(site_id=site.pk, account_id=account.pk) for site in sites],
+            batch_size=STORE_BATCH_SIZE,
+            ignore_conflicts=True,
+        )
     return sites
 
 
+@metrics.upstream_function
 def get_asset_measurements(
     account: models.Account,
     assetId: str,
     from_date: datetime = None,
     to_date: datetime = None,
+    measurement_types: list[int] = None,
+    session: requests.Session = None,
 ) -> AssetMeasurements:
     """
     get measurement saved from the motionasset.
@@ -414,47 +1019,783 @@ def get_asset_measurements(
       ]
     }
     """
-    # set last complete available month as default
-    if not to_date:
-        to_date = datetime.now()
-        to_date = to_date - timedelta(days=to_date.day)
-        to_date.replace(hour=0, minute=0, second=0, microsecond=0)
-    if not from_date:
-        from_date = to_date - timedelta(days=to_date.day - 1)
-        from_date.replace(hour=0, minute=0, second=0, microsecond=0)
     # get data
-    rsp = requests.get(
+    session = session or get_session()
+    rsp = session.get(
         f"{API_URL}/Measurement",
         headers={"Authorization": f"Bearer {account.token}", **HEADERS},
-        params={
-            "motionAssetId": assetId,
-            "measurementTypeIds": ",".join(map(str, MEASUREMENT_TYPES.values())),
-            "from": from_date.strftime(FMT_DT),
-            "to": to_date.strftime(FMT_DT),
-            # "interval": # 0, 5, 15, 30, 60, 180, 360, 720 - not applicable
-        },
+        params=get_measurement_params(assetId, from_date, to_date, measurement_types),
     )
     rsp.raise_for_status()
-    data = rsp.json().get("payload", [None])[0]
+    return parse_asset_measurements(rsp.json())
+
+
+@metrics.upstream_function
+def stream_asset_measurements(
+    account: models.Account,
+    assetId: str,
+    from_date: datetime = None,
+    to_date: datetime = None,
+    measurement_types: list[int] = None,
+    session: requests.Session = None,
+) -> Iterator[tuple[MeasurementInfo, MeasurementPoint]]:
+    """
+    like get_asset_measurements, but the points are parsed while the body is
+    downloaded and yielded one at a time with the info of their measurement,
+    so memory doesn't grow with the size of the response
+    """
+    session = session or get_session()
+    rsp = session.get(
+        f"{API_URL}/Measurement",
+        headers={"Authorization": f"Bearer {account.token}", **HEADERS},
+        params=get_measurement_params(assetId, from_date, to_date, measurement_types),
+        stream=True,
+    )
+    with rsp:
+        rsp.raise_for_status()
+        yield from iter_measurement_points(rsp.iter_content(STREAM_CHUNK_SIZE))
+
+
+def iter_measurement_points(
+    chunks: Iterable[bytes],
+) -> Iterator[tuple[MeasurementInfo, MeasurementPoint]]:
+    """
+    parse incrementally the body of the Measurement endpoint, yielding its
+    points in order. The baseInfo of a measurement must precede its dataPoints,
+    as in the responses of the ABB cloud.
+    """
+    stream = JsonStream(chunks)
+    for key in stream.iter_object():
+        if key != "payload":
+            stream.skip_value()
+            continue
+        for index, _ in enumerate(stream.iter_array()):
+            # only the first asset is parsed, as in parse_asset_measurements
+            if index:
+                stream.skip_value()
+                continue
+            for key in stream.iter_object():
+                if key != "measurements":
+                    stream.skip_value()
+                    continue
+                for _ in stream.iter_array():
+                    info = None
+                    for key in stream.iter_object():
+                        if key == "baseInfo":
+                            info = MeasurementInfo(**stream.read_value())
+                        elif key == "dataPoints":
+                            if info is None:
+                                raise ValueError("dataPoints before baseInfo")
+                            for _ in stream.iter_array():
+                                point = stream.read_value()
+                                yield info, MeasurementPoint(
+                                    timestamp=parse_timestamp(point["timestamp"]),
+                                    value=float(point["measurementValue"]),
+                                )
+                        else:
+                            stream.skip_value()
+
+
+def get_measurement_params(
+    assetId: str,
+    from_date: datetime = None,
+    to_date: datetime = None,
+    measurement_types: list[int] = None,
+) -> dict:
+    """query params of the Measurement endpoint"""
+    # set last complete available month as default
+    if not from_date or not to_date:
+        month_start, month_end = get_last_complete_month()
+        from_date = from_date or month_start
+        to_date = to_date or month_end
+    if not measurement_types:
+        measurement_types = MEASUREMENT_TYPES.values()
+    return {
+        "motionAssetId": assetId,
+        "measurementTypeIds": ",".join(map(str, measurement_types)),
+        "from": from_date.strftime(FMT_DT),
+        "to": to_date.strftime(FMT_DT),
+        # "interval": # 0, 5, 15, 30, 60, 180, 360, 720 - not applicable
+    }
+
+
+def parse_asset_measurements(body: dict) -> Optional[AssetMeasurements]:
+    """parse the body returned by the Measurement endpoint"""
+    data = body.get("payload", [None])[0]
     if not data:
         return None
     # parse data
     measurements = []
     for measure in data["measurements"]:
         info = MeasurementInfo(**measure["baseInfo"])
-        values = []
+        values = MeasurementSeries()
         for point in measure["dataPoints"]:
             values.append(
-                MeasurementPoint(
-                    # timestamp=datetime.strptime(point["timestamp"], FMT_POINT_DT),
-                    timestamp=point["timestamp"],
-                    value=float(point["measurementValue"]),
-                )
+                parse_timestamp(point["timestamp"]), float(point["measurementValue"])
             )
         measurements.append(Measurement(info, values))
     return AssetMeasurements(**data["baseInfo"], measurements=measurements)
 
 
+def sync_asset_measurements(
+    account: models.Account,
+    asset: models.MotionAsset,
+    from_date: datetime = None,
+    to_date: datetime = None,
+    session: requests.Session = None,
+) -> int:
+    """
+    Store locally the measurements of the asset between from_date and to_date,
+    asking the ABB cloud only for the points newer than the last timestamp
+    already stored for each measurement type and, if from_date precedes the
+    stored ones, for the points before them.
+    Return the number of new points stored.
+    """
+    plan = plan_measurement_fetch(asset, from_date, to_date)
+    stored = store_measurement_windows(account, asset, plan.backfill, {}, session)
+    stored += store_measurement_windows(
+        account, asset, plan.forward, plan.last_stored, session
+    )
+    set_synced_from(asset, plan.synced_from)
+    return stored
+
+
+def store_measurement_windows(
+    account: models.Account,
+    asset: models.MotionAsset,
+    windows: list[FetchWindow],
+    last_stored: dict[int, datetime],
+    session: requests.Session = None,
+) -> int:
+    """
+    store the points of the windows newer than the last stored ones. A single
+    window is streamed, more are fetched in parallel and stored in order.
+    """
+    if not windows:
+        return 0
+    if len(windows) == 1:
+        window = windows[0]
+        points = stream_asset_measurements(
+            account,
+            asset.motionAssetId,
+            window.start,
+            window.end,
+            list(window.type_ids),
+            session,
+        )
+    else:
+        points = stitch_measurements(
+            fetch_measurement_windows(account, asset.motionAssetId, windows, session)
+        )
+    return save_measurement_points(asset, points, last_stored)
+
+
+def plan_measurement_fetch(
+    asset: models.MotionAsset, from_date: datetime = None, to_date: datetime = None
+) -> FetchPlan:
+    """the windows to fetch to store the measurements of the asset in the range"""
+    if not from_date or not to_date:
+        month_start, month_end = get_last_complete_month()
+        from_date = from_date or month_start
+        to_date = to_date or month_end
+    last_stored, pending = get_measurements_to_fetch(asset, from_date, to_date)
+    forward = sorted(
+        (
+            window
+            for since, type_ids in pending.items()
+            for window in split_range(since, to_date, type_ids)
+        ),
+        key=lambda window: window.start,
+    )
+    backfill = []
+    if not asset.synced_from or asset.synced_from > from_date:
+        first = models.MotionAssetMeasurement.objects.filter(asset=asset).aggregate(
+            first=Min("timestamp")
+        )["first"]
+        # the gap up to the first stored point is fetched, so that the stored
+        # measurements stay contiguous
+        if first and first - timedelta(seconds=1) >= from_date:
+            backfill = split_range(
+                from_date, first - timedelta(seconds=1), MEASUREMENT_TYPES.values()
+            )
+    if any(last < from_date for last in last_stored.values()):
+        # the measurements before from_date are followed by a gap
+        synced_from = from_date
+    else:
+        synced_from = min(filter(None, (asset.synced_from, from_date)))
+    return FetchPlan(last_stored, backfill, forward, synced_from)
+
+
+def split_range(
+    start: datetime, end: datetime, type_ids: Iterable[int]
+) -> list[FetchWindow]:
+    """
+    split [start, end] in consecutive windows of settings.ABB_FETCH_WINDOW_DAYS,
+    a second apart as the timestamps of the measurements
+    """
+    type_ids = tuple(type_ids)
+    step = timedelta(days=settings.ABB_FETCH_WINDOW_DAYS)
+    windows = []
+    while start + step < end:
+        windows.append(
+            FetchWindow(start, start + step - timedelta(seconds=1), type_ids)
+        )
+        start += step
+    windows.append(FetchWindow(start, end, type_ids))
+    return windows
+
+
+def fetch_window(
+    account: models.Account,
+    assetId: str,
+    window: FetchWindow,
+    session: requests.Session = None,
+) -> Optional[AssetMeasurements]:
+    """
+    fetch the measurements of a window, the session retries it on its own
+    when it fails transiently
+    """
+    return get_asset_measurements(
+        account,
+        assetId,
+        window.start,
+        window.end,
+        list(window.type_ids),
+        session,
+    )
+
+
+def fetch_measurement_windows(
+    account: models.Account,
+    assetId: str,
+    windows: list[FetchWindow],
+    session: requests.Session = None,
+) -> Iterator[Optional[AssetMeasurements]]:
+    """
+    fetch the windows in parallel, at most settings.ABB_API_MAX_CONCURRENCY at
+    a time, yielding their measurements in the order of the windows
+    """
+    pool = ThreadPoolExecutor(
+        max_workers=min(len(windows), settings.ABB_API_MAX_CONCURRENCY)
+    )
+    tasks = [
+        profiling.run_in_context(fetch_window, account, assetId, window, session)
+        for window in windows
+    ]
+    try:
+        yield from pool.map(lambda task: task(), tasks)
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+def stitch_measurements(
+    windows: Iterable[Optional[AssetMeasurements]],
+) -> Iterator[tuple[MeasurementInfo, MeasurementPoint]]:
+    """
+    the points of consecutive windows, in timestamp order for each measurement
+    type, without the ones repeated at their boundaries
+    """
+    last = {}
+    for data in windows:
+        if not data:
+            continue
+        for measure in data.measurements:
+            type_id = measure.info.measurementTypeId
+            for point in measure.data:
+                if type_id in last and point.timestamp <= last[type_id]:
+                    continue
+                last[type_id] = point.timestamp
+                yield measure.info, point
+
+
+def get_account_asset(account: models.Account, assetId: str) -> models.MotionAsset:
+    """
+    the asset, with its site, if the site is one of the account: the reports
+    are served from the local store, which holds the assets of every account
+    """
+    return models.MotionAsset.objects.select_related("site").get(
+        motionAssetId=assetId, site__accounts=account
+    )
+
+
+def set_synced_from(asset: models.MotionAsset, synced_from: datetime) -> None:
+    """record that the measurements of the asset are stored since synced_from"""
+    if asset.synced_from != synced_from:
+        models.MotionAsset.objects.filter(pk=asset.pk).update(synced_from=synced_from)
+        asset.synced_from = synced_from
+
+
+def is_asset_synced(
+    asset: models.MotionAsset, to_date: datetime, from_date: datetime = None
+) -> bool:
+    """
+    the measurements of the asset up to to_date have been stored by the
+    background sync, recently enough if to_date is still to come, and since
+    from_date if given
+    """
+    if not asset.synced_at:
+        return False
+    if from_date and (not asset.synced_from or asset.synced_from > from_date):
+        return False
+    max_age = timedelta(seconds=settings.ABB_SYNC_MAX_AGE)
+    return asset.synced_at >= min(to_date, datetime.now(timezone.utc) - max_age)
+
+
+def get_sites_version(account: models.Account) -> DataVersion:
+    """version of the sites of the account in the local store"""
+    return _queryset_version(
+        "sites", models.Site.objects.filter(accounts=account), "updated_at"
+    )
+
+
+def get_motionassets_version(siteId: str) -> DataVersion:
+    """version of the motion assets of the site in the local store"""
+    return _queryset_version(
+        "assets",
+        models.MotionAsset.objects.filter(site__siteId=siteId),
+        "updated_at",
+        "site__updated_at",
+    )
+
+
+def _queryset_version(name: str, queryset, *fields: str) -> DataVersion:
+    """version of the rows of queryset: their number and last update"""
+    values = queryset.aggregate(Count("pk"), *(Max(field) for field in fields))
+    count = values.pop("pk__count")
+    modified = max(filter(None, values.values()), default=None)
+    return DataVersion(
+        f"{name}-{count}-{modified.timestamp() if modified else ''}", modified
+    )
+
+
+def get_report_version(
+    asset: models.MotionAsset, month: int = None, year: int = None
+) -> Optional[DataVersion]:
+    """
+    version of the report AbbApi.get_asset_report returns for the asset
+    without asking the ABB cloud, None if it would ask it
+    """
+    month, year = get_report_month(month, year)
+    has_snapshot = models.MotionAssetReport.objects.filter(
+        asset=asset, month=month, year=year
+    ).exists()
+    return _report_version(asset, month, year, has_snapshot)
+
+
+def get_site_reports_version(
+    siteId: str, month: int = None, year: int = None
+) -> Optional[DataVersion]:
+    """version of the reports of all the assets of the site, as get_report_version"""
+    month, year = get_report_month(month, year)
+    assets = models.MotionAsset.objects.filter(site__siteId=siteId).select_related(
+        "site"
+    )
+    snapshots = set(
+        models.MotionAssetReport.objects.filter(
+            asset__site__siteId=siteId, month=month, year=year
+        ).values_list("asset_id", flat=True)
+    )
+    versions = [
+        _report_version(asset, month, year, asset.pk in snapshots)
+        for asset in assets.order_by("pk")
+    ]
+    if None in versions:
+        return None
+    return DataVersion(
+        "-".join(version.key for version in versions),
+        max((version.modified for version in versions), default=None),
+    )
+
+
+def _report_version(
+    asset: models.MotionAsset,
+    month: int,
+    year: int,
+    has_snapshot: bool,
+) -> Optional[DataVersion]:
+    """
+    The report of a month is read from its snapshot if any, otherwise it's
+    computed from the local store if the asset is synced up to its end.
+    Either way it changes only with the asset, its site and its stored
+    measurements: a snapshot is deleted when new points of its month arrive.
+    """
+    if not has_snapshot:
+        from_date, to_date = get_month_range(month, year)
+        if not is_asset_synced(asset, to_date, from_date):
+            return None
+    return _asset_version(asset, f"report-{asset.pk}-{month}-{year}")
+
+
+def get_range_report_version(
+    asset: models.MotionAsset, from_date: datetime, to_date: datetime
+) -> Optional[DataVersion]:
+    """
+    version of the report AbbApi.get_asset_range_report returns for the asset
+    without asking the ABB cloud, None if it would ask it
+    """
+    if not is_asset_synced(asset, to_date, from_date):
+        return None
+    return _asset_version(
+        asset, f"report-{asset.pk}-{from_date.timestamp()}-{to_date.timestamp()}"
+    )
+
+
+def _asset_version(asset: models.MotionAsset, name: str) -> DataVersion:
+    """version of data computed from the asset, its site and its measurements"""
+    modified = asset.updated_at
+    if asset.site:
+        modified = max(modified, asset.site.updated_at)
+    return DataVersion(f"{name}-{modified.timestamp()}", modified)
+
+
+def get_measurements_to_fetch(
+    asset: models.MotionAsset, from_date: datetime = None, to_date: datetime = None
+) -> tuple[dict[int, datetime], dict[datetime, list[int]]]:
+    """
+    return the last timestamp stored for each measurement type of the asset
+    and the measurement types still to fetch grouped by their start date
+    """
+    if not from_date or not to_date:
+        month_start, month_end = get_last_complete_month()
+        from_date = from_date or month_start
+        to_date = to_date or month_end
+    last_stored = dict(
+        models.MotionAssetMeasurement.objects.filter(asset=asset)
+        .values("measurementTypeId")
+        .annotate(last=Max("timestamp"))
+        .values_list("measurementTypeId", "last")
+    )
+    # measurement types stored up to the same timestamp (the usual case)
+    # are fetched together with a single request
+    pending = defaultdict(list)
+    for type_id in MEASUREMENT_TYPES.values():
+        last = last_stored.get(type_id)
+        if not last:
+            pending[from_date].append(type_id)
+        elif last < to_date:
+            pending[max(last + timedelta(seconds=1), from_date)].append(type_id)
+    return last_stored, pending
+
+
+def save_measurement_points(
+    asset: models.MotionAsset,
+    points: Iterable[tuple[MeasurementInfo, MeasurementPoint]],
+    last_stored: dict[int, datetime],
+) -> int:
+    """
+    store the points newer than the last stored ones as they come, in batches
+    of STORE_BATCH_SIZE, return their number
+    """
+    new_points = _new_measurement_rows(asset, points, last_stored)
+    stored = 0
+    days = set()
+    while batch := list(islice(new_points, STORE_BATCH_SIZE)):
+        models.MotionAssetMeasurement.objects.bulk_create(batch, ignore_conflicts=True)
+        days.update(point.timestamp.astimezone(timezone.utc).date() for point in batch)
+        stored += len(batch)
+    if days:
+        update_daily_rollups(asset, days)
+        # points arrived late for a closed month make its report stale
+        invalidate_report_snapshots(asset, {(day.month, day.year) for day in days})
+        models.MotionAsset.objects.filter(pk=asset.pk).update(
+            updated_at=datetime.now(timezone.utc)
+        )
+    return stored
+
+
+def _new_measurement_rows(
+    asset: models.MotionAsset,
+    points: Iterable[tuple[MeasurementInfo, MeasurementPoint]],
+    last_stored: dict[int, datetime],
+) -> Iterator[models.MotionAssetMeasurement]:
+    for info, point in points:
+        type_id = int(info.measurementTypeId)
+        last = last_stored.get(type_id)
+        if last and point.timestamp <= last:
+            continue
+        yield models.MotionAssetMeasurement(
+            asset=asset,
+            measurementTypeId=type_id,
+            timestamp=point.timestamp,
+            value=point.value,
+        )
+
+
+def get_stored_asset_report(
+    asset: models.MotionAsset, from_date: datetime, to_date: datetime
+) -> AssetReport:
+    """compute the report of the asset from the local store"""
+    orig_data = load_asset_measurements(asset, from_date, to_date)
+    if not orig_data.measurements:
+        raise NoMeasurementsError("No measurements found")
+    return elaborate_report_data(orig_data, asset)
+
+
+def stream_stored_asset_report(
+    asset: models.MotionAsset, from_date: datetime, to_date: datetime
+) -> tuple[AssetReportHeader, Iterator[CombinedPoint]]:
+    """
+    Compute the report of the asset from the local store, returning its
+    header and an iterator merging the measurements on demand. The series are
+    read in advance as compact arrays, so consuming the iterator doesn't touch
+    the DB and is safe in an event loop.
+    """
+    data = load_asset_measurements(asset, from_date, to_date)
+    series = get_series(data)
+    if not series:
+        raise NoMeasurementsError("No measurements found")
+    header = AssetReportHeader(
+        asset=asset,
+        start_date=min(points[0].timestamp for points in series.values()),
+        end_date=max(points[-1].timestamp for points in series.values()),
+        report=compute_report_values(
+            {key: np.frombuffer(points.values) for key, points in series.items()}
+        ),
+    )
+    return header, merge_measurements(series)
+
+
+def load_report_snapshot(
+    asset: models.MotionAsset, month: int, year: int
+) -> Optional[AssetReport]:
+    """return the report stored for the asset and month, if any"""
+    snapshot = models.MotionAssetReport.objects.filter(
+        asset=asset, month=month, year=year
+    ).first()
+    if snapshot is None:
+        return None
+    points = [
+        CombinedPoint(
+            parse_timestamp(point["tstamp"]),
+            *(point[key] for key in COMBINED_POINT_KEYS),
+        )
+        for point in snapshot.measurements
+    ]
+    return AssetReport(
+        asset,
+        snapshot.start_date,
+        snapshot.end_date,
+        points,
+        ReportData(**snapshot.report),
+    )
+
+
+def save_report_snapshot(
+    report: AssetReport, month: int, year: int
+) -> models.MotionAssetReport:
+    """store the report of a closed month so it's never computed again"""
+    return store_report_snapshot(report.asset, month, year, get_snapshot_fields(report))
+
+
+def get_snapshot_fields(report: AssetReport) -> dict:
+    """the fields of the MotionAssetReport snapshot of the report"""
+    measurements = [
+        {
+            "tstamp": point.tstamp.isoformat(),
+            **{key: getattr(point, key) for key in COMBINED_POINT_KEYS},
+        }
+        for point in report.measurements
+    ]
+    return {
+        "measurements": measurements,
+        "report": asdict(report.report),
+        "start_date": report.start_date,
+        "end_date": report.end_date,
+        "tvi": report.report.tvi,
+        "dvi": report.report.dvi,
+    }
+
+
+def store_report_snapshot(
+    asset: models.MotionAsset, month: int, year: int, fields: dict
+) -> models.MotionAssetReport:
+    """store the snapshot fields of the report of the asset for a month"""
+    snapshot, _ = models.MotionAssetReport.objects.update_or_create(
+        asset=asset, month=month, year=year, defaults=fields
+    )
+    return snapshot
+
+
+def update_daily_rollups(asset: models.MotionAsset, days: Iterable[date]) -> None:
+    """
+    recompute the daily rollups of the asset for the UTC days from the stored
+    measurements, in batches of close days
+    """
+    days = sorted(days)
+    while days:
+        first = days[0]
+        batch_end = first + timedelta(days=ROLLUP_BATCH_DAYS)
+        last = max(day for day in days if day < batch_end)
+        _update_daily_rollups(asset, first, last)
+        days = [day for day in days if day > last]
+
+
+def _update_daily_rollups(asset: models.MotionAsset, first: date, last: date) -> None:
+    start, end = get_date_range(first, last)
+    with transaction.atomic():
+        # rollups of an asset are updated by a transaction at a time, which
+        # sees all the measurements stored by the previous ones
+        models.MotionAsset.objects.select_for_update().filter(pk=asset.pk).exists()
+        measurements = models.MotionAssetMeasurement.objects.filter(
+            asset=asset, timestamp__gte=start, timestamp__lt=end
+        )
+        rows = list(
+            measurements.annotate(day=TruncDate("timestamp", tzinfo=timezone.utc))
+            .values("day", "measurementTypeId")
+            .annotate(
+                count=Count("pk"),
+                sum=Sum("value"),
+                min=Min("value"),
+                max=Max("value"),
+                first_timestamp=Min("timestamp"),
+                last_timestamp=Max("timestamp"),
+            )
+            .order_by()
+        )
+        last_values = {
+            (type_id, timestamp): value
+            for type_id, timestamp, value in measurements.filter(
+                timestamp__in={row["last_timestamp"] for row in rows}
+            ).values_list("measurementTypeId", "timestamp", "value")
+        }
+        models.MotionAssetDailyRollup.objects.filter(
+            asset=asset, day__gte=first, day__lte=last
+        ).delete()
+        models.MotionAssetDailyRollup.objects.bulk_create(
+            [
+                models.MotionAssetDailyRollup(
+                    asset=asset,
+                    last=last_values[row["measurementTypeId"], row["last_timestamp"]],
+                    **row,
+                )
+                for row in rows
+            ],
+            batch_size=STORE_BATCH_SIZE,
+        )
+
+
+def get_rollup_report(
+    asset: models.MotionAsset, from_date: datetime, to_date: datetime
+) -> AssetReportHeader:
+    """
+    Compute the report of the asset from the daily rollups of the UTC days in
+    [from_date, to_date), which must start at midnight: the values of
+    ReportData are all sums, counts or maxima of the daily ones, so they are
+    computed in O(days) instead of O(measurements).
+    """
+    totals = {
+        str(row.pop("measurementTypeId")): row
+        for row in models.MotionAssetDailyRollup.objects.filter(
+            asset=asset,
+            day__gte=from_date.date(),
+            day__lt=to_date.date(),
+            measurementTypeId__in=[int(type_id) for type_id in MEASUREMENT_TYPES_IDS],
+        )
+        .values("measurementTypeId")
+        .annotate(
+            count=Sum("count"),
+            sum=Sum("sum"),
+            max=Max("max"),
+            first_timestamp=Min("first_timestamp"),
+            last_timestamp=Max("last_timestamp"),
+        )
+        .order_by()
+    }
+    if not totals:
+        raise NoMeasurementsError("No measurements found")
+    values = {MEASUREMENT_TYPES_IDS[type_id]: row for type_id, row in totals.items()}
+    empty = {"count": 0, "sum": 0.0, "max": 0.0}
+    acc = {key: values.get(key, empty) for key in ("acc_x", "acc_y", "acc_z")}
+    report = ReportData(
+        max_tot_time=values.get("tot_time", empty)["max"],
+        tot_run_time=values.get("run_time", empty)["sum"] / 60,
+        avg_acc_x=acc["acc_x"]["sum"] / max(acc["acc_x"]["count"], 1),
+        avg_acc_y=acc["acc_y"]["sum"] / max(acc["acc_y"]["count"], 1),
+        avg_acc_z=acc["acc_z"]["sum"] / max(acc["acc_z"]["count"], 1),
+        tvi=0,
+        dvi=0,
+    )
+    return AssetReportHeader(
+        asset=asset,
+        start_date=min(row["first_timestamp"] for row in totals.values()),
+        end_date=max(row["last_timestamp"] for row in totals.values()),
+        report=report,
+    )
+
+
+def invalidate_report_snapshots(
+    asset: models.MotionAsset, months: Iterable[tuple[int, int]] = None
+) -> int:
+    """
+    delete the report snapshots of the asset for the given (month, year),
+    all of them if not given, so they are computed again on the next request
+    """
+    snapshots = models.MotionAssetReport.objects.filter(asset=asset)
+    if months is not None:
+        query = Q(pk__in=[])
+        for month, year in months:
+            query |= Q(month=month, year=year)
+        snapshots = snapshots.filter(query)
+    deleted, _ = snapshots.delete()
+    return deleted
+
+
+def has_stored_measurements(
+    asset: models.MotionAsset, from_date: datetime, to_date: datetime
+) -> bool:
+    """some measurements of the asset in [from_date, to_date) are stored"""
+    return models.MotionAssetMeasurement.objects.filter(
+        asset=asset, timestamp__gte=from_date, timestamp__lt=to_date
+    ).exists()
+
+
+def refresh_in_background(
+    account: models.Account,
+    asset: models.MotionAsset,
+    from_date: datetime,
+    to_date: datetime,
+) -> None:
+    """fetch the new measurements of the asset in the range on another thread"""
+    api = AbbApi(account)
+    resilience.refresh_in_background(
+        (account.pk, asset.pk, from_date, to_date),
+        api.sync_asset_measurements,
+        asset.motionAssetId,
+        from_date,
+        to_date,
+    )
+
+
+def load_asset_measurements(
+    asset: models.MotionAsset, from_date: datetime, to_date: datetime
+) -> AssetMeasurements:
+    """read the asset measurements in [from_date, to_date) from the local store"""
+    rows = (
+        models.MotionAssetMeasurement.objects.filter(
+            asset=asset, timestamp__gte=from_date, timestamp__lt=to_date
+        )
+        .order_by("measurementTypeId", "timestamp")
+        .values_list("measurementTypeId", "timestamp", "value")
+    )
+    series = defaultdict(MeasurementSeries)
+    for type_id, timestamp, value in rows:
+        series[type_id].append(timestamp, value)
+    type_names = {type_id: name for name, type_id in MEASUREMENT_TYPES.items()}
+    measurements = []
+    for type_id, points in series.items():
+        info = MeasurementInfo(
+            measurementTypeId=str(type_id),
+            measurementTypeName=type_names.get(type_id, ""),
+            unit="",
+            startTime=points[0].timestamp.isoformat(),
+            endTime=points[-1].timestamp.isoformat(),
+        )
+        measurements.append(Measurement(info, points))
+    return AssetMeasurements(
+        assetId=asset.assetId, assetName=asset.assetName, measurements=measurements
+    )
+
+
 MEASUREMENT_TYPES_IDS = {
     "31": "acc_x",
     "32": "acc_y",
@@ -464,40 +1805,332 @@ MEASUREMENT_TYPES_IDS = {
 }
 
 
-def elaborate_report_data(data: AssetMeasurements) -> ReportData:
-    datalen = min([len(m.data) for m in data.measurements])
-    resdata = []
-    report_arrays = defaultdict(list)
-    for i in range(datalen):
-        vals = {}
-        for m in data.measurements:
-            tipe = m.info.measurementTypeId
-            if tipe in MEASUREMENT_TYPES_IDS:
-                key = MEASUREMENT_TYPES_IDS[tipe]
-                value = m.data[i].value
-                vals[key] = value
-                report_arrays[key].append(value)
+COMBINED_POINT_KEYS = ("acc_x", "acc_y", "acc_z", "run_time", "tot_time")
+
+
+def get_series(data: AssetMeasurements) -> dict[str, Iterable[MeasurementPoint]]:
+    """return the points of the report measurement types by CombinedPoint key"""
+    return {
+        MEASUREMENT_TYPES_IDS[m.info.measurementTypeId]: m.data
+        for m in data.measurements
+        if m.info.measurementTypeId in MEASUREMENT_TYPES_IDS
+    }
+
+
+def merge_measurements(
+    series: dict[str, Iterable[MeasurementPoint]],
+    tolerance: timedelta = timedelta(0),
+) -> Iterator[CombinedPoint]:
+    """
+    Merge the series, each one sorted by timestamp, into CombinedPoint rows.
+    A point joins the current row if its timestamp is within tolerance from
+    the first point of the row and its series has no value in the row yet,
+    otherwise it starts a new row. Series without a point in a row are None.
+    MeasurementSeries are joined on their arrays, the other series are
+    consumed lazily so they can be generators.
+    """
+    joined = None if tolerance else join_series(series)
+    if joined is not None:
+        return iter_combined_points(*joined)
+    return _merge_points(series, tolerance)
+
+
+def join_series(
+    series: dict[str, Iterable[MeasurementPoint]]
+) -> Optional[tuple[np.ndarray, dict[str, np.ndarray]]]:
+    """
+    Exact join of MeasurementSeries on their epoch arrays: the epochs of the
+    rows and a float64 column of each key, NaN where the series has no point.
+    None if a series isn't a MeasurementSeries or repeats a timestamp, as
+    merge_measurements puts the repeated points on rows of their own.
+    """
+    if not all(isinstance(points, MeasurementSeries) for points in series.values()):
+        return None
+    arrays = {
+        key: (
+            np.frombuffer(points.timestamps, dtype=np.int64),
+            np.frombuffer(points.values, dtype=np.float64),
+        )
+        for key, points in series.items()
+    }
+    for timestamps, _ in arrays.values():
+        if np.any(timestamps[1:] <= timestamps[:-1]):
+            return None
+    epochs = np.unique(
+        np.concatenate([np.empty(0, dtype=np.int64)] + [t for t, _ in arrays.values()])
+    )
+    columns = {}
+    for key, (timestamps, values) in arrays.items():
+        column = np.full(len(epochs), np.nan)
+        column[np.searchsorted(epochs, timestamps)] = values
+        columns[key] = column
+    return epochs, columns
+
+
+MERGE_CHUNK_SIZE = 10_000
+
+
+def iter_combined_points(
+    epochs: np.ndarray, columns: dict[str, np.ndarray]
+) -> Iterator[CombinedPoint]:
+    """
+    the CombinedPoint rows of the columns joined by join_series, built by
+    chunks so that streaming them doesn't hold a python object per point
+    """
+    for start in range(0, len(epochs), MERGE_CHUNK_SIZE):
+        end = start + MERGE_CHUNK_SIZE
+        timestamps = [
+            datetime.fromtimestamp(epoch, timezone.utc)
+            for epoch in epochs[start:end].tolist()
+        ]
+        values = []
+        for key in COMBINED_POINT_KEYS:
+            column = columns.get(key)
+            if column is None:
+                values.append(repeat(None))
+                continue
+            chunk = column[start:end]
+            chunk_values = chunk.tolist()
+            if np.isnan(chunk).any():
+                chunk_values = [None if v != v else v for v in chunk_values]
+            values.append(chunk_values)
+        yield from map(CombinedPoint, timestamps, *values)
+
+
+def _merge_points(
+    series: dict[str, Iterable[MeasurementPoint]], tolerance: timedelta
+) -> Iterator[CombinedPoint]:
+    # with a handful of series a linear scan of their heads is cheaper than a
+    # heap, each point is still visited once. MeasurementSeries alone are
+    # compared by epoch seconds and get a datetime by row, not by point
+    epochs = all(isinstance(points, MeasurementSeries) for points in series.values())
+    margin = tolerance.total_seconds() if epochs else tolerance
+    slots = []
+    iterators = []
+    heads = []
+    for key, points in series.items():
+        iterator = _timed_points(points, epochs)
+        head = next(iterator, None)
+        if head is not None:
+            slots.append(COMBINED_POINT_KEYS.index(key) + 1)
+            iterators.append(iterator)
+            heads.append(head)
+    while heads:
+        row_start = min(heads, key=itemgetter(0))
+        row_end = row_start[0] + margin
+        timestamp = row_start[2]
+        if timestamp is None:
+            timestamp = datetime.fromtimestamp(row_start[0], timezone.utc)
+        row = [timestamp, None, None, None, None, None]
+        exhausted = False
+        for i, head in enumerate(heads):
+            if head[0] <= row_end:
+                row[slots[i]] = head[1]
+                heads[i] = next(iterators[i], None)
+                exhausted = exhausted or heads[i] is None
+        if exhausted:
+            for i in reversed(range(len(heads))):
+                if heads[i] is None:
+                    del slots[i], iterators[i], heads[i]
+        yield CombinedPoint(*row)
+
+
+def _timed_points(
+    points: Iterable[MeasurementPoint], epochs: bool = False
+) -> Iterator[tuple]:
+    """
+    yield (datetime, value, timestamp) tuples of the points, or (epoch
+    seconds, value, None) tuples of a MeasurementSeries if epochs is set
+    """
+    if isinstance(points, MeasurementSeries):
+        if epochs:
+            yield from zip(points.timestamps, points.values, repeat(None))
+            return
+        for epoch, value in zip(points.timestamps, points.values):
+            timestamp = datetime.fromtimestamp(epoch, timezone.utc)
+            yield timestamp, value, timestamp
+        return
+    points = iter(points)
+    first = next(points, None)
+    if first is None:
+        return
+    points = chain((first,), points)
+    if isinstance(first.timestamp, str):
+        for point in points:
+            yield parse_timestamp(point.timestamp), point.value, point.timestamp
+    else:
+        for point in points:
+            yield point.timestamp, point.value, point.timestamp
+
+
+@dataclass
+class ReportColumns:
+    """columnar view of the CombinedPoint rows, gaps are NaN"""
+
+    timestamps: list  # timestamps of the rows as returned by the source
+    values: dict[str, np.ndarray]  # float64 column per CombinedPoint key
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    @cached_property
+    def epoch(self) -> np.ndarray:
+        """timestamps of the rows as int64 epoch seconds"""
+        return np.fromiter(
+            (
+                (parse_timestamp(t) if isinstance(t, str) else t).timestamp()
+                for t in self.timestamps
+            ),
+            dtype=np.float64,
+            count=len(self.timestamps),
+        ).astype(np.int64)
+
+
+def get_report_columns(points: list[CombinedPoint]) -> ReportColumns:
+    """turn the rows into float64 columns, None values become NaN"""
+    return ReportColumns(
+        timestamps=[point.tstamp for point in points],
+        values={
+            key: np.array([getattr(point, key) for point in points], dtype=np.float64)
+            for key in COMBINED_POINT_KEYS
+        },
+    )
+
+
+def _sequential_sum(values: np.ndarray) -> float:
+    # np.sum uses pairwise summation, cumsum adds left to right like sum() so
+    # the results are the same of the pure python implementation
+    return float(np.cumsum(values)[-1]) if len(values) else 0.0
+
+
+def compute_report_data(columns: ReportColumns) -> ReportData:
+    """compute the report values from the measurement columns, skipping gaps"""
+    return compute_report_values(
+        {key: column[~np.isnan(column)] for key, column in columns.values.items()}
+    )
+
+
+def compute_report_values(values: dict[str, np.ndarray]) -> ReportData:
+    """compute the report values from the values of each CombinedPoint key"""
+    values = {key: values.get(key, np.empty(0)) for key in COMBINED_POINT_KEYS}
+    tot_time = values["tot_time"]
+    return ReportData(
+        max_tot_time=float(tot_time.max()) if len(tot_time) else 0.0,
+        tot_run_time=_sequential_sum(values["run_time"]) / 60,
+        avg_acc_x=_sequential_sum(values["acc_x"]) / max(len(values["acc_x"]), 1),
+        avg_acc_y=_sequential_sum(values["acc_y"]) / max(len(values["acc_y"]), 1),
+        avg_acc_z=_sequential_sum(values["acc_z"]) / max(len(values["acc_z"]), 1),
+        tvi=0,
+        dvi=0,
+    )
+
+
+def elaborate_report_data(
+    data: AssetMeasurements,
+    asset: models.MotionAsset = None,
+    tolerance: timedelta = timedelta(0),
+) -> ReportData:
+    series = get_series(data)
+    joined = None if tolerance else join_series(series)
+    if joined is None:
+        points = list(merge_measurements(series, tolerance))
+        report_vals = compute_report_data(get_report_columns(points))
+    else:
+        # the report values are computed on the joined columns, without
+        # reading them back from the rows
+        epochs, columns = joined
+        points = list(iter_combined_points(epochs, columns))
+        report_vals = compute_report_values(
+            {key: column[~np.isnan(column)] for key, column in columns.items()}
+        )
+    start_date = points[0].tstamp
+    end_date = points[-1].tstamp
+    if asset is None:
+        asset, _ = models.MotionAsset.objects.get_or_create(
+            assetId=data.assetId,
+            assetName=data.assetName,
+        )
+    return AssetReport(asset, start_date, end_date, points, report_vals)
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    indices of the threshold points of (x, y) chosen by Largest-Triangle-
+    Three-Buckets: the first and last points are kept, each bucket in between
+    keeps the point making the largest triangle with the previous choice and
+    the average of the next bucket
+    """
+    n = len(y)
+    if threshold >= n:
+        return np.arange(n)
+    if threshold < 3:
+        return np.array([0, n - 1][:threshold], dtype=np.int64)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = a = 0
+    selected[-1] = n - 1
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x = x[end : edges[i + 2]].mean()
+            next_y = y[end : edges[i + 2]].mean()
         else:
-            key = "tstamp"
-            value = m.data[i].timestamp
-            vals[key] = value
-            report_arrays[key].append(value)
-        resdata.append(CombinedPoint(**vals))
-    # calc report values
-    max_tot_time = max(report_arrays["tot_time"])
-    tot_run_time = sum(report_arrays["run_time"]) / 60
-    avg_acc_x = sum(report_arrays["acc_x"]) / len(report_arrays["acc_x"])
-    avg_acc_y = sum(report_arrays["acc_y"]) / len(report_arrays["acc_y"])
-    avg_acc_z = sum(report_arrays["acc_z"]) / len(report_arrays["acc_z"])
-    tvi = 0
-    dvi = 0
-    start_date = report_arrays["tstamp"][0]
-    end_date = report_arrays["tstamp"][-1]
-    report_vals = ReportData(
-        max_tot_time, tot_run_time, avg_acc_x, avg_acc_y, avg_acc_z, tvi, dvi
-    )
-    asset, _ = models.MotionAsset.objects.get_or_create(
-        assetId=data.assetId,
-        assetName=data.assetName,
-    )
-    return AssetReport(asset, start_date, end_date, resdata, report_vals)
+            next_x, next_y = x[n - 1], y[n - 1]
+        area = np.abs(
+            (x[a] - next_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (next_y - y[a])
+        )
+        a = selected[i + 1] = start + int(area.argmax())
+    return selected
+
+
+def minmax_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    indices of at most threshold points of y keeping the min and the max of
+    each one of threshold / 2 buckets of equal size, in order
+    """
+    n = len(y)
+    if threshold >= n:
+        return np.arange(n)
+    edges = np.linspace(0, n, max(threshold // 2, 1) + 1).astype(np.int64)
+    selected = []
+    for start, end in zip(edges[:-1], edges[1:]):
+        bucket = y[start:end]
+        selected.extend(sorted({start + bucket.argmin(), start + bucket.argmax()}))
+    return np.array(selected, dtype=np.int64)
+
+
+DOWNSAMPLING_METHODS = {"lttb": lttb_indices, "minmax": minmax_indices}
+
+
+def downsample_report(
+    report: AssetReport, max_points: int, method: str = "lttb"
+) -> AssetReport:
+    """
+    Return the report with at most max_points measurements, chosen by method
+    for each channel separately so that its spikes are kept. The rows picked
+    for a channel keep the values of all the channels, each channel gets an
+    equal share of max_points. The report values are left as computed on all
+    the measurements.
+    """
+    points = report.measurements
+    if len(points) <= max_points:
+        return report
+    columns = get_report_columns(points)
+    x = columns.epoch.astype(np.float64)
+    channels = {}
+    for key, column in columns.values.items():
+        valid = np.flatnonzero(~np.isnan(column))
+        if len(valid):
+            channels[key] = valid
+    threshold = max_points // max(len(channels), 1)
+    selected = [
+        valid[
+            DOWNSAMPLING_METHODS[method](
+                x[valid], columns.values[key][valid], threshold
+            )
+        ]
+        for key, valid in channels.items()
+    ]
+    keep = np.unique(np.concatenate(selected)) if selected else []
+    return replace(report, measurements=[points[i] for i in keep])
@@ -18,7 +18,8 @@ admin.site.register(models.Site, SiteAdmin)
 
 
 class MotionAssetAdmin(admin.ModelAdmin):
-    pass
+    list_display = ("__str__", "sync_status", "synced_at")
+    list_filter = ("sync_status",)
 
 
 admin.site.register(models.MotionAsset, MotionAssetAdmin)
@@ -29,3 +30,19 @@ class MotionAssetReportAdmin(admin.ModelAdmin):
 
 
 admin.site.register(models.MotionAssetReport, MotionAssetReportAdmin)
+
+
+class MotionAssetMeasurementAdmin(admin.ModelAdmin):
+    list_display = ("asset", "measurementTypeId", "timestamp", "value")
+    list_filter = ("measurementTypeId",)
+
+
+admin.site.register(models.MotionAssetMeasurement, MotionAssetMeasurementAdmin)
+
+
+class MotionAssetDailyRollupAdmin(admin.ModelAdmin):
+    list_display = ("asset", "measurementTypeId", "day", "count", "last")
+    list_filter = ("measurementTypeId",)
+
+
+admin.site.register(models.MotionAssetDailyRollup, MotionAssetDailyRollupAdmin)
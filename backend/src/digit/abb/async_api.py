@@ -0,0 +1,466 @@
+import asyncio
+import logging
+import ssl
+import time
+import weakref
+
+from datetime import datetime
+from functools import lru_cache
+from typing import Iterator, Optional
+
+import httpx
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import abb_api as abb, cache, metrics, models, profiling, resilience
+
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def get_ssl_context() -> ssl.SSLContext:
+    """
+    the SSL context shared by the clients: loading the CA certificates takes
+    tens of milliseconds, which would block the event loop at every client
+    """
+    return httpx.create_ssl_context()
+
+
+def create_client() -> httpx.AsyncClient:
+    """create an async HTTP client configured like the sync AbbSession"""
+    return httpx.AsyncClient(
+        base_url=abb.API_URL,
+        headers=abb.HEADERS,
+        verify=get_ssl_context(),
+        # like the pool of AbbSession, the connections in use aren't limited
+        limits=httpx.Limits(
+            max_connections=None,
+            max_keepalive_connections=settings.ABB_API_POOL_SIZE,
+        ),
+        timeout=httpx.Timeout(
+            settings.ABB_API_READ_TIMEOUT, connect=settings.ABB_API_CONNECT_TIMEOUT
+        ),
+    )
+
+
+# the shared client of each event loop, with the generator closing it
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, tuple]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+async def _client_lifetime(client: httpx.AsyncClient):
+    try:
+        yield client
+    finally:
+        await client.aclose()
+
+
+async def get_client() -> httpx.AsyncClient:
+    """
+    return the HTTP client shared by the requests served on the running event
+    loop, so they reuse its connections. The client is closed by close_client
+    or with the loop: asyncio.run and async_to_sync shut down the asynchronous
+    generators of a loop before closing it, _client_lifetime among them.
+    """
+    loop = asyncio.get_running_loop()
+    client, lifetime = _clients.get(loop, (None, None))
+    if client is None or client.is_closed:
+        lifetime = _client_lifetime(create_client())
+        client = await lifetime.__anext__()
+        _clients[loop] = client, lifetime
+    return client
+
+
+async def close_client() -> None:
+    """close the shared client of the running event loop, if any"""
+    client, lifetime = _clients.pop(asyncio.get_running_loop(), (None, None))
+    if lifetime is not None:
+        await lifetime.aclose()
+
+
+class AsyncAbbApi:
+    """
+    asyncio variant of AbbApi: same methods, awaitable. It must be used as an
+    async context manager:
+
+        async with AsyncAbbApi(account) as api:
+            reports = await api.get_site_reports(siteId)
+
+    The requests are made with client, by default the shared client of the
+    running event loop, got at the first request: the data read from the
+    local store doesn't need it. The client isn't closed on exit.
+    """
+
+    def __init__(
+        self,
+        account: models.Account,
+        client: httpx.AsyncClient = None,
+        max_concurrency: int = None,
+    ) -> None:
+        self.account: models.Account = account
+        self.client: Optional[httpx.AsyncClient] = client
+        self.max_concurrency: int = max_concurrency or settings.ABB_API_MAX_CONCURRENCY
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._token_lock: Optional[asyncio.Lock] = None
+
+    async def __aenter__(self) -> "AsyncAbbApi":
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._token_lock = asyncio.Lock()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        pass
+
+    async def update_token_if_needed(self, rejected_token: str = None) -> str:
+        """
+        get token from ABB API if about to expire or rejected through the
+        token manager of AbbApi, waiting tasks reuse the new token
+        """
+        if self.account.token != rejected_token and self.account.is_token_valid(
+            abb.TOKEN_REFRESH_MARGIN
+        ):
+            return self.account.token
+        async with self._token_lock:
+            return await sync_to_async(abb.update_token_if_needed)(
+                self.account, rejected_token=rejected_token
+            )
+
+    async def request(self, method: str, url: str, **kwargs) -> dict:
+        """
+        make a request to the ABB API with at most max_concurrency requests in
+        flight, retrying once with a new token if it's rejected. Like
+        AbbSession, the idempotent requests failing transiently are retried
+        and the account breaker is applied.
+        """
+        await self.update_token_if_needed()
+        breaker = resilience.get_breaker(self.account.pk)
+        retries = 0
+        if method.upper() in resilience.IDEMPOTENT_METHODS:
+            retries = settings.ABB_API_RETRIES
+        attempt = 0
+        token_retry = True
+        while True:
+            breaker.check()
+            token = self.account.token
+            headers = {"Authorization": f"Bearer {token}"}
+            try:
+                rsp = await self._send(method, url, headers=headers, **kwargs)
+            except httpx.TransportError as e:
+                breaker.record_failure()
+                if attempt == retries:
+                    raise
+                error = e
+            else:
+                if not resilience.is_retryable_status(rsp.status_code):
+                    breaker.record_success()
+                    if rsp.status_code == 401 and token_retry:
+                        token_retry = False
+                        metrics.TOKEN_RETRIES.inc()
+                        await self.update_token_if_needed(rejected_token=token)
+                        continue
+                    rsp.raise_for_status()
+                    return rsp.json()
+                breaker.record_failure()
+                if attempt == retries:
+                    rsp.raise_for_status()
+                error = f"status {rsp.status_code}"
+            delay = resilience.get_backoff(attempt)
+            logger.warning("Retrying %s %s in %.2fs: %s", method, url, delay, error)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _send(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """make a single attempt of a request, recording it"""
+        if self.client is None:
+            self.client = await get_client()
+        async with self._semaphore:
+            start = time.perf_counter()
+            rsp = None
+            try:
+                rsp = await self.client.request(method, url, **kwargs)
+                return rsp
+            finally:
+                duration = time.perf_counter() - start
+                status = size = None
+                if rsp is not None:
+                    status, size = rsp.status_code, len(rsp.content)
+                profiling.record_call(
+                    method,
+                    str(rsp.url) if rsp is not None else url,
+                    status,
+                    duration,
+                    size,
+                )
+                metrics.observe_call(status, duration, size)
+
+    @metrics.upstream_function
+    async def get_sites(self, force_reload: bool = False) -> list[models.Site]:
+        if force_reload:
+            rsp = await self.request("GET", "/Site")
+            sites = await sync_to_async(abb.save_sites)(
+                self.account, rsp.get("payload", [])
+            )
+            await sync_to_async(cache.invalidate)(self.account)
+            return sites
+        return await sync_to_async(list)(
+            models.Site.objects.filter(accounts__in=[self.account]).order_by("siteName")
+        )
+
+    @metrics.upstream_function
+    async def get_motionassets(
+        self,
+        siteId: str = None,
+        force_reload: bool = False,
+        baseApi: int = 1,
+        assetTypeId: int = abb.MotionAssetTypeId.MOTIONASSET.value,
+    ) -> list[models.MotionAsset]:
+        """get list of motion assets"""
+        if force_reload:
+            if siteId:
+                url = f"/InstalledBase/Site/{baseApi}/{siteId}"
+            else:
+                url = f"/InstalledBase/Type/{assetTypeId}"
+            rsp = await self.request("GET", url)
+            assets = await sync_to_async(abb.save_motionassets)(rsp.get("payload", []))
+            await sync_to_async(cache.invalidate)(self.account)
+            return assets
+        return await sync_to_async(list)(
+            models.MotionAsset.objects.filter(
+                site__siteId=siteId, site__accounts=self.account
+            ).select_related("site")
+        )
+
+    @metrics.upstream_function
+    async def get_subscriptions(self) -> list[abb.Subscription]:
+        rsp = await self.request("GET", "/Subscription/All")
+        return [
+            abb.Subscription(**subscription) for subscription in rsp.get("payload", [])
+        ]
+
+    @metrics.upstream_function
+    async def get_asset_measurements(
+        self,
+        assetId: str,
+        from_date: datetime = None,
+        to_date: datetime = None,
+        measurement_types: list[int] = None,
+    ) -> Optional[abb.AssetMeasurements]:
+        params = abb.get_measurement_params(
+            assetId, from_date, to_date, measurement_types
+        )
+        rsp = await self.request("GET", "/Measurement", params=params)
+        return abb.parse_asset_measurements(rsp)
+
+    async def fetch_window(
+        self, assetId: str, window: abb.FetchWindow
+    ) -> Optional[abb.AssetMeasurements]:
+        """fetch the measurements of a window, retried by request if it fails"""
+        return await self.get_asset_measurements(
+            assetId, window.start, window.end, list(window.type_ids)
+        )
+
+    async def sync_asset_measurements(
+        self, assetId: str, from_date: datetime = None, to_date: datetime = None
+    ) -> int:
+        asset = await self.get_asset(assetId)
+        return await self._sync_asset_measurements(asset, from_date, to_date)
+
+    async def _sync_asset_measurements(
+        self,
+        asset: models.MotionAsset,
+        from_date: datetime = None,
+        to_date: datetime = None,
+    ) -> int:
+        """
+        store locally the new measurements of the asset, the windows of the
+        measurement types that need different start dates, or of a long
+        range, are fetched concurrently
+        """
+        plan = await sync_to_async(abb.plan_measurement_fetch)(
+            asset, from_date, to_date
+        )
+        results = await asyncio.gather(
+            *(
+                self.fetch_window(asset.motionAssetId, window)
+                for window in plan.backfill + plan.forward
+            )
+        )
+        backfill = len(plan.backfill)
+        stored = await sync_to_async(abb.save_measurement_points)(
+            asset, abb.stitch_measurements(results[:backfill]), {}
+        )
+        stored += await sync_to_async(abb.save_measurement_points)(
+            asset, abb.stitch_measurements(results[backfill:]), plan.last_stored
+        )
+        await sync_to_async(abb.set_synced_from)(asset, plan.synced_from)
+        if stored:
+            await sync_to_async(cache.invalidate)(self.account)
+        return stored
+
+    async def get_asset(self, assetId: str) -> models.MotionAsset:
+        return await sync_to_async(abb.get_account_asset)(self.account, assetId)
+
+    async def get_asset_report(
+        self,
+        assetId: str,
+        month: int = None,
+        year: int = None,
+        force_reload: bool = False,
+    ) -> abb.AssetReport:
+        asset = await self.get_asset(assetId)
+        return await self._get_asset_report(asset, month, year, force_reload)
+
+    async def get_asset_range_report(
+        self,
+        assetId: str,
+        from_date: datetime,
+        to_date: datetime,
+        force_reload: bool = False,
+    ) -> abb.AssetReport:
+        asset = await self.get_asset(assetId)
+        from_date, to_date, stale = await self._sync_report_range(
+            asset, force_reload=force_reload, from_date=from_date, to_date=to_date
+        )
+        report = await sync_to_async(abb.get_stored_asset_report)(
+            asset, from_date, to_date
+        )
+        report.stale = stale
+        return report
+
+    async def stream_asset_report(
+        self,
+        assetId: str,
+        month: int = None,
+        year: int = None,
+        force_reload: bool = False,
+        from_date: datetime = None,
+        to_date: datetime = None,
+    ) -> tuple[abb.AssetReportHeader, Iterator[abb.CombinedPoint]]:
+        """
+        the iterator of the measurements doesn't touch the DB, it can be
+        consumed in the event loop
+        """
+        asset = await self.get_asset(assetId)
+        from_date, to_date, stale = await self._sync_report_range(
+            asset, month, year, force_reload, from_date, to_date
+        )
+        header, points = await sync_to_async(abb.stream_stored_asset_report)(
+            asset, from_date, to_date
+        )
+        header.stale = stale
+        return header, points
+
+    async def get_asset_summary(
+        self,
+        assetId: str,
+        month: int = None,
+        year: int = None,
+        force_reload: bool = False,
+        from_date: datetime = None,
+        to_date: datetime = None,
+    ) -> abb.AssetReportHeader:
+        asset = await self.get_asset(assetId)
+        from_date, to_date, stale = await self._sync_report_range(
+            asset, month, year, force_reload, from_date, to_date
+        )
+        header = await sync_to_async(abb.get_rollup_report)(asset, from_date, to_date)
+        header.stale = stale
+        return header
+
+    async def _sync_report_range(
+        self,
+        asset: models.MotionAsset,
+        month: int = None,
+        year: int = None,
+        force_reload: bool = False,
+        from_date: datetime = None,
+        to_date: datetime = None,
+    ) -> tuple[datetime, datetime, bool]:
+        """like AbbApi._sync_report_range"""
+        if from_date and to_date:
+            synced = abb.is_asset_synced(asset, to_date, from_date)
+        else:
+            from_date, to_date = abb.get_month_range(*abb.get_report_month(month, year))
+            synced = abb.is_asset_synced(asset, to_date, from_date)
+        stale = False
+        if force_reload or not synced:
+            stale = await self._sync_or_stale(asset, from_date, to_date)
+        return from_date, to_date, stale
+
+    async def _get_asset_report(
+        self,
+        asset: models.MotionAsset,
+        month: int = None,
+        year: int = None,
+        force_reload: bool = False,
+    ) -> abb.AssetReport:
+        month, year = abb.get_report_month(month, year)
+        if not force_reload:
+            report = await sync_to_async(abb.load_report_snapshot)(asset, month, year)
+            if report:
+                return report
+        from_date, to_date = abb.get_month_range(month, year)
+        stale = False
+        if force_reload or not abb.is_asset_synced(asset, to_date, from_date):
+            stale = await self._sync_or_stale(asset, from_date, to_date)
+        report = await sync_to_async(abb.get_stored_asset_report)(
+            asset, from_date, to_date
+        )
+        report.stale = stale
+        if abb.is_month_closed(month, year) and not stale:
+            await sync_to_async(abb.save_report_snapshot)(report, month, year)
+        return report
+
+    async def _sync_or_stale(
+        self, asset: models.MotionAsset, from_date: datetime, to_date: datetime
+    ) -> bool:
+        """like AbbApi._sync_or_stale"""
+        try:
+            await self._sync_asset_measurements(asset, from_date, to_date)
+            return False
+        except (httpx.HTTPError, resilience.CircuitOpenError) as e:
+            if not resilience.is_upstream_failure(e) or not await sync_to_async(
+                abb.has_stored_measurements
+            )(asset, from_date, to_date):
+                raise
+            logger.warning("Serving stale measurements of asset %s: %s", asset.pk, e)
+            await sync_to_async(abb.refresh_in_background)(
+                self.account, asset, from_date, to_date
+            )
+            return True
+
+    async def get_site_reports(
+        self,
+        siteId: str,
+        month: int = None,
+        year: int = None,
+        force_reload: bool = False,
+    ) -> list[abb.AssetReport]:
+        """
+        compute the reports of all the assets of the site, fetching their
+        measurements concurrently. Assets without measurements are skipped.
+        """
+        assets = await self.get_motionassets(siteId)
+
+        async def get_report(asset):
+            try:
+                return await self._get_asset_report(asset, month, year, force_reload)
+            except abb.NoMeasurementsError:
+                logger.info("No measurements found for asset %s", asset.pk)
+
+        reports = await asyncio.gather(*(get_report(asset) for asset in assets))
+        return [report for report in reports if report is not None]
+
+
+async def get_site_reports(
+    account: models.Account,
+    siteId: str,
+    month: int = None,
+    year: int = None,
+    force_reload: bool = False,
+) -> list[abb.AssetReport]:
+    async with AsyncAbbApi(account) as api:
+        return await api.get_site_reports(siteId, month, year, force_reload)
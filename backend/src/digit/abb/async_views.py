@@ -0,0 +1,252 @@
+"""
+Native async variants of SiteView, AssetView and AssetDataView, routed in
+their place when settings.ABB_ASYNC_VIEWS is set. On an ASGI server a sync
+view holds a thread, and a DB connection, for as long as it waits on the ABB
+cloud; these views wait in the event loop, so a worker keeps many slow
+requests in flight.
+
+Django 4.0 has neither async class-based views nor an async queryset API,
+and the DRF views are sync only. So the views are coroutine functions that
+authenticate the JWT as the DRF views do, run their queries through
+sync_to_async as async_api does, and call the ABB cloud with AsyncAbbApi.
+They answer with the same data, validators and cache entries as the sync
+views, in JSON only.
+"""
+from functools import wraps
+from typing import Any, Awaitable, Callable, Optional
+
+import httpx
+import requests
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.http import HttpResponse, HttpResponseNotAllowed, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from rest_framework import exceptions, status
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from abb import (
+    abb_api as abb,
+    async_api,
+    cache,
+    models,
+    renderers,
+    resilience,
+    serializers,
+    views,
+)
+
+
+def json_response(data, status_code: int = status.HTTP_200_OK) -> HttpResponse:
+    return HttpResponse(
+        renderers.FastJSONRenderer().render(data),
+        status=status_code,
+        content_type="application/json",
+    )
+
+
+def authenticate(request) -> tuple[Optional[User], Optional[models.Account]]:
+    """the user of the JWT of the request, if any, and the user's ABB account"""
+    result = JWTAuthentication().authenticate(request)
+    if result is None:
+        return None, None
+    user, _ = result
+    return user, user.account.first()
+
+
+def unauthorized(request, detail) -> HttpResponse:
+    """the 401 response of the DRF views"""
+    data = detail if isinstance(detail, (dict, list)) else {"detail": detail}
+    response = json_response(data, status.HTTP_401_UNAUTHORIZED)
+    response["WWW-Authenticate"] = JWTAuthentication().authenticate_header(request)
+    return response
+
+
+def abb_view(view):
+    """
+    Decorator of the async views: only GET is allowed, by an authenticated
+    user with an ABB account, passed to the view after the request.
+    """
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ("GET", "HEAD"):
+            return HttpResponseNotAllowed(["GET", "HEAD"])
+        try:
+            user, account = await sync_to_async(authenticate)(request)
+        except exceptions.AuthenticationFailed as e:
+            return unauthorized(request, e.detail)
+        if user is None:
+            return unauthorized(request, exceptions.NotAuthenticated.default_detail)
+        if account is None:
+            return json_response(
+                {"msg": "Invalid ABB user account"}, status.HTTP_400_BAD_REQUEST
+            )
+        request.user = user
+        return await view(request, account, *args, **kwargs)
+
+    return wrapper
+
+
+async def conditional(
+    request,
+    version: Optional[abb.DataVersion],
+    get: Callable[[], Awaitable[HttpResponse]],
+) -> HttpResponse:
+    """
+    the response of get, or a 304 if the client has the version, as
+    views.conditional
+    """
+    if version is None:
+        return await get()
+    etag, last_modified = views.get_validators(request, version)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = await get()
+    return views.set_validators(response, etag, last_modified)
+
+
+async def cached(
+    account: models.Account,
+    endpoint: str,
+    params: dict,
+    version: Optional[abb.DataVersion],
+    compute: Callable[[], Awaitable[Any]],
+    reload: bool = False,
+) -> Any:
+    """like views.cached, sharing its entries"""
+    if views.RELOAD or reload:
+        return await compute()
+    params = {**params, "version": version and version.key}
+    return await cache.aget_or_set(account, endpoint, params, compute, views.is_fresh)
+
+
+async def serialize(func: Callable[..., dict], *args) -> dict:
+    """run the serialization func on a worker thread, large reports take a while"""
+    return await sync_to_async(func, thread_sensitive=False)(*args)
+
+
+@abb_view
+async def sites(request, account: models.Account):
+    version = None
+    if not views.RELOAD:
+        version = await sync_to_async(abb.get_sites_version)(account)
+
+    async def compute() -> dict:
+        async with async_api.AsyncAbbApi(account) as api:
+            sites = await api.get_sites(force_reload=views.RELOAD)
+        return await serialize(
+            renderers.serialize, serializers.SitesSerializer, {"sites": sites}
+        )
+
+    async def get() -> HttpResponse:
+        return json_response(await cached(account, "sites", {}, version, compute))
+
+    return await conditional(request, version, get)
+
+
+@abb_view
+async def assets(request, account: models.Account, siteId: str = None):
+    version = None
+    if not views.RELOAD:
+        version = await sync_to_async(abb.get_motionassets_version)(siteId)
+
+    async def compute() -> dict:
+        async with async_api.AsyncAbbApi(account) as api:
+            assets = await api.get_motionassets(siteId, force_reload=views.RELOAD)
+        return await serialize(
+            renderers.serialize, serializers.AssetsSerializer, {"assets": assets}
+        )
+
+    async def get() -> HttpResponse:
+        data = await cached(account, "assets", {"siteId": siteId}, version, compute)
+        return json_response(data)
+
+    return await conditional(request, version, get)
+
+
+@abb_view
+async def asset_data(request, account: models.Account, siteId: str, assetId: str):
+    query = serializers.AssetReportQuerySerializer(data=request.GET)
+    if not query.is_valid():
+        return json_response(query.errors, status.HTTP_400_BAD_REQUEST)
+    query = query.validated_data
+    version = None
+    if not views.RELOAD and not query["refresh"]:
+        version = await sync_to_async(views.get_asset_report_version)(
+            account, assetId, query
+        )
+
+    async def get() -> HttpResponse:
+        try:
+            if query["stream"]:
+                return await stream_report(account, assetId, query)
+            data = await cached(
+                account,
+                "report",
+                views.get_report_cache_params(assetId, query),
+                version,
+                lambda: report(account, assetId, query),
+                reload=query["refresh"],
+            )
+        except models.MotionAsset.DoesNotExist:
+            return json_response({"msg": "Asset not found"}, status.HTTP_404_NOT_FOUND)
+        except abb.NoMeasurementsError:
+            return json_response(
+                {"msg": "No measurements found"}, status.HTTP_404_NOT_FOUND
+            )
+        except (httpx.HTTPError, requests.RequestException) as e:
+            if not resilience.is_upstream_failure(e):
+                raise
+            return json_response(
+                {"msg": "ABB cloud unavailable"}, status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        return json_response(data)
+
+    return await conditional(request, version, get)
+
+
+async def report(account: models.Account, assetId: str, query: dict) -> dict:
+    async with async_api.AsyncAbbApi(account) as api:
+        if query["summary"]:
+            report = await api.get_asset_summary(
+                assetId,
+                month=query.get("month"),
+                year=query.get("year"),
+                force_reload=query["refresh"],
+                from_date=query.get("from_date"),
+                to_date=query.get("to_date"),
+            )
+        elif "from_date" in query:
+            report = await api.get_asset_range_report(
+                assetId,
+                query["from_date"],
+                query["to_date"],
+                force_reload=query["refresh"],
+            )
+        else:
+            report = await api.get_asset_report(
+                assetId,
+                month=query.get("month"),
+                year=query.get("year"),
+                force_reload=query["refresh"],
+            )
+    return await serialize(views.serialize_report, report, query)
+
+
+async def stream_report(
+    account: models.Account, assetId: str, query: dict
+) -> StreamingHttpResponse:
+    async with async_api.AsyncAbbApi(account) as api:
+        header, points = await api.stream_asset_report(
+            assetId,
+            month=query.get("month"),
+            year=query.get("year"),
+            force_reload=query["refresh"],
+            from_date=query.get("from_date"),
+            to_date=query.get("to_date"),
+        )
+    # Django 4.0 iterates a streaming response in the event loop and takes no
+    # async iterators, so the lines are serialized on a worker thread first
+    lines = await serialize(list, views.iter_report_ndjson(header, points))
+    return StreamingHttpResponse(lines, content_type="application/x-ndjson")
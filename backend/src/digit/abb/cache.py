@@ -0,0 +1,149 @@
+"""
+Per-account cache of the data of the ABB views, in the "abb" cache of
+settings.CACHES (local memory or files, see settings.ABB_CACHE_BACKEND).
+
+Entries are keyed by account, endpoint and request params and expire after
+the TTL of their endpoint in settings.ABB_CACHE_TTLS. invalidate(account)
+drops all the entries of the account at once: the keys include a generation
+of the account, replaced on invalidation, so the old entries are never read
+again and expire on their own. The entries of UNVERSIONED_ENDPOINTS, not
+computed from the local store, are kept.
+"""
+import hashlib
+import threading
+import time
+
+from collections import Counter
+from typing import Any, Awaitable, Callable
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics, models
+
+
+CACHE_ALIAS = "abb"
+
+# endpoints whose data doesn't come from the local store: new data stored for
+# the account doesn't invalidate it
+UNVERSIONED_ENDPOINTS = {"subscriptions"}
+
+_MISSING = object()
+
+_stats_lock = threading.Lock()
+_hits = Counter()
+_misses = Counter()
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def _generation_key(account_id: int) -> str:
+    return f"abb:{account_id}:generation"
+
+
+def get_generation(account_id: int) -> int:
+    """
+    current generation of the account. If it has been evicted a new one is
+    created, so the entries of the lost one can't be read anymore
+    """
+    cache = get_cache()
+    key = _generation_key(account_id)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        generation = cache.get(key)
+    return generation
+
+
+def make_key(account_id: int, endpoint: str, params: dict) -> str:
+    digest = hashlib.md5(
+        repr(sorted(params.items())).encode(), usedforsecurity=False
+    ).hexdigest()
+    generation = 0 if endpoint in UNVERSIONED_ENDPOINTS else get_generation(account_id)
+    return f"abb:{account_id}:{generation}:{endpoint}:{digest}"
+
+
+def get_or_set(
+    account: models.Account,
+    endpoint: str,
+    params: dict,
+    compute: Callable[[], Any],
+    should_cache: Callable[[Any], bool] = None,
+) -> Any:
+    """
+    the cached data of the endpoint for the account and params, computed by
+    compute and stored if missing and accepted by should_cache. Exceptions of
+    compute aren't cached.
+    """
+    ttl = settings.ABB_CACHE_TTLS.get(endpoint, 0)
+    if not ttl:
+        return compute()
+    cache = get_cache()
+    key = make_key(account.pk, endpoint, params)
+    data = cache.get(key, _MISSING)
+    _count(endpoint, data is not _MISSING)
+    if data is not _MISSING:
+        return data
+    data = compute()
+    if should_cache is None or should_cache(data):
+        cache.set(key, data, ttl)
+    return data
+
+
+async def aget_or_set(
+    account: models.Account,
+    endpoint: str,
+    params: dict,
+    compute: Callable[[], Awaitable[Any]],
+    should_cache: Callable[[Any], bool] = None,
+) -> Any:
+    """get_or_set for the async views, compute is a coroutine function"""
+    ttl = settings.ABB_CACHE_TTLS.get(endpoint, 0)
+    if not ttl:
+        return await compute()
+    cache = get_cache()
+    key = await sync_to_async(make_key)(account.pk, endpoint, params)
+    data = await cache.aget(key, _MISSING)
+    _count(endpoint, data is not _MISSING)
+    if data is not _MISSING:
+        return data
+    data = await compute()
+    if should_cache is None or should_cache(data):
+        await cache.aset(key, data, ttl)
+    return data
+
+
+def store(account: models.Account, endpoint: str, params: dict, data: Any) -> None:
+    """store data as the cached data of the endpoint for the account and params"""
+    ttl = settings.ABB_CACHE_TTLS.get(endpoint, 0)
+    if ttl:
+        get_cache().set(make_key(account.pk, endpoint, params), data, ttl)
+
+
+def _count(endpoint: str, hit: bool) -> None:
+    with _stats_lock:
+        (_hits if hit else _misses)[endpoint] += 1
+    metrics.CACHE_REQUESTS.labels(endpoint, "hit" if hit else "miss").inc()
+
+
+def invalidate(account: models.Account) -> None:
+    """drop the cached data of the account, after new data has been stored"""
+    get_cache().set(_generation_key(account.pk), time.time_ns(), timeout=None)
+
+
+def get_stats() -> dict[str, dict[str, int]]:
+    """hits and misses of each endpoint counted by this process"""
+    with _stats_lock:
+        return {
+            endpoint: {"hits": _hits[endpoint], "misses": _misses[endpoint]}
+            for endpoint in sorted(_hits.keys() | _misses.keys())
+        }
+
+
+def reset_stats() -> None:
+    with _stats_lock:
+        _hits.clear()
+        _misses.clear()
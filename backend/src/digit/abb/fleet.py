@@ -0,0 +1,230 @@
+"""
+Reports of a whole fleet for a month: every motion asset of an account, or of
+all the accounts, run by `manage.py abb_fleet_reports` and /api/abb/fleet/.
+
+The I/O stage, syncing the missing measurements from the ABB cloud and
+reading them from the local store, runs on a pool of threads. The CPU-bound
+stage, merging the series and computing the report (elaborate_report_data),
+runs on a pool of processes sized to the cores, fed as soon as the data of an
+asset has been read. The reports of closed months are stored as
+MotionAssetReport snapshots, which the next runs and the views read back.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+from collections import Counter
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Iterable, Optional
+
+import django
+
+from django.conf import settings
+
+from . import abb_api as abb, models, sync
+
+
+logger = logging.getLogger(__name__)
+
+STORED = "stored"
+COMPUTED = "computed"
+NO_DATA = "no_data"
+ERROR = "error"
+
+
+@dataclass
+class FleetAssetRow:
+    account: str
+    siteId: str
+    siteName: str
+    motionAssetId: str
+    assetName: Optional[str]
+    status: str = NO_DATA
+    start_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None
+    report: Optional[abb.ReportData] = None
+    error: str = ""
+
+
+@dataclass
+class FleetReport:
+    month: int
+    year: int
+    rows: list[FleetAssetRow] = field(default_factory=list)
+    # number of rows by status
+    stored: int = 0
+    computed: int = 0
+    no_data: int = 0
+    errors: int = 0
+    # seconds taken to compute the reports
+    elapsed: float = 0.0
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    return the process pool computing the reports, shared by the threads of
+    the current process. Its workers are spawned, not forked, so they don't
+    inherit the threads and the DB connections of a running server.
+    """
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                _pool = ProcessPoolExecutor(
+                    max_workers=settings.ABB_FLEET_WORKERS or os.cpu_count(),
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=django.setup,
+                )
+                _pool_pid = pid
+    return _pool
+
+
+def discard_process_pool(pool: ProcessPoolExecutor) -> None:
+    """drop the pool after one of its workers died, a new one is created"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def compute_report_fields(
+    asset: models.MotionAsset, data: abb.AssetMeasurements
+) -> dict:
+    """run by the process pool: the snapshot fields of the report of the asset"""
+    return abb.get_snapshot_fields(abb.elaborate_report_data(data, asset))
+
+
+@sync.closing_connection
+def read_asset(
+    api: abb.AbbApi,
+    asset: models.MotionAsset,
+    month: int,
+    year: int,
+    force_reload: bool,
+) -> tuple[Optional[models.MotionAssetReport], Optional[abb.AssetMeasurements]]:
+    """
+    run by the thread pool: the stored snapshot of the report of the asset,
+    or else its measurements, synced first if needed
+    """
+    if not force_reload:
+        snapshot = (
+            models.MotionAssetReport.objects.defer("measurements")
+            .filter(asset=asset, month=month, year=year)
+            .first()
+        )
+        if snapshot is not None:
+            return snapshot, None
+    from_date, to_date = abb.get_month_range(month, year)
+    if force_reload or not abb.is_asset_synced(asset, to_date, from_date):
+        api.sync_asset_measurements(asset.motionAssetId, from_date, to_date)
+    return None, abb.load_asset_measurements(asset, from_date, to_date)
+
+
+def compute_fleet_reports(
+    accounts: Iterable[models.Account],
+    month: int = None,
+    year: int = None,
+    force_reload: bool = False,
+) -> FleetReport:
+    """
+    Compute the reports of all the motion assets of the accounts for the
+    month, by default the last complete one. Assets shared by more accounts
+    are computed once. A failure is logged and reported in the row of its
+    asset, the others go on.
+    """
+    started = time.monotonic()
+    month, year = abb.get_report_month(month, year)
+    closed = abb.is_month_closed(month, year)
+    fleet = FleetReport(month, year)
+    apis = [
+        sync.create_account_api(account, settings.ABB_SYNC_RATE_LIMIT)
+        for account in accounts
+    ]
+    pool = get_process_pool()
+    with ThreadPoolExecutor(max_workers=settings.ABB_SYNC_WORKERS) as io_pool:
+        reads = {}
+        rows = {}
+        for api in apis:
+            assets = models.MotionAsset.objects.filter(
+                site__accounts=api.account
+            ).select_related("site")
+            for asset in assets:
+                if asset.pk in rows:
+                    continue
+                rows[asset.pk] = FleetAssetRow(
+                    account=api.account.username,
+                    siteId=asset.site.siteId,
+                    siteName=asset.site.siteName,
+                    motionAssetId=asset.motionAssetId,
+                    assetName=asset.assetName,
+                )
+                future = io_pool.submit(
+                    read_asset, api, asset, month, year, force_reload
+                )
+                reads[future] = asset
+        computations = {}
+        for future in as_completed(reads):
+            asset = reads[future]
+            row = rows[asset.pk]
+            try:
+                snapshot, data = future.result()
+            except Exception as e:
+                logger.exception("Read of asset %s failed", asset.pk)
+                row.status, row.error = ERROR, str(e)
+                continue
+            if snapshot is not None:
+                row.status = STORED
+                row.start_date, row.end_date = snapshot.start_date, snapshot.end_date
+                row.report = abb.ReportData(**snapshot.report)
+            elif data.measurements:
+                try:
+                    future = pool.submit(compute_report_fields, asset, data)
+                except BrokenProcessPool as e:
+                    discard_process_pool(pool)
+                    row.status, row.error = ERROR, str(e)
+                    continue
+                computations[future] = asset
+        for future in as_completed(computations):
+            asset = computations[future]
+            row = rows[asset.pk]
+            try:
+                fields = future.result()
+            except BrokenProcessPool as e:
+                discard_process_pool(pool)
+                row.status, row.error = ERROR, str(e)
+                continue
+            except Exception as e:
+                logger.exception("Report of asset %s failed", asset.pk)
+                row.status, row.error = ERROR, str(e)
+                continue
+            if closed:
+                abb.store_report_snapshot(asset, month, year, fields)
+            row.status = COMPUTED
+            row.start_date, row.end_date = fields["start_date"], fields["end_date"]
+            row.report = abb.ReportData(**fields["report"])
+    for api in apis:
+        api.session.close()
+    fleet.rows = sorted(
+        rows.values(), key=lambda row: (row.siteName, row.assetName or "")
+    )
+    statuses = Counter(row.status for row in fleet.rows)
+    fleet.stored, fleet.computed = statuses[STORED], statuses[COMPUTED]
+    fleet.no_data, fleet.errors = statuses[NO_DATA], statuses[ERROR]
+    fleet.elapsed = time.monotonic() - started
+    return fleet
@@ -0,0 +1,109 @@
+"""
+Incremental reader of a JSON document received in chunks, so that the items
+of a large array can be consumed one at a time without holding the whole
+body or its parsed tree in memory.
+
+    stream = JsonStream(rsp.iter_content(CHUNK_SIZE))
+    for key in stream.iter_object():
+        if key == "items":
+            for _ in stream.iter_array():
+                item = stream.read_value()
+        else:
+            stream.skip_value()
+
+Containers to stream are walked with iter_object/iter_array, any other value
+is decoded whole with read_value. After each key/item yielded by the iterators
+its value must be consumed before resuming them.
+"""
+import codecs
+import json
+
+from typing import Iterable, Iterator
+
+
+WHITESPACE = " \t\n\r"
+
+
+class JsonStream:
+    def __init__(self, chunks: Iterable[bytes]) -> None:
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    def _read_chunk(self) -> bool:
+        """append the next chunk to the buffer, False at the end of the body"""
+        if self._eof:
+            return False
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._eof = True
+            text = self._decoder.decode(b"", final=True)
+        else:
+            text = self._decoder.decode(chunk)
+        # drop what has been consumed, the buffer stays about a chunk long
+        self._buf = self._buf[self._pos :] + text
+        self._pos = 0
+        return True
+
+    def _peek(self) -> str:
+        """next non blank character, without consuming it"""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._read_chunk():
+                raise ValueError("Unexpected end of JSON stream")
+
+    def _expect(self, char: str) -> None:
+        found = self._peek()
+        if found != char:
+            raise ValueError(f"Expected {char!r} at {self._pos}, found {found!r}")
+        self._pos += 1
+
+    def read_value(self):
+        """decode the next value whole"""
+        self._peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                # the value is truncated by the end of the buffer
+                if self._read_chunk():
+                    continue
+                raise
+            # a number ending the buffer may continue in the next chunk
+            if end == len(self._buf) and self._read_chunk():
+                continue
+            self._pos = end
+            return value
+
+    skip_value = read_value
+
+    def _iter_items(self, close: str) -> Iterator[None]:
+        if self._peek() == close:
+            self._pos += 1
+            return
+        while True:
+            yield
+            if self._peek() == ",":
+                self._pos += 1
+            else:
+                self._expect(close)
+                return
+
+    def iter_array(self) -> Iterator[None]:
+        """yield once per item of the next array"""
+        self._expect("[")
+        yield from self._iter_items("]")
+
+    def iter_object(self) -> Iterator[str]:
+        """yield the keys of the next object"""
+        self._expect("{")
+        for _ in self._iter_items("}"):
+            key = self.read_value()
+            self._expect(":")
+            yield key
@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from abb import fleet, models
+
+
+class Command(BaseCommand):
+    help = (
+        "Compute the reports of a month of every motion asset of the given "
+        "ABB accounts, or of all of them, and print a summary per asset"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "accounts",
+            nargs="*",
+            help="Usernames of the ABB accounts, all the accounts if omitted",
+        )
+        parser.add_argument(
+            "--month", type=int, help="Month of the reports, the last complete one"
+        )
+        parser.add_argument("--year", type=int, help="Year of the reports")
+        parser.add_argument(
+            "--force-reload",
+            action="store_true",
+            help="Fetch the measurements and compute the stored reports again",
+        )
+
+    def handle(self, *args, **options):
+        if (options["month"] is None) != (options["year"] is None):
+            raise CommandError("--month and --year must be given together")
+        accounts = models.Account.objects.all()
+        if options["accounts"]:
+            accounts = accounts.filter(username__in=options["accounts"])
+            missing = set(options["accounts"]) - {a.username for a in accounts}
+            if missing:
+                raise CommandError(f"Unknown accounts: {', '.join(sorted(missing))}")
+        report = fleet.compute_fleet_reports(
+            accounts,
+            options["month"],
+            options["year"],
+            force_reload=options["force_reload"],
+        )
+        self.stdout.write(
+            f"{'site':<30} {'asset':<30} {'status':<9} {'run time':>9} "
+            f"{'acc x':>7} {'acc y':>7} {'acc z':>7}"
+        )
+        for row in report.rows:
+            asset = row.assetName or row.motionAssetId
+            line = f"{row.siteName[:30]:<30} {asset[:30]:<30} {row.status:<9}"
+            if row.report is not None:
+                line += (
+                    f" {row.report.tot_run_time:>9.1f} {row.report.avg_acc_x:>7.3f}"
+                    f" {row.report.avg_acc_y:>7.3f} {row.report.avg_acc_z:>7.3f}"
+                )
+            elif row.error:
+                line += f" {row.error}"
+            self.stdout.write(line)
+        self.stdout.write(
+            f"Reports of {report.month}/{report.year}: {report.computed} computed, "
+            f"{report.stored} stored, {report.no_data} without data, "
+            f"{report.errors} errors in {report.elapsed:.1f}s"
+        )
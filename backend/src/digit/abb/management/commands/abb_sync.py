@@ -0,0 +1,67 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from abb import sync
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Periodically sync sites, assets, subscriptions and the latest "
+        "measurements of every ABB account into the local store"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true", help="Run a single sync and exit"
+        )
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=settings.ABB_SYNC_INTERVAL,
+            help="Seconds between the start of two syncs",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=settings.ABB_SYNC_WORKERS,
+            help="Number of worker threads",
+        )
+        parser.add_argument(
+            "--rate-limit",
+            type=float,
+            default=settings.ABB_SYNC_RATE_LIMIT,
+            help="Max requests per second to the ABB cloud for each account",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                started = time.monotonic()
+                try:
+                    result = sync.sync_all(options["workers"], options["rate_limit"])
+                except Exception:
+                    if options["once"]:
+                        raise
+                    # e.g. the DB went away: the next sync runs as planned, on
+                    # a new connection
+                    logger.exception("Sync failed")
+                    connection.close()
+                else:
+                    elapsed = time.monotonic() - started
+                    self.stdout.write(
+                        f"Synced {result.assets} assets of {result.accounts} "
+                        f"accounts, {result.points} new points, {result.errors} "
+                        f"errors in {elapsed:.1f}s"
+                    )
+                if options["once"]:
+                    break
+                time.sleep(max(0, options["interval"] - (time.monotonic() - started)))
+        except KeyboardInterrupt:
+            pass
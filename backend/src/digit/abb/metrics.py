@@ -0,0 +1,179 @@
+"""
+Prometheus metrics of the ABB integration, served in the text format by
+MetricsView at /api/abb/metrics/:
+
+- abb_upstream_request_duration_seconds: latency of the calls to the ABB
+  cloud, by the abb_api function making them and the response status. The
+  latency of a streamed response is the time to its headers.
+- abb_upstream_response_bytes: size of the bodies of those responses
+- abb_token_refreshes_total: access tokens obtained from the ABB cloud
+- abb_token_retries_total: requests retried after a 401 with a new token
+- abb_view_request_duration_seconds, abb_view_response_bytes: latency and
+  size of the responses of the views, by URL name
+- abb_cache_requests_total: lookups of the cache of the ABB views, by
+  endpoint and result (hit or miss), whose ratio is the hit ratio
+
+With several worker processes PROMETHEUS_MULTIPROC_DIR must name a directory
+shared by them and emptied before they start: each process writes its
+samples there and a scrape, served by any of them, sums all of them up.
+"""
+import asyncio
+import contextvars
+import os
+import time
+
+from functools import wraps
+from inspect import iscoroutinefunction, isgeneratorfunction
+from typing import Optional
+
+from prometheus_client import (
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# from 1 KiB to 64 MiB
+SIZE_BUCKETS = tuple(1024 * 4**i for i in range(9))
+
+UPSTREAM_DURATION = Histogram(
+    "abb_upstream_request_duration_seconds",
+    "Latency of the calls to the ABB cloud",
+    ["function", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+UPSTREAM_SIZE = Histogram(
+    "abb_upstream_response_bytes",
+    "Size of the responses of the ABB cloud",
+    ["function"],
+    buckets=SIZE_BUCKETS,
+)
+TOKEN_REFRESHES = Counter(
+    "abb_token_refreshes_total", "Access tokens obtained from the ABB cloud"
+)
+TOKEN_RETRIES = Counter(
+    "abb_token_retries_total", "Requests retried with a new token after a 401"
+)
+VIEW_DURATION = Histogram(
+    "abb_view_request_duration_seconds",
+    "Latency of the responses of the views",
+    ["view", "method", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+VIEW_SIZE = Histogram(
+    "abb_view_response_bytes",
+    "Size of the responses of the views, streamed ones excluded",
+    ["view"],
+    buckets=SIZE_BUCKETS,
+)
+CACHE_REQUESTS = Counter(
+    "abb_cache_requests_total",
+    "Lookups of the cache of the ABB views",
+    ["endpoint", "result"],
+)
+
+_function: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "abb_function", default="other"
+)
+
+
+def upstream_function(func):
+    """label the calls to the ABB cloud made by func with its name"""
+    if iscoroutinefunction(func):
+
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            token = _function.set(func.__name__)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                _function.reset(token)
+
+        return async_wrapper
+
+    if isgeneratorfunction(func):
+
+        @wraps(func)
+        def generator_wrapper(*args, **kwargs):
+            # the body of a generator, and so its calls, runs at each next()
+            generator = func(*args, **kwargs)
+            try:
+                while True:
+                    token = _function.set(func.__name__)
+                    try:
+                        item = next(generator)
+                    except StopIteration as stop:
+                        return stop.value
+                    finally:
+                        _function.reset(token)
+                    yield item
+            finally:
+                generator.close()
+
+        return generator_wrapper
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _function.set(func.__name__)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _function.reset(token)
+
+    return wrapper
+
+
+def observe_call(status: Optional[int], duration: float, size: Optional[int]) -> None:
+    """record a call to the ABB cloud, status is None if it failed"""
+    function = _function.get()
+    UPSTREAM_DURATION.labels(function, str(status or "error")).observe(duration)
+    if size is not None:
+        UPSTREAM_SIZE.labels(function).observe(size)
+
+
+def generate() -> bytes:
+    """the metrics in the Prometheus text format, of all the processes"""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+class MetricsMiddleware:
+    """record the latency and the size of the responses of the views"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # marks __call__ as returning a coroutine, as MiddlewareMixin does
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        return self.record(request, self.get_response(request), start)
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        return self.record(request, await self.get_response(request), start)
+
+    def record(self, request, response, start: float):
+        match = request.resolver_match
+        if match is None:
+            # not found, labelling it by path would explode the label values
+            return response
+        view = match.view_name
+        VIEW_DURATION.labels(view, request.method, str(response.status_code)).observe(
+            time.perf_counter() - start
+        )
+        if not response.streaming:
+            VIEW_SIZE.labels(view).observe(len(response.content))
+        return response
@@ -0,0 +1,38 @@
+# Generated by Django 4.0.2 on 2026-10-18 05:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abb', '0005_alter_site_options'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='motionasset',
+            name='baseAPI',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='motionasset',
+            name='site',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='assets', to='abb.site'),
+        ),
+        migrations.CreateModel(
+            name='MotionAssetMeasurement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('measurementTypeId', models.IntegerField()),
+                ('timestamp', models.DateTimeField()),
+                ('value', models.FloatField()),
+                ('asset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='measurements', to='abb.motionasset')),
+            ],
+            options={
+                'ordering': ['timestamp'],
+                'unique_together': {('asset', 'measurementTypeId', 'timestamp')},
+            },
+        ),
+    ]
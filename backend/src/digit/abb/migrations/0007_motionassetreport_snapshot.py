@@ -0,0 +1,35 @@
+# Generated by Django 4.0.2 on 2026-10-18 05:56
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abb', '0006_motionassetmeasurement'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='motionassetreport',
+            name='report',
+            field=models.JSONField(default=dict),
+        ),
+        migrations.AddField(
+            model_name='motionassetreport',
+            name='start_date',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='motionassetreport',
+            name='end_date',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='motionassetreport',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
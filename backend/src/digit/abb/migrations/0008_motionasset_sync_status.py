@@ -0,0 +1,30 @@
+# Generated by Django 4.0.2 on 2026-10-18 06:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("abb", "0007_motionassetreport_snapshot"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="motionasset",
+            name="sync_error",
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name="motionasset",
+            name="sync_status",
+            field=models.CharField(
+                blank=True, choices=[("ok", "Ok"), ("error", "Error")], max_length=10
+            ),
+        ),
+        migrations.AddField(
+            model_name="motionasset",
+            name="synced_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.2 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abb', '0009_site_motionasset_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='motionasset',
+            name='synced_from',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
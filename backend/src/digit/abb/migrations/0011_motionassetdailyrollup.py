@@ -0,0 +1,33 @@
+# Generated by Django 4.0.2 on 2026-10-18 06:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abb', '0010_motionasset_synced_from'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MotionAssetDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('measurementTypeId', models.IntegerField()),
+                ('count', models.IntegerField()),
+                ('sum', models.FloatField()),
+                ('min', models.FloatField()),
+                ('max', models.FloatField()),
+                ('last', models.FloatField()),
+                ('first_timestamp', models.DateTimeField()),
+                ('last_timestamp', models.DateTimeField()),
+                ('asset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='abb.motionasset')),
+            ],
+            options={
+                'unique_together': {('asset', 'day', 'measurementTypeId')},
+            },
+        ),
+    ]
@@ -0,0 +1,66 @@
+from datetime import timezone
+
+from django.db import migrations
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import TruncDate
+
+
+# max number of last values read per query
+BATCH_SIZE = 500
+
+
+def fill_daily_rollups(apps, schema_editor):
+    """compute the daily rollups of the measurements already stored"""
+    MotionAssetMeasurement = apps.get_model('abb', 'MotionAssetMeasurement')
+    MotionAssetDailyRollup = apps.get_model('abb', 'MotionAssetDailyRollup')
+    asset_ids = (
+        MotionAssetMeasurement.objects.values_list('asset_id', flat=True)
+        .distinct()
+        .order_by()
+    )
+    for asset_id in asset_ids:
+        measurements = MotionAssetMeasurement.objects.filter(asset_id=asset_id)
+        rows = list(
+            measurements.annotate(day=TruncDate('timestamp', tzinfo=timezone.utc))
+            .values('day', 'measurementTypeId')
+            .annotate(
+                count=Count('pk'),
+                sum=Sum('value'),
+                min=Min('value'),
+                max=Max('value'),
+                first_timestamp=Min('timestamp'),
+                last_timestamp=Max('timestamp'),
+            )
+            .order_by()
+        )
+        last_values = {}
+        for i in range(0, len(rows), BATCH_SIZE):
+            timestamps = {row['last_timestamp'] for row in rows[i : i + BATCH_SIZE]}
+            last_values.update(
+                ((type_id, timestamp), value)
+                for type_id, timestamp, value in measurements.filter(
+                    timestamp__in=timestamps
+                ).values_list('measurementTypeId', 'timestamp', 'value')
+            )
+        MotionAssetDailyRollup.objects.bulk_create(
+            [
+                MotionAssetDailyRollup(
+                    asset_id=asset_id,
+                    last=last_values[row['measurementTypeId'], row['last_timestamp']],
+                    **row,
+                )
+                for row in rows
+            ],
+            batch_size=BATCH_SIZE,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abb', '0011_motionassetdailyrollup'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_daily_rollups, migrations.RunPython.noop),
+    ]
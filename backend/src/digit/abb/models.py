@@ -1,4 +1,4 @@
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 
 from django.contrib.auth.models import User
 from django.db import models
@@ -12,9 +12,10 @@ class Account(models.Model):
     token = models.CharField(max_length=1500, blank=True)
     token_expiration = models.DateTimeField(null=True, blank=True)
 
-    def is_token_valid(self) -> bool:
+    def is_token_valid(self, margin: timedelta = timedelta(0)) -> bool:
+        """the token is valid for at least margin"""
         expiration = self.token and self.token_expiration
-        return expiration and expiration > datetime.now(timezone.utc)
+        return expiration and expiration > datetime.now(timezone.utc) + margin
 
     def __str__(self) -> str:
         return self.username
@@ -30,6 +31,7 @@ class Site(models.Model):
     latitude = models.FloatField(null=True, blank=True)
     longitude = models.FloatField(null=True, blank=True)
     accounts = models.ManyToManyField(Account, related_name="sites")
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ["siteName"]
@@ -55,6 +57,21 @@ class MotionAsset(models.Model):
     site = models.ForeignKey(
         Site, related_name="assets", on_delete=models.CASCADE, null=True, blank=True
     )
+    # state of the last background sync, synced_at is the time of the last
+    # successful one: measurements up to then are stored locally
+    SYNC_OK = "ok"
+    SYNC_ERROR = "error"
+    SYNC_STATUS_CHOICES = [(SYNC_OK, "Ok"), (SYNC_ERROR, "Error")]
+    sync_status = models.CharField(
+        max_length=10, choices=SYNC_STATUS_CHOICES, blank=True
+    )
+    sync_error = models.TextField(blank=True)
+    synced_at = models.DateTimeField(null=True, blank=True)
+    # start of the measurements stored without gaps, older ones are fetched
+    # again when requested
+    synced_from = models.DateTimeField(null=True, blank=True)
+    # last change of the asset, its sync state or its stored measurements
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self) -> str:
         return f"{self.site.siteName} - {self.assetName}"
@@ -67,8 +84,54 @@ class MotionAssetReport(models.Model):
     month = models.IntegerField()
     year = models.IntegerField()
     measurements = models.JSONField()
+    report = models.JSONField(default=dict)
+    start_date = models.DateTimeField(null=True, blank=True)
+    end_date = models.DateTimeField(null=True, blank=True)
     tvi = models.FloatField()
     dvi = models.FloatField()
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ["asset", "month", "year"]
+
+    def __str__(self) -> str:
+        return f"{self.asset_id} - {self.month:02d}/{self.year}"
+
+
+class MotionAssetMeasurement(models.Model):
+    asset = models.ForeignKey(
+        MotionAsset, related_name="measurements", on_delete=models.CASCADE
+    )
+    measurementTypeId = models.IntegerField()
+    timestamp = models.DateTimeField()
+    value = models.FloatField()
+
+    class Meta:
+        ordering = ["timestamp"]
+        unique_together = ["asset", "measurementTypeId", "timestamp"]
+
+    def __str__(self) -> str:
+        return f"{self.asset_id} - {self.measurementTypeId} @ {self.timestamp}"
+
+
+class MotionAssetDailyRollup(models.Model):
+    """aggregates of the measurements of a type stored for an asset in a UTC day"""
+
+    asset = models.ForeignKey(
+        MotionAsset, related_name="daily_rollups", on_delete=models.CASCADE
+    )
+    day = models.DateField()
+    measurementTypeId = models.IntegerField()
+    count = models.IntegerField()
+    sum = models.FloatField()
+    min = models.FloatField()
+    max = models.FloatField()
+    last = models.FloatField()
+    first_timestamp = models.DateTimeField()
+    last_timestamp = models.DateTimeField()
+
+    class Meta:
+        unique_together = ["asset", "day", "measurementTypeId"]
+
+    def __str__(self) -> str:
+        return f"{self.asset_id} - {self.measurementTypeId} @ {self.day}"
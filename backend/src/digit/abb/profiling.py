@@ -0,0 +1,200 @@
+"""
+Opt-in profiling of the requests, enabled by settings.ABB_PROFILING.
+
+ProfilingMiddleware records for each request the DB queries, the calls made
+to the ABB cloud and the time spent serializing and rendering the data, and
+reports them in the Server-Timing header of the response:
+
+    Server-Timing: db;dur=5.2;desc="12 queries", abb;dur=812.4;desc="2 calls",
+        serialize;dur=3.1, render;dur=0.8, total;dur=831.0
+
+and in a JSON log line of the "abb.profiling" logger, which lists every ABB
+call with its URL, status, duration and size. The profile of the request is
+kept in a context variable, so it follows the request into sync_to_async,
+async_to_sync and the threads started with run_in_context. The body of a
+streamed response is produced after the middleware returns and isn't counted.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import threading
+import time
+
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from functools import partial
+from typing import Callable, Optional
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class UpstreamCall:
+    method: str
+    url: str
+    status: Optional[int]  # None if no response was received
+    duration: float  # seconds
+    bytes: Optional[int]  # None if unknown, e.g. a streamed body
+
+
+@dataclass
+class Profile:
+    queries: int = 0
+    query_time: float = 0.0
+    calls: list[UpstreamCall] = field(default_factory=list)
+    # seconds spent in each timer
+    timers: Counter = field(default_factory=Counter)
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def server_timing(self, total: float) -> str:
+        """value of the Server-Timing header, durations in milliseconds"""
+        metrics = [
+            f'db;dur={self.query_time * 1000:.1f};desc="{self.queries} queries"',
+            f"abb;dur={sum(call.duration for call in self.calls) * 1000:.1f};"
+            f'desc="{len(self.calls)} calls"',
+            *(f"{name};dur={value * 1000:.1f}" for name, value in self.timers.items()),
+            f"total;dur={total * 1000:.1f}",
+        ]
+        return ", ".join(metrics)
+
+    def as_dict(self) -> dict:
+        """durations in milliseconds, for the log line"""
+        return {
+            "db": {"queries": self.queries, "ms": round(self.query_time * 1000, 1)},
+            "abb": [
+                {**asdict(call), "duration": round(call.duration * 1000, 1)}
+                for call in self.calls
+            ],
+            **{
+                f"{name}_ms": round(value * 1000, 1)
+                for name, value in self.timers.items()
+            },
+        }
+
+
+_profile: contextvars.ContextVar[Optional[Profile]] = contextvars.ContextVar(
+    "abb_profile", default=None
+)
+
+
+def record_call(
+    method: str,
+    url: str,
+    status: Optional[int],
+    duration: float,
+    size: Optional[int] = None,
+) -> None:
+    """record a call to the ABB cloud in the profile of the current request"""
+    profile = _profile.get()
+    if profile is None:
+        return
+    with profile.lock:
+        profile.calls.append(UpstreamCall(method, url, status, duration, size))
+
+
+@contextmanager
+def timer(name: str):
+    """add the time spent in the block to the timer name of the current request"""
+    profile = _profile.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with profile.lock:
+            profile.timers[name] += elapsed
+
+
+def run_in_context(func: Callable, *args, **kwargs) -> Callable[[], object]:
+    """
+    func bound to a copy of the current context, to be run by another thread
+    recording in the profile of the current request
+    """
+    return partial(contextvars.copy_context().run, func, *args, **kwargs)
+
+
+def _record_query(execute, sql, params, many, context):
+    profile = _profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        with profile.lock:
+            profile.queries += 1
+            profile.query_time += elapsed
+
+
+def install_query_recorder(connection, **kwargs) -> None:
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+class ProfilingMiddleware:
+    """profile the requests, see the module docstring"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.ABB_PROFILING:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # marks __call__ as returning a coroutine, as MiddlewareMixin does
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+        connection_created.connect(install_query_recorder)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        profile, token, start = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _profile.reset(token)
+        return self.finish(request, response, profile, start)
+
+    async def __acall__(self, request):
+        profile, token, start = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _profile.reset(token)
+        return self.finish(request, response, profile, start)
+
+    def start(self) -> tuple[Profile, contextvars.Token, float]:
+        # connections opened before the middleware was loaded
+        for connection in connections.all():
+            install_query_recorder(connection)
+        profile = Profile()
+        return profile, _profile.set(profile), time.perf_counter()
+
+    def finish(self, request, response, profile: Profile, start: float):
+        total = time.perf_counter() - start
+        response["Server-Timing"] = profile.server_timing(total)
+        logger.info(
+            json.dumps(
+                {
+                    "method": request.method,
+                    "path": request.get_full_path(),
+                    "status": response.status_code,
+                    "total_ms": round(total * 1000, 1),
+                    **profile.as_dict(),
+                }
+            )
+        )
+        return response
@@ -0,0 +1,182 @@
+"""
+Fast path for the JSON responses of the ABB views.
+
+serialize() returns the same data of serializer_class(instance).data, walking
+the fields of the serializer once per class instead of once per object, and
+FastJSONRenderer encodes it with orjson when it's installed. Both are
+disabled by settings.ABB_FAST_JSON = False.
+"""
+from collections.abc import Mapping
+from contextvars import ContextVar
+from datetime import datetime, timezone as dt_timezone
+from functools import lru_cache
+from operator import attrgetter
+from typing import Any, Callable
+
+from django.conf import settings
+from django.db.models import Manager
+from django.utils import timezone
+from rest_framework import ISO_8601, fields as drf_fields, serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+
+from . import profiling
+
+try:
+    import orjson
+except ImportError:  # optional, the stdlib encoder is used instead
+    orjson = None
+
+
+# DateTimeField renders in the current timezone, UTC datetimes need no
+# conversion when it's UTC
+_utc_output = ContextVar("utc_output", default=False)
+
+
+def _not_none(convert: Callable) -> Callable:
+    return lambda value: None if value is None else convert(value)
+
+
+def compile_field(field: drf_fields.Field) -> Callable[[Any], Any]:
+    """return a function converting a value as field.to_representation"""
+    if isinstance(field, serializers.ListSerializer):
+        child = compile_field(field.child)
+        return lambda items: [
+            child(item)
+            for item in (items.all() if isinstance(items, Manager) else items)
+        ]
+    if isinstance(field, serializers.Serializer):
+        return compile_serializer(field)
+    if isinstance(field, drf_fields.ListField):
+        child = _not_none(compile_field(field.child))
+        return lambda items: [child(item) for item in items]
+    # values of these types are already of their JSON type when read from
+    # the models and the dataclasses
+    if type(field) in (drf_fields.FloatField, drf_fields.IntegerField):
+        kind = float if isinstance(field, drf_fields.FloatField) else int
+        return lambda value: value if type(value) is kind else kind(value)
+    if type(field) is drf_fields.CharField:
+        return lambda value: value if type(value) is str else str(value)
+    if type(field) is drf_fields.DateTimeField:
+        return _compile_datetime_field(field)
+    return field.to_representation
+
+
+def _compile_datetime_field(field: drf_fields.DateTimeField) -> Callable:
+    """
+    UTC datetimes are the usual values and the usual output timezone: skip
+    the timezone conversion of DateTimeField for them
+    """
+    output_format = getattr(field, "format", api_settings.DATETIME_FORMAT)
+    if output_format is None or output_format.lower() != ISO_8601:
+        return field.to_representation
+    if hasattr(field, "timezone"):
+        return field.to_representation
+
+    def to_representation(value):
+        if type(value) is datetime and value.tzinfo is dt_timezone.utc:
+            if _utc_output.get():
+                return value.isoformat()[:-6] + "Z"
+        return field.to_representation(value)
+
+    return to_representation
+
+
+def _is_utc(tz) -> bool:
+    return tz is not None and str(tz) == "UTC"
+
+
+def _getter(name: str) -> Callable[[Any], Any]:
+    get_attribute = attrgetter(name)
+
+    def get(instance):
+        if type(instance) is dict:
+            return instance[name]
+        try:
+            return get_attribute(instance)
+        except AttributeError:
+            if isinstance(instance, Mapping):
+                return instance[name]
+            raise
+
+    return get
+
+
+def compile_serializer(serializer: serializers.Serializer) -> Callable[[Any], dict]:
+    """return a function converting an instance as serializer.to_representation"""
+    readers = []
+    for field in serializer._readable_fields:
+        if field.source == "*" or "." in field.source:
+            get = field.get_attribute
+        else:
+            get = _getter(field.source)
+        readers.append((field.field_name, get, compile_field(field)))
+
+    def to_representation(instance) -> dict:
+        data = {}
+        for name, get, convert in readers:
+            value = get(instance)
+            data[name] = None if value is None else convert(value)
+        return data
+
+    return to_representation
+
+
+@lru_cache(maxsize=None)
+def get_serialize_function(serializer_class: type) -> Callable[[Any], dict]:
+    return compile_serializer(serializer_class())
+
+
+def serialize(serializer_class: type, instance) -> dict:
+    """serializer_class(instance).data, computed by the fast path if enabled"""
+    with profiling.timer("serialize"):
+        return _serialize(serializer_class, instance)
+
+
+def _serialize(serializer_class: type, instance) -> dict:
+    if not settings.ABB_FAST_JSON:
+        return serializer_class(instance).data
+    # the output timezone of DateTimeField, resolved once per call
+    utc = settings.USE_TZ and _is_utc(timezone.get_current_timezone())
+    token = _utc_output.set(utc)
+    try:
+        return get_serialize_function(serializer_class)(instance)
+    finally:
+        _utc_output.reset(token)
+
+
+def _orjson_dumps(data) -> bytes:
+    ret = orjson.dumps(data)
+    # escaped by JSONRenderer, so that the JSON is valid javascript too
+    if b"\xe2\x80\xa8" in ret or b"\xe2\x80\xa9" in ret:
+        ret = ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(
+            b"\xe2\x80\xa9", b"\\u2029"
+        )
+    return ret
+
+
+def dumps(data) -> bytes:
+    """compact JSON of data, as encoded by the DRF JSONRenderer"""
+    if orjson is not None and settings.ABB_FAST_JSON:
+        return _orjson_dumps(data)
+    return JSONRenderer().render(data)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer encoding with orjson, when installed and enabled"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with profiling.timer("render"):
+            return self._render(data, accepted_media_type, renderer_context)
+
+    def _render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or not settings.ABB_FAST_JSON or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        renderer_context = renderer_context or {}
+        if self.get_indent(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            return _orjson_dumps(data)
+        except TypeError:
+            # types orjson doesn't know, e.g. lazy translations
+            return super().render(data, accepted_media_type, renderer_context)
@@ -0,0 +1,212 @@
+"""
+Resilience of the calls to the ABB cloud, applied by AbbSession and
+AsyncAbbApi to every request:
+
+- the idempotent requests failing transiently (connection errors, timeouts,
+  429 and 5xx responses) are retried up to settings.ABB_API_RETRIES times,
+  after an exponential backoff with full jitter, so that the clients of a
+  recovering upstream don't retry in lockstep
+- each account has a circuit breaker: after ABB_BREAKER_FAILURES failed calls
+  in a row the calls of the account fail fast with CircuitOpenError for
+  ABB_BREAKER_RESET seconds, then a single trial call is let through and
+  closes the breaker again if it succeeds
+
+When the ABB cloud is failing the views serve the measurements already in
+the local store, flagged as stale, and refresh_in_background fetches the new
+ones on a pool of ABB_REFRESH_WORKERS threads for the next requests.
+
+The breakers are kept in memory, each process has its own ones.
+"""
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Hashable, Optional
+
+import httpx
+import requests
+
+from django.conf import settings
+from django.db import connection
+
+
+logger = logging.getLogger(__name__)
+
+
+IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "OPTIONS"))
+
+# errors of the requests library worth a retry, a body cut short included
+TRANSIENT_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+
+
+class CircuitOpenError(requests.RequestException):
+    """the calls of the account are suspended after too many failures"""
+
+
+def is_retryable_status(status: int) -> bool:
+    return status == 429 or status >= 500
+
+
+def is_upstream_failure(error: Exception) -> bool:
+    """
+    the ABB cloud is unreachable, failing or suspended by the breaker, as
+    opposed to rejecting the request
+    """
+    if isinstance(error, (requests.HTTPError, httpx.HTTPStatusError)):
+        return error.response is not None and is_retryable_status(
+            error.response.status_code
+        )
+    return isinstance(
+        error, (CircuitOpenError, httpx.TransportError, *TRANSIENT_ERRORS)
+    )
+
+
+def get_backoff(attempt: int) -> float:
+    """seconds to wait before the retry following attempt, counted from 0"""
+    ceiling = min(
+        settings.ABB_API_RETRY_MAX_BACKOFF,
+        settings.ABB_API_RETRY_BACKOFF * 2**attempt,
+    )
+    return random.uniform(0, ceiling)
+
+
+class CircuitBreaker:
+    def __init__(self, max_failures: int, reset_timeout: float) -> None:
+        self.max_failures = max_failures
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        # start of the trial call of an open breaker
+        self.trial_at: Optional[float] = None
+        self.lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        """
+        whether a call can be made. Once the breaker has been open for
+        reset_timeout a single trial call is allowed, another one only if it
+        doesn't report its outcome within reset_timeout
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            now = time.monotonic()
+            if now - self.opened_at < self.reset_timeout:
+                return False
+            if self.trial_at is not None and now - self.trial_at < self.reset_timeout:
+                return False
+            self.trial_at = now
+            return True
+
+    def check(self) -> None:
+        if not self.allow():
+            raise CircuitOpenError(
+                f"Calls to the ABB cloud suspended after {self.failures} failures"
+            )
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.failures = 0
+            self.opened_at = self.trial_at = None
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            # a failed trial opens the breaker for another reset_timeout
+            if self.opened_at is not None or self.failures >= self.max_failures:
+                self.opened_at = time.monotonic()
+                self.trial_at = None
+
+
+_breakers: dict[int, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(account_id: int) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(account_id)
+        if breaker is None:
+            breaker = _breakers[account_id] = CircuitBreaker(
+                settings.ABB_BREAKER_FAILURES, settings.ABB_BREAKER_RESET
+            )
+        return breaker
+
+
+def reset_breakers() -> None:
+    with _breakers_lock:
+        _breakers.clear()
+
+
+_account: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar(
+    "abb_account", default=None
+)
+
+
+@contextmanager
+def account_calls(account_id: int):
+    """the calls made by AbbSession in the block go through the account breaker"""
+    token = _account.set(account_id)
+    try:
+        yield
+    finally:
+        _account.reset(token)
+
+
+def get_current_breaker() -> Optional[CircuitBreaker]:
+    account_id = _account.get()
+    return None if account_id is None else get_breaker(account_id)
+
+
+_refresh_pool: Optional[ThreadPoolExecutor] = None
+_refresh_pid: Optional[int] = None
+_refreshing: dict[Hashable, Future] = {}
+_refresh_lock = threading.Lock()
+
+
+def _run_refresh(key: Hashable, func: Callable, *args) -> None:
+    try:
+        func(*args)
+    except Exception as e:
+        if not is_upstream_failure(e):
+            logger.exception("Background refresh of %s failed", key)
+        else:
+            logger.warning("Background refresh of %s failed: %s", key, e)
+    finally:
+        with _refresh_lock:
+            _refreshing.pop(key, None)
+        connection.close()
+
+
+def refresh_in_background(key: Hashable, func: Callable, *args) -> Future:
+    """
+    run func(*args) on the refresh threads of the current process, unless the
+    refresh identified by key is already queued or running
+    """
+    global _refresh_pool, _refresh_pid
+    pid = os.getpid()
+    with _refresh_lock:
+        if _refresh_pool is None or _refresh_pid != pid:
+            _refresh_pool = ThreadPoolExecutor(
+                max_workers=settings.ABB_REFRESH_WORKERS,
+                thread_name_prefix="abb-refresh",
+            )
+            _refresh_pid = pid
+            _refreshing.clear()
+        future = _refreshing.get(key)
+        if future is None:
+            future = _refreshing[key] = _refresh_pool.submit(
+                _run_refresh, key, func, *args
+            )
+        return future
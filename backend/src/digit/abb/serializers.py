@@ -1,7 +1,10 @@
+from datetime import datetime, timezone
+
+from django.conf import settings
 from rest_framework import serializers
 from rest_framework_dataclasses.serializers import DataclassSerializer
 
-from abb import abb_api, models
+from abb import abb_api, fleet, models
 
 
 class AbbUserAccountSerializer(serializers.ModelSerializer):
@@ -13,7 +16,7 @@ class AbbUserAccountSerializer(serializers.ModelSerializer):
 class SiteSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.Site
-        exclude = ("accounts",)
+        exclude = ("accounts", "updated_at")
 
 
 class AssetSerializer(serializers.ModelSerializer):
@@ -21,7 +24,14 @@ class AssetSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = models.MotionAsset
-        fields = "__all__"
+        # the sync state is internal, sync_error holds raw upstream errors
+        exclude = (
+            "updated_at",
+            "sync_status",
+            "sync_error",
+            "synced_at",
+            "synced_from",
+        )
 
 
 class SubscriptionSerializer(DataclassSerializer):
@@ -34,6 +44,69 @@ class AssetMeasurementsSerializer(DataclassSerializer):
         dataclass = abb_api.AssetMeasurements
 
 
+class ReportQuerySerializer(serializers.Serializer):
+    month = serializers.IntegerField(min_value=1, max_value=12, required=False)
+    year = serializers.IntegerField(min_value=2000, required=False)
+    refresh = serializers.BooleanField(default=False)
+    # downsample the measurements of the reports to at most max_points
+    max_points = serializers.IntegerField(
+        min_value=2 * len(abb_api.COMBINED_POINT_KEYS), required=False
+    )
+    downsample = serializers.ChoiceField(
+        choices=list(abb_api.DOWNSAMPLING_METHODS), default="lttb"
+    )
+    # send the report as NDJSON, one line per measurement
+    stream = serializers.BooleanField(default=False)
+
+    def validate(self, attrs):
+        if ("month" in attrs) != ("year" in attrs):
+            raise serializers.ValidationError("month and year must be given together")
+        if attrs["stream"] and "max_points" in attrs:
+            raise serializers.ValidationError("stream can't be used with max_points")
+        return attrs
+
+
+class AssetReportQuerySerializer(ReportQuerySerializer):
+    """
+    report query of an asset, which can also cover the days from "from" to
+    "to" included, to today by default: they are validated as the from_date
+    and to_date UTC datetimes of the range
+    """
+
+    # send only the report values, computed from the daily rollups
+    summary = serializers.BooleanField(default=False)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        # from is a keyword, the fields can't be declared as attributes
+        fields["from"] = serializers.DateField(required=False)
+        fields["to"] = serializers.DateField(required=False)
+        return fields
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        if attrs["summary"] and (attrs["stream"] or "max_points" in attrs):
+            raise serializers.ValidationError(
+                "summary can't be used with stream or max_points"
+            )
+        if "to" in attrs and "from" not in attrs:
+            raise serializers.ValidationError("to must be given with from")
+        if "from" not in attrs:
+            return attrs
+        if "month" in attrs:
+            raise serializers.ValidationError("from can't be used with month and year")
+        start = attrs["from"]
+        end = attrs.get("to", datetime.now(timezone.utc).date())
+        if end < start:
+            raise serializers.ValidationError("to can't precede from")
+        if (end - start).days >= settings.ABB_REPORT_MAX_DAYS:
+            raise serializers.ValidationError(
+                f"the range can't be longer than {settings.ABB_REPORT_MAX_DAYS} days"
+            )
+        attrs["from_date"], attrs["to_date"] = abb_api.get_date_range(start, end)
+        return attrs
+
+
 class AssetReportSerializer(DataclassSerializer):
     asset = AssetSerializer()
 
@@ -41,9 +114,43 @@ class AssetReportSerializer(DataclassSerializer):
         dataclass = abb_api.AssetReport
 
 
+class AssetReportHeaderSerializer(DataclassSerializer):
+    asset = AssetSerializer()
+
+    class Meta:
+        dataclass = abb_api.AssetReportHeader
+
+
+class CombinedPointSerializer(DataclassSerializer):
+    class Meta:
+        dataclass = abb_api.CombinedPoint
+
+
 class AssetsSerializer(serializers.Serializer):
     assets = AssetSerializer(many=True)
 
 
 class SitesSerializer(serializers.Serializer):
     sites = SiteSerializer(many=True)
+
+
+class SiteReportsSerializer(serializers.Serializer):
+    reports = AssetReportSerializer(many=True)
+
+
+class FleetReportQuerySerializer(serializers.Serializer):
+    month = serializers.IntegerField(min_value=1, max_value=12, required=False)
+    year = serializers.IntegerField(min_value=2000, required=False)
+    refresh = serializers.BooleanField(default=False)
+    # the reports of all the accounts instead of the user's one, staff only
+    all = serializers.BooleanField(default=False)
+
+    def validate(self, attrs):
+        if ("month" in attrs) != ("year" in attrs):
+            raise serializers.ValidationError("month and year must be given together")
+        return attrs
+
+
+class FleetReportSerializer(DataclassSerializer):
+    class Meta:
+        dataclass = fleet.FleetReport
@@ -0,0 +1,153 @@
+"""
+Background sync of the ABB cloud data into the local store, run periodically
+by `manage.py abb_sync` so that the views read fresh data without waiting on
+the upstream.
+"""
+import logging
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from functools import wraps
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, F, Q, Value, When
+
+from . import abb_api as abb, models
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SyncResult:
+    accounts: int = 0
+    assets: int = 0
+    points: int = 0
+    errors: int = 0
+
+
+def closing_connection(func):
+    """close the DB connection opened by the worker thread running func"""
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            connection.close()
+
+    return wrapper
+
+
+def create_account_api(account: models.Account, rate_limit: float) -> abb.AbbApi:
+    """AbbApi with its own session, making at most rate_limit requests/s"""
+    session = abb.AbbSession(
+        pool_size=settings.ABB_API_POOL_SIZE,
+        timeout=(settings.ABB_API_CONNECT_TIMEOUT, settings.ABB_API_READ_TIMEOUT),
+        rate_limiter=abb.RateLimiter(rate_limit),
+    )
+    return abb.AbbApi(account, session)
+
+
+@closing_connection
+def sync_account_inventory(api: abb.AbbApi) -> list[models.MotionAsset]:
+    """
+    refresh the sites, the motion assets and the subscriptions of the account,
+    return its motion assets
+    """
+    assets = []
+    for site in api.get_sites(force_reload=True):
+        assets.extend(api.get_motionassets(site.siteId, force_reload=True))
+    subscriptions = api.get_subscriptions(force_reload=True)
+    logger.info(
+        "Account %s: %d assets, %d subscriptions",
+        api.account,
+        len(assets),
+        len(subscriptions),
+    )
+    return assets
+
+
+@closing_connection
+def sync_asset(
+    api: abb.AbbApi,
+    asset: models.MotionAsset,
+    from_date: datetime,
+    to_date: datetime,
+) -> int:
+    """
+    store the new measurements of the asset and record the sync outcome on
+    it, return the number of new points
+    """
+    try:
+        stored = api.sync_asset_measurements(asset.motionAssetId, from_date, to_date)
+    except Exception as e:
+        record_sync(asset, models.MotionAsset.SYNC_ERROR, str(e))
+        raise
+    record_sync(asset, models.MotionAsset.SYNC_OK, synced_at=to_date)
+    return stored
+
+
+def record_sync(asset: models.MotionAsset, status: str, error: str = "", **fields):
+    """
+    record the outcome of a sync on the asset. Its updated_at, which the
+    versions of the data computed from it depend on, changes only with the
+    status: the new points have changed it already.
+    """
+    models.MotionAsset.objects.filter(pk=asset.pk).update(
+        sync_status=status,
+        sync_error=error,
+        updated_at=Case(
+            When(~Q(sync_status=status), then=Value(datetime.now(timezone.utc))),
+            default=F("updated_at"),
+        ),
+        **fields,
+    )
+
+
+def sync_all(workers: int = None, rate_limit: float = None) -> SyncResult:
+    """
+    Refresh sites, assets, subscriptions and the measurements since the start
+    of the last complete month for every account, on a pool of worker
+    threads. Requests are rate limited per account, so a slow or throttled
+    account doesn't use up the pool and no account exceeds its quota.
+    A failure is logged and recorded on its asset, the others go on.
+    """
+    workers = workers or settings.ABB_SYNC_WORKERS
+    rate_limit = rate_limit or settings.ABB_SYNC_RATE_LIMIT
+    from_date, _ = abb.get_last_complete_month()
+    to_date = datetime.now(timezone.utc)
+    apis = [
+        create_account_api(account, rate_limit)
+        for account in models.Account.objects.all()
+    ]
+    result = SyncResult(accounts=len(apis))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        inventories = {pool.submit(sync_account_inventory, api): api for api in apis}
+        # assets shared by more accounts are synced once
+        synced = {}
+        for future in as_completed(inventories):
+            api = inventories[future]
+            try:
+                assets = future.result()
+            except Exception:
+                logger.exception("Sync of account %s failed", api.account)
+                result.errors += 1
+                continue
+            for asset in assets:
+                if asset.pk not in synced:
+                    synced[asset.pk] = pool.submit(
+                        sync_asset, api, asset, from_date, to_date
+                    )
+        for assetId, future in synced.items():
+            try:
+                result.points += future.result()
+                result.assets += 1
+            except Exception:
+                logger.exception("Sync of asset %s failed", assetId)
+                result.errors += 1
+    for api in apis:
+        api.session.close()
+    return result
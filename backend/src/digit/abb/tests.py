@@ -1,12 +1,55 @@
+import asyncio
+import json
 import os
+import random
+import threading
+import time
+import tracemalloc
 
+from dataclasses import asdict
+from io import StringIO
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+import numpy as np
+import requests
+import responses
+
+from asgiref.sync import async_to_sync
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import CommandError, call_command
+from django.http import HttpResponse, JsonResponse
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, resolve
+from django.utils.timezone import override as timezone_override
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.serializer_helpers import ReturnDict
 from rest_framework.views import APIView
-from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.tokens import AccessToken
 
 
-from abb import abb_api as api, models, views
+from abb import (
+    abb_api as api,
+    async_api,
+    cache,
+    fleet,
+    metrics,
+    models,
+    profiling,
+    renderers,
+    resilience,
+    serializers,
+    sync,
+    urls as abb_urls,
+    views,
+)
 
 
 USERNAME = os.getenv("ABB_USERNAME")
@@ -77,3 +120,2426 @@ class ApiEndpointsTest(TestCase):
         self.assertIsInstance(asset.assetName, str)
         self.assertIsInstance(asset.baseAPI, int)
         self.assertIsInstance(asset.description, str)
+
+
+def measurement_payload(points: dict) -> dict:
+    """build a /Measurement response with the given {typeId: [(tstamp, value)]}"""
+    return {
+        "payload": [
+            {
+                "baseInfo": {"assetId": "30879", "assetName": "coclea"},
+                "measurements": [
+                    {
+                        "baseInfo": {
+                            "measurementTypeId": str(type_id),
+                            "measurementTypeName": "",
+                            "unit": "",
+                            "startTime": values[0][0].isoformat(),
+                            "endTime": values[-1][0].isoformat(),
+                        },
+                        "dataPoints": [
+                            {
+                                "measurementValue": str(value),
+                                "timestamp": tstamp.isoformat(),
+                            }
+                            for tstamp, value in values
+                        ],
+                    }
+                    for type_id, values in points.items()
+                ],
+            }
+        ]
+    }
+
+
+class AssetMeasurementsStoreTest(TestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+        user = User.objects.create_user(username="test", password="test")
+        self.account = models.Account.objects.create(
+            user=user,
+            username="abb",
+            password="abb",
+            token="token",
+            token_expiration=datetime.now(timezone.utc) + timedelta(hours=1),
+        )
+        site = models.Site.objects.create(siteId="12440", siteName="Depuratore")
+        self.account.sites.add(site)
+        self.asset = models.MotionAsset.objects.create(
+            motionAssetId="e197cdae", assetId="30879", assetName="coclea", site=site
+        )
+        self.from_date, self.to_date = api.get_last_complete_month()
+
+    def points(self, start: int, stop: int) -> dict:
+        return {
+            type_id: [
+                (self.from_date + timedelta(hours=i), float(i))
+                for i in range(start, stop)
+            ]
+            for type_id in api.MEASUREMENT_TYPES.values()
+        }
+
+    def add_response(self, points: dict):
+        responses.add(
+            responses.GET,
+            f"{api.API_URL}/Measurement",
+            json=measurement_payload(points),
+        )
+
+    @responses.activate
+    def test_sync_stores_points(self):
+        self.add_response(self.points(0, 10))
+        stored = api.sync_asset_measurements(
+            self.account, self.asset, self.from_date, self.to_date
+        )
+        self.assertEqual(stored, 10 * len(api.MEASUREMENT_TYPES))
+        self.assertEqual(models.MotionAssetMeasurement.objects.count(), stored)
+
+    @responses.activate
+    @mock.patch("abb.abb_api.STORE_BATCH_SIZE", 3)
+    def test_sync_stores_points_in_batches(self):
+        self.add_response(self.points(0, 10))
+        with CaptureQueriesContext(connection) as queries:
+            stored = api.sync_asset_measurements(
+                self.account, self.asset, self.from_date, self.to_date
+            )
+        self.assertEqual(stored, 10 * len(api.MEASUREMENT_TYPES))
+        self.assertEqual(models.MotionAssetMeasurement.objects.count(), stored)
+        inserts = [
+            q
+            for q in queries
+            if q["sql"].startswith("INSERT")
+            and "abb_motionassetmeasurement" in q["sql"]
+        ]
+        self.assertEqual(len(inserts), -(-stored // 3))
+
+    @responses.activate
+    def test_sync_fetches_only_new_points(self):
+        self.add_response(self.points(0, 10))
+        api.sync_asset_measurements(
+            self.account, self.asset, self.from_date, self.to_date
+        )
+        # the cloud returns also already stored points: they must be skipped
+        self.add_response(self.points(5, 15))
+        stored = api.sync_asset_measurements(
+            self.account, self.asset, self.from_date, self.to_date
+        )
+        self.assertEqual(stored, 5 * len(api.MEASUREMENT_TYPES))
+        self.assertEqual(len(responses.calls), 2)
+        params = parse_qs(urlparse(responses.calls[1].request.url).query)
+        last = self.from_date + timedelta(hours=9, seconds=1)
+        self.assertEqual(params["from"], [last.strftime(api.FMT_DT)])
+
+    @responses.activate
+    def test_sync_skips_up_to_date_asset(self):
+        self.add_response(
+            {
+                type_id: [(self.to_date, 1.0)]
+                for type_id in api.MEASUREMENT_TYPES.values()
+            }
+        )
+        api.sync_asset_measurements(
+            self.account, self.asset, self.from_date, self.to_date
+        )
+        api.sync_asset_measurements(
+            self.account, self.asset, self.from_date, self.to_date
+        )
+        self.assertEqual(len(responses.calls), 1)
+
+    @responses.activate
+    def test_report_from_store(self):
+        self.add_response(self.points(0, 10))
+        report = api.AbbApi(self.account).get_asset_report(self.asset.motionAssetId)
+        self.assertEqual(report.asset, self.asset)
+        self.assertEqual(len(report.measurements), 10)
+        self.assertEqual(report.report.max_tot_time, 9.0)
+        self.assertEqual(report.report.avg_acc_x, 4.5)
+
+
+class MeasurementStreamTest(TestCase):
+    def setUp(self):
+        start = datetime(2022, 1, 1, tzinfo=timezone.utc)
+        self.body = measurement_payload(
+            {
+                type_id: [(start + timedelta(minutes=i), i / 7) for i in range(20)]
+                for type_id in api.MEASUREMENT_TYPES.values()
+            }
+        )
+        # keys and values the streaming parser must skip
+        self.body["payload"][0]["baseInfo"]["assetName"] = "coclea di ricircolo è"
+        self.body["payload"][0]["measurements"][0]["dataPoints"][0]["flags"] = [1, {}]
+        self.body["total"] = 123456789
+
+    def chunks(self, body: bytes, size: int) -> list[bytes]:
+        return [body[i : i + size] for i in range(0, len(body), size)]
+
+    def test_points_as_parsed_whole(self):
+        expected = [
+            (measure.info, point)
+            for measure in api.parse_asset_measurements(self.body).measurements
+            for point in measure.data
+        ]
+        for indent in (None, 2):
+            body = json.dumps(self.body, indent=indent, ensure_ascii=False).encode()
+            for size in (1, 7, 4096):
+                with self.subTest(indent=indent, size=size):
+                    points = api.iter_measurement_points(self.chunks(body, size))
+                    self.assertEqual(list(points), expected)
+
+    def test_truncated_body(self):
+        body = json.dumps(self.body).encode()[:-10]
+        with self.assertRaises(ValueError):
+            list(api.iter_measurement_points(self.chunks(body, 64)))
+
+
+class MeasurementSeriesTest(TestCase):
+    def setUp(self):
+        start = datetime(2022, 1, 1, tzinfo=timezone.utc)
+        self.body = json.dumps(
+            measurement_payload(
+                {33: [(start + timedelta(minutes=i), i / 7) for i in range(10000)]}
+            )
+        )
+
+    def retained_memory(self, parse) -> int:
+        """bytes still allocated by parse once the body is released"""
+        tracemalloc.start()
+        body = json.loads(self.body)
+        data = parse(body)
+        del body
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.assertTrue(data)
+        return memory
+
+    def test_sequence_view(self):
+        series = (
+            api.parse_asset_measurements(json.loads(self.body)).measurements[0].data
+        )
+        self.assertIsInstance(series, api.MeasurementSeries)
+        self.assertEqual(len(series), 10000)
+        self.assertEqual(
+            series[1],
+            api.MeasurementPoint(
+                1 / 7, datetime(2022, 1, 1, 0, 1, tzinfo=timezone.utc)
+            ),
+        )
+        self.assertEqual(series[-1].value, 9999 / 7)
+        self.assertEqual(list(series[:3]), list(series)[:3])
+        self.assertEqual(series[:3], list(series)[:3])
+
+    def test_serialized(self):
+        data = api.parse_asset_measurements(json.loads(self.body))
+        serialized = serializers.AssetMeasurementsSerializer(data).data
+        points = serialized["measurements"][0]["data"]
+        self.assertEqual(len(points), 10000)
+        self.assertEqual(points[1]["value"], 1 / 7)
+        self.assertEqual(points[1]["timestamp"], "2022-01-01T00:01:00Z")
+
+    def test_memory_per_point(self):
+        def parse_points(body):
+            # previous representation: a dataclass per point with the timestamp
+            # string of the response
+            return [
+                api.MeasurementPoint(
+                    value=float(point["measurementValue"]),
+                    timestamp=point["timestamp"],
+                )
+                for point in body["payload"][0]["measurements"][0]["dataPoints"]
+            ]
+
+        compact = self.retained_memory(api.parse_asset_measurements)
+        points = self.retained_memory(parse_points)
+        self.assertLess(compact / 10000, 20)
+        self.assertGreater(points / compact, 10)
+
+
+class SessionTest(TestCase):
+    def test_session_shared_by_threads(self):
+        sessions = []
+        threads = [
+            threading.Thread(target=lambda: sessions.append(api.get_session()))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len({id(session) for session in sessions}), 1)
+
+    def test_abb_api_uses_shared_session(self):
+        user = User.objects.create_user(username="test", password="test")
+        account = models.Account.objects.create(
+            user=user, username="abb", password="abb"
+        )
+        self.assertIs(api.AbbApi(account).session, api.get_session())
+
+
+class AsyncAbbApiTest(TestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+        user = User.objects.create_user(username="test", password="test")
+        self.account = models.Account.objects.create(
+            user=user,
+            username="abb",
+            password="abb",
+            token="token",
+            token_expiration=datetime.now(timezone.utc) + timedelta(hours=1),
+        )
+        site = models.Site.objects.create(siteId="12440", siteName="Depuratore")
+        self.account.sites.add(site)
+        for i in range(6):
+            models.MotionAsset.objects.create(
+                motionAssetId=f"asset-{i}", assetId=str(i), site=site
+            )
+        from_date, _ = api.get_last_complete_month()
+        self.payload = measurement_payload(
+            {
+                type_id: [(from_date + timedelta(hours=i), float(i)) for i in range(5)]
+                for type_id in api.MEASUREMENT_TYPES.values()
+            }
+        )
+        self.in_flight = self.max_in_flight = 0
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        return httpx.Response(200, json=self.payload)
+
+    def create_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=api.API_URL, transport=httpx.MockTransport(self.handler)
+        )
+
+    def get_site_reports(self, max_concurrency: int):
+        async def run():
+            async with async_api.AsyncAbbApi(
+                self.account, self.create_client(), max_concurrency
+            ) as abb:
+                return await abb.get_site_reports("12440")
+
+        return async_to_sync(run)()
+
+    def test_site_reports(self):
+        reports = self.get_site_reports(max_concurrency=3)
+        self.assertEqual(len(reports), 6)
+        self.assertEqual(models.MotionAssetMeasurement.objects.count(), 6 * 5 * 5)
+        self.assertEqual(reports[0].report.max_tot_time, 4.0)
+
+    def test_concurrency_limit(self):
+        self.get_site_reports(max_concurrency=3)
+        self.assertEqual(self.max_in_flight, 3)
+
+    @responses.activate
+    def test_token_refreshed_once_on_401(self):
+        responses.add(
+            responses.POST,
+            f"{api.API_URL}/Auth/ConnectAccount",
+            json={"payload": {"accessToken": "new", "expiration": 3600}},
+        )
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            if request.headers["Authorization"] != "Bearer new":
+                return httpx.Response(401)
+            return httpx.Response(200, json=self.payload)
+
+        self.handler = handler
+        reports = self.get_site_reports(max_concurrency=6)
+        self.assertEqual(len(reports), 6)
+        self.assertEqual(len(responses.calls), 1)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.token, "new")
+
+    def test_site_reports_view(self):
+        client = self.create_client()
+        request = APIRequestFactory().get("/api/abb/site/12440/reports/")
+        force_authenticate(request, user=self.account.user)
+        with mock.patch.object(async_api, "create_client", return_value=client):
+            response = views.SiteReportsView.as_view()(request, siteId="12440")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["reports"]), 6)
+        self.assertTrue(client.is_closed)
+
+    def test_shared_client(self):
+        async def run():
+            reports = []
+            for _ in range(2):
+                async with async_api.AsyncAbbApi(self.account) as abb:
+                    reports.append(
+                        await abb.get_site_reports("12440", force_reload=True)
+                    )
+                    self.assertFalse(abb.client.is_closed)
+            return abb.client, reports
+
+        with mock.patch.object(
+            async_api, "create_client", side_effect=self.create_client
+        ) as create:
+            client, reports = async_to_sync(run)()
+        self.assertEqual(create.call_count, 1)
+        self.assertEqual([len(r) for r in reports], [6, 6])
+        # closed with the loop of async_to_sync
+        self.assertTrue(client.is_closed)
+
+        async def close():
+            client = await async_api.get_client()
+            await async_api.close_client()
+            return client
+
+        with mock.patch.object(
+            async_api, "create_client", side_effect=self.create_client
+        ):
+            self.assertTrue(async_to_sync(close)().is_closed)
+
+    def test_lifespan_closes_client(self):
+        from config import asgi
+
+        async def run():
+            client = await async_api.get_client()
+            messages = [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]
+            sent = []
+
+            async def receive():
+                return messages.pop(0)
+
+            async def send(message):
+                sent.append(message["type"])
+
+            await asgi.application({"type": "lifespan"}, receive, send)
+            return client, sent
+
+        with mock.patch.object(
+            async_api, "create_client", side_effect=self.create_client
+        ):
+            client, sent = async_to_sync(run)()
+        self.assertTrue(client.is_closed)
+        self.assertEqual(
+            sent, ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+        )
+
+
+class ReportEngineTest(TestCase):
+    def make_measurements(self, lengths: dict) -> api.AssetMeasurements:
+        start = datetime(2022, 1, 1, tzinfo=timezone.utc)
+        measurements = []
+        for key, length in lengths.items():
+            type_id = next(k for k, v in api.MEASUREMENT_TYPES_IDS.items() if v == key)
+            info = api.MeasurementInfo(type_id, key, "", "", "")
+            data = [
+                api.MeasurementPoint(
+                    random.random(), (start + timedelta(minutes=i)).isoformat()
+                )
+                for i in range(length)
+            ]
+            measurements.append(api.Measurement(info, data))
+        return api.AssetMeasurements("30879", "coclea", measurements)
+
+    def test_report_values(self):
+        data = self.make_measurements(
+            {key: 1000 for key in api.MEASUREMENT_TYPES_IDS.values()}
+        )
+        report = api.elaborate_report_data(data, models.MotionAsset()).report
+        values = {
+            api.MEASUREMENT_TYPES_IDS[m.info.measurementTypeId]: [
+                p.value for p in m.data
+            ]
+            for m in data.measurements
+        }
+        self.assertEqual(report.max_tot_time, max(values["tot_time"]))
+        self.assertEqual(report.tot_run_time, sum(values["run_time"]) / 60)
+        self.assertEqual(report.avg_acc_x, sum(values["acc_x"]) / 1000)
+        self.assertEqual(report.avg_acc_y, sum(values["acc_y"]) / 1000)
+        self.assertEqual(report.avg_acc_z, sum(values["acc_z"]) / 1000)
+
+    def test_series_not_truncated_to_shortest(self):
+        lengths = {key: 10 for key in api.MEASUREMENT_TYPES_IDS.values()}
+        lengths["acc_y"] = 7
+        data = self.make_measurements(lengths)
+        report = api.elaborate_report_data(data, models.MotionAsset())
+        self.assertEqual(len(report.measurements), 10)
+        self.assertEqual(report.end_date, data.measurements[0].data[9].timestamp)
+        self.assertIsNone(report.measurements[8].acc_y)
+        self.assertEqual(
+            report.measurements[8].acc_x, data.measurements[0].data[8].value
+        )
+        acc_y = [p.value for p in data.measurements[1].data]
+        self.assertEqual(report.report.avg_acc_y, sum(acc_y) / 7)
+
+    def test_epoch_column(self):
+        data = self.make_measurements({"acc_x": 3})
+        points = list(api.merge_measurements(api.get_series(data)))
+        columns = api.get_report_columns(points)
+        self.assertEqual(columns.epoch.dtype, np.int64)
+        self.assertEqual(columns.epoch.tolist(), [1640995200, 1640995260, 1640995320])
+
+
+class DownsampleTest(TestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+
+    def make_report(self, length: int) -> api.AssetReport:
+        start = datetime(2022, 1, 1, tzinfo=timezone.utc)
+        rng = np.random.default_rng(0)
+        measurements = [
+            api.Measurement(
+                api.MeasurementInfo(type_id, key, "", "", ""),
+                [
+                    api.MeasurementPoint(value, start + timedelta(minutes=i))
+                    for i, value in enumerate(rng.random(length))
+                ],
+            )
+            for type_id, key in api.MEASUREMENT_TYPES_IDS.items()
+        ]
+        # a spike on a single channel
+        measurements[2].data[length // 3].value = 100.0
+        data = api.AssetMeasurements("30879", "coclea", measurements)
+        return api.elaborate_report_data(data, models.MotionAsset())
+
+    def test_lttb_keeps_spike(self):
+        x = np.arange(1000, dtype=np.float64)
+        y = np.zeros(1000)
+        y[537] = 5.0
+        indices = api.lttb_indices(x, y, 50)
+        self.assertEqual(len(indices), 50)
+        self.assertEqual(indices[0], 0)
+        self.assertEqual(indices[-1], 999)
+        self.assertIn(537, indices)
+        self.assertTrue((np.diff(indices) > 0).all())
+
+    def test_minmax_keeps_extremes(self):
+        y = np.random.default_rng(0).random(1000)
+        indices = api.minmax_indices(np.arange(1000), y, 20)
+        self.assertLessEqual(len(indices), 20)
+        self.assertIn(y.argmin(), indices)
+        self.assertIn(y.argmax(), indices)
+        self.assertTrue((np.diff(indices) > 0).all())
+
+    def test_report_bounded(self):
+        report = self.make_report(5000)
+        for method in api.DOWNSAMPLING_METHODS:
+            with self.subTest(method=method):
+                sampled = api.downsample_report(report, 200, method)
+                self.assertLessEqual(len(sampled.measurements), 200)
+                self.assertEqual(sampled.report, report.report)
+                spikes = [
+                    point
+                    for point in sampled.measurements
+                    if point.acc_z == 100.0 or point.acc_y == 100.0
+                ]
+                self.assertEqual(len(spikes), 1)
+        self.assertIs(api.downsample_report(report, 5000), report)
+
+    def test_view_max_points(self):
+        user = User.objects.create_user(username="test", password="test")
+        models.Account.objects.create(user=user, username="abb", password="abb")
+        report = self.make_report(5000)
+        request = APIRequestFactory().get(
+            "/api/abb/site/12440/asset/e197cdae/", {"max_points": 100}
+        )
+        force_authenticate(request, user=user)
+        with mock.patch.object(api.AbbApi, "get_asset_report", return_value=report):
+            response = views.AssetDataView.as_view()(
+                request, siteId="12440", assetId="e197cdae"
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(response.data["measurements"]), 100)
+
+    def test_view_errors(self):
+        user = User.objects.create_user(username="test", password="test")
+        models.Account.objects.create(user=user, username="abb", password="abb")
+        request = APIRequestFactory().get("/api/abb/site/12440/asset/e197cdae/")
+        force_authenticate(request, user=user)
+        with mock.patch.object(
+            api.AbbApi,
+            "get_asset_report",
+            side_effect=api.NoMeasurementsError("No measurements found"),
+        ):
+            response = views.AssetDataView.as_view()(
+                request, siteId="12440", assetId="e197cdae"
+            )
+        self.assertEqual(response.status_code, 404)
+        # not mistaken for missing data
+        error = ValueError("Unexpected end of JSON stream")
+        with mock.patch.object(api.AbbApi, "get_asset_report", side_effect=error):
+            with self.assertRaises(ValueError):
+                views.AssetDataView.as_view()(
+                    request, siteId="12440", assetId="e197cdae"
+                )
+
+
+class FastRenderTest(TestCase):
+    def setUp(self):
+        site = models.Site(siteId="12440", siteName="Depuratore", latitude=45.4)
+        self.assets = [
+            models.MotionAsset(
+                motionAssetId=f"asset-{i}",
+                assetId=str(i),
+                assetName=f"coclea è {i}",
+                baseAPI=1,
+                site=site,
+                sync_status=models.MotionAsset.SYNC_OK,
+                synced_at=datetime(2022, 3, 1, 12, 30, tzinfo=timezone.utc),
+            )
+            for i in range(10)
+        ]
+        start = datetime(2022, 2, 1, tzinfo=timezone.utc)
+        points = [
+            api.CombinedPoint(
+                start + timedelta(minutes=i), i / 7, None if i % 5 else 1, i, i, 0.0
+            )
+            for i in range(1000)
+        ]
+        self.report = api.AssetReport(
+            self.assets[0],
+            start,
+            points[-1].tstamp,
+            points,
+            api.ReportData(1.0, 2.5, 1 / 3, 0.1, 0.2, 0, 0),
+        )
+
+    def assertRenderedAsDrf(self, serializer_class, instance):
+        expected = serializer_class(instance).data
+        data = renderers.serialize(serializer_class, instance)
+        self.assertEqual(data, expected)
+        self.assertEqual(list(data), list(expected))
+        self.assertEqual(
+            renderers.FastJSONRenderer().render(data),
+            JSONRenderer().render(expected),
+        )
+
+    def test_report(self):
+        self.assertRenderedAsDrf(serializers.AssetReportSerializer, self.report)
+
+    def test_assets(self):
+        self.assertRenderedAsDrf(serializers.AssetsSerializer, {"assets": self.assets})
+
+    def test_sync_state_not_exposed(self):
+        data = renderers.serialize(
+            serializers.AssetsSerializer, {"assets": self.assets}
+        )
+        for field in ("sync_status", "sync_error", "synced_at", "synced_from"):
+            with self.subTest(field=field):
+                self.assertNotIn(field, data["assets"][0])
+
+    def test_sites(self):
+        sites = [self.assets[0].site, models.Site(siteId="1", siteName="\u2028")]
+        self.assertRenderedAsDrf(serializers.SitesSerializer, {"sites": sites})
+
+    def test_local_timezone(self):
+        with timezone_override("Europe/Rome"):
+            self.assertRenderedAsDrf(serializers.AssetReportSerializer, self.report)
+
+    def test_disabled(self):
+        with self.settings(ABB_FAST_JSON=False):
+            data = renderers.serialize(serializers.AssetReportSerializer, self.report)
+            self.assertIsInstance(data, ReturnDict)
+            self.assertEqual(
+                renderers.FastJSONRenderer().render(data), JSONRenderer().render(data)
+            )
+
+
+class MergeMeasurementsTest(TestCase):
+    start = datetime(2022, 1, 1, tzinfo=timezone.utc)
+
+    def series(self, *offsets: int):
+        """generator of points at the given offsets in seconds from start"""
+        for offset in offsets:
+            yield api.MeasurementPoint(
+                float(offset), self.start + timedelta(seconds=offset)
+            )
+
+    def test_exact_join(self):
+        points = list(
+            api.merge_measurements(
+                {"acc_x": self.series(0, 60, 120), "acc_y": self.series(0, 120)}
+            )
+        )
+        self.assertEqual(len(points), 3)
+        self.assertEqual([p.acc_x for p in points], [0.0, 60.0, 120.0])
+        self.assertEqual([p.acc_y for p in points], [0.0, None, 120.0])
+        self.assertEqual([p.run_time for p in points], [None, None, None])
+        self.assertEqual(points[1].tstamp, self.start + timedelta(seconds=60))
+
+    def test_join_within_tolerance(self):
+        series = {
+            "acc_x": self.series(0, 60, 120),
+            "acc_z": self.series(2, 65, 119),
+            "run_time": self.series(3, 300),
+        }
+        points = list(api.merge_measurements(series, tolerance=timedelta(seconds=3)))
+        self.assertEqual([p.acc_x for p in points], [0.0, 60.0, None, 120.0, None])
+        self.assertEqual([p.acc_z for p in points], [2.0, None, 65.0, 119.0, None])
+        self.assertEqual([p.run_time for p in points], [3.0, None, None, None, 300.0])
+        # each row starts at its earliest point
+        self.assertEqual(points[3].tstamp, self.start + timedelta(seconds=119))
+
+    def test_same_series_never_joined(self):
+        points = list(
+            api.merge_measurements(
+                {"acc_x": self.series(0, 1, 2)}, tolerance=timedelta(seconds=10)
+            )
+        )
+        self.assertEqual([p.acc_x for p in points], [0.0, 1.0, 2.0])
+
+    def test_string_timestamps(self):
+        series = {
+            "acc_x": [api.MeasurementPoint(1.0, "2022-01-01T01:00:00+01:00")],
+            "acc_y": [api.MeasurementPoint(2.0, "2022-01-01T00:00:00+00:00")],
+        }
+        points = list(api.merge_measurements(series))
+        self.assertEqual(len(points), 1)
+        self.assertEqual((points[0].acc_x, points[0].acc_y), (1.0, 2.0))
+
+    def measurement_series(self, *offsets: int) -> api.MeasurementSeries:
+        series = api.MeasurementSeries()
+        for point in self.series(*offsets):
+            series.append(point.timestamp, point.value)
+        return series
+
+    def test_series_joined_on_arrays(self):
+        offsets = {"acc_x": (0, 60, 120, 180), "acc_y": (0, 120), "tot_time": (90,)}
+        series = {key: self.measurement_series(*o) for key, o in offsets.items()}
+        with mock.patch.object(api, "MERGE_CHUNK_SIZE", 2):
+            points = api.merge_measurements(series)
+            self.assertNotIsInstance(points, list)
+            points = list(points)
+        expected = list(
+            api.merge_measurements({k: self.series(*o) for k, o in offsets.items()})
+        )
+        self.assertEqual(points, expected)
+        self.assertEqual([p.tot_time for p in points], [None, None, 90.0, None, None])
+        self.assertEqual(points[2].tstamp, self.start + timedelta(seconds=90))
+
+    def test_series_merged_by_epoch(self):
+        # a tolerance, or a repeated timestamp, needs the merge point by point
+        cases = [
+            ({"acc_x": (0, 60), "acc_z": (2, 61)}, timedelta(seconds=3)),
+            ({"acc_x": (0, 0, 60), "acc_y": (0, 60)}, timedelta(0)),
+        ]
+        for offsets, tolerance in cases:
+            series = {key: self.measurement_series(*o) for key, o in offsets.items()}
+            points = list(api.merge_measurements(series, tolerance))
+            expected = api.merge_measurements(
+                {k: self.series(*o) for k, o in offsets.items()}, tolerance
+            )
+            self.assertEqual(points, list(expected))
+        self.assertIsNone(api.join_series(series))
+        # the datetimes are built by row, not by point
+        self.assertEqual(
+            next(api._timed_points(series["acc_x"], epochs=True)),
+            (int(self.start.timestamp()), 0.0, None),
+        )
+
+
+class ReportSnapshotTest(AssetMeasurementsStoreTest):
+    def get_report(self, **kwargs) -> api.AssetReport:
+        return api.AbbApi(self.account).get_asset_report(
+            self.asset.motionAssetId, **kwargs
+        )
+
+    @responses.activate
+    def test_closed_month_served_from_snapshot(self):
+        self.add_response(self.points(0, 10))
+        report = self.get_report()
+        self.assertEqual(models.MotionAssetReport.objects.count(), 1)
+        calls = len(responses.calls)
+        cached = self.get_report()
+        self.assertEqual(len(responses.calls), calls)
+        self.assertEqual(cached.measurements, report.measurements)
+        self.assertEqual(cached.report, report.report)
+        self.assertEqual(cached.start_date, report.start_date)
+
+    @responses.activate
+    def test_force_reload_recomputes(self):
+        self.add_response(self.points(0, 10))
+        self.get_report()
+        calls = len(responses.calls)
+        self.get_report(force_reload=True)
+        self.assertGreater(len(responses.calls), calls)
+        self.assertEqual(models.MotionAssetReport.objects.count(), 1)
+
+    @responses.activate
+    def test_late_points_invalidate_snapshot(self):
+        self.add_response(self.points(0, 10))
+        self.get_report()
+        # a point of the same month stored by a later sync
+        models.MotionAssetMeasurement.objects.filter(
+            timestamp__gte=self.from_date + timedelta(hours=9)
+        ).delete()
+        api.sync_asset_measurements(self.account, self.asset)
+        self.assertFalse(models.MotionAssetReport.objects.exists())
+
+    @responses.activate
+    def test_open_month_not_stored(self):
+        now = datetime.now(timezone.utc)
+        self.add_response(self.points(0, 10))
+        with self.assertRaises(ValueError):
+            self.get_report(month=now.month, year=now.year)
+        self.assertFalse(models.MotionAssetReport.objects.exists())
+
+    def test_month_and_year_required_together(self):
+        request = APIRequestFactory().get("/", {"month": 1})
+        force_authenticate(request, user=self.account.user)
+        response = views.AssetDataView.as_view()(
+            request, siteId="12440", assetId=self.asset.motionAssetId
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class DailyRollupTest(AssetMeasurementsStoreTest):
+    def rollups(self, type_id: int = 31) -> list[models.MotionAssetDailyRollup]:
+        return list(
+            models.MotionAssetDailyRollup.objects.filter(
+                measurementTypeId=type_id
+            ).order_by("day")
+        )
+
+    @responses.activate
+    def test_rollups_of_stored_points(self):
+        self.add_response(self.points(0, 50))
+        api.sync_asset_measurements(self.account, self.asset)
+        self.assertEqual(
+            models.MotionAssetDailyRollup.objects.count(),
+            3 * len(api.MEASUREMENT_TYPES),
+        )
+        day = self.rollups()[1]
+        self.assertEqual(day.day, (self.from_date + timedelta(days=1)).date())
+        self.assertEqual(
+            (day.count, day.sum, day.min, day.max, day.last),
+            (24, float(sum(range(24, 48))), 24.0, 47.0, 47.0),
+        )
+        self.assertEqual(day.first_timestamp, self.from_date + timedelta(hours=24))
+        self.assertEqual(day.last_timestamp, self.from_date + timedelta(hours=47))
+
+    @responses.activate
+    def test_rollups_updated_by_new_points(self):
+        self.add_response(self.points(0, 10))
+        api.sync_asset_measurements(self.account, self.asset)
+        self.add_response(self.points(10, 30))
+        api.sync_asset_measurements(self.account, self.asset)
+        first, second = self.rollups()
+        self.assertEqual((first.count, first.last), (24, 23.0))
+        self.assertEqual((second.count, second.min, second.last), (6, 24.0, 29.0))
+
+    @responses.activate
+    def test_summary_matches_report(self):
+        rng = random.Random(7)
+        self.add_response(
+            {
+                type_id: [
+                    (self.from_date + timedelta(minutes=37 * i), rng.uniform(0, 10))
+                    for i in range(rng.randint(500, 1000))
+                ]
+                for type_id in api.MEASUREMENT_TYPES.values()
+            }
+        )
+        abb = api.AbbApi(self.account)
+        report = abb.get_asset_report(self.asset.motionAssetId)
+        with self.assertNumQueries(1):
+            summary = api.get_rollup_report(self.asset, self.from_date, self.to_date)
+        self.assertEqual(summary.start_date, report.start_date)
+        self.assertEqual(summary.end_date, report.end_date)
+        for field, value in asdict(report.report).items():
+            self.assertAlmostEqual(getattr(summary.report, field), value)
+
+    @responses.activate
+    def test_summary_view(self):
+        self.add_response(self.points(0, 50))
+        url = "/api/abb/site/12440/asset/e197cdae/"
+        request = APIRequestFactory().get(url, {"summary": 1})
+        force_authenticate(request, user=self.account.user)
+        view = views.AssetDataView.as_view()
+        response = view(request, siteId="12440", assetId=self.asset.motionAssetId)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("measurements", response.data)
+        self.assertEqual(response.data["report"]["max_tot_time"], 49.0)
+        request = APIRequestFactory().get(url, {"summary": 1, "stream": 1})
+        force_authenticate(request, user=self.account.user)
+        response = view(request, siteId="12440", assetId=self.asset.motionAssetId)
+        self.assertEqual(response.status_code, 400)
+
+    def test_summary_without_rollups(self):
+        with self.assertRaises(ValueError):
+            api.get_rollup_report(self.asset, self.from_date, self.to_date)
+
+
+class StreamReportTest(AssetMeasurementsStoreTest):
+    def get(self, **params):
+        request = APIRequestFactory().get("/api/abb/site/12440/asset/e197cdae/", params)
+        force_authenticate(request, user=self.account.user)
+        return views.AssetDataView.as_view()(
+            request, siteId="12440", assetId=self.asset.motionAssetId
+        )
+
+    @responses.activate
+    def test_lines_match_report(self):
+        points = self.points(0, 3000)
+        points[31] = points[31][:2500]
+        self.add_response(points)
+        response = self.get(stream=1)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+
+        async def consume():
+            # the ASGI handler iterates the response in the event loop, where
+            # the DB can't be used
+            return [line for chunk in response for line in chunk.splitlines()]
+
+        lines = [json.loads(line) for line in async_to_sync(consume)()]
+        expected = self.get().data
+        header = lines[0]
+        self.assertEqual(header["report"], expected["report"])
+        self.assertEqual(header["start_date"], expected["start_date"])
+        self.assertEqual(header["end_date"], expected["end_date"])
+        self.assertEqual(header["asset"], expected["asset"])
+        self.assertEqual(lines[1:], expected["measurements"])
+
+    def test_stream_not_found(self):
+        self.asset.measurements.all().delete()
+        self.asset.synced_at = datetime.now(timezone.utc)
+        self.asset.synced_from = self.from_date
+        self.asset.save()
+        self.assertEqual(self.get(stream=1).status_code, 404)
+        self.assertEqual(self.get(stream=1, max_points=100).status_code, 400)
+
+
+class ConditionalGetTest(AssetMeasurementsStoreTest):
+    def get(self, view, url: str, headers: dict = None, **kwargs):
+        request = APIRequestFactory().get(url, **(headers or {}))
+        force_authenticate(request, user=self.account.user)
+        return view.as_view()(request, **kwargs)
+
+    def get_report(self, **headers):
+        return self.get(
+            views.AssetDataView,
+            "/api/abb/site/12440/asset/e197cdae/",
+            headers,
+            siteId="12440",
+            assetId=self.asset.motionAssetId,
+        )
+
+    def sync(self, points: dict):
+        self.add_response(points)
+        api.sync_asset_measurements(
+            self.account, self.asset, self.from_date, self.to_date
+        )
+        models.MotionAsset.objects.filter(pk=self.asset.pk).update(
+            synced_at=self.to_date
+        )
+
+    @responses.activate
+    def test_report_not_modified(self):
+        self.sync(self.points(0, 10))
+        response = self.get_report()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("no-cache", response["Cache-Control"])
+        self.assertIn("Authorization", response["Vary"])
+        calls = len(responses.calls)
+        with mock.patch.object(renderers, "serialize") as serialize:
+            cached = self.get_report(HTTP_IF_NONE_MATCH=response["ETag"])
+            modified_since = self.get_report(
+                HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]
+            )
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached["ETag"], response["ETag"])
+        self.assertEqual(modified_since.status_code, 304)
+        serialize.assert_not_called()
+        self.assertEqual(len(responses.calls), calls)
+
+    @responses.activate
+    def test_new_points_change_etag(self):
+        self.sync(self.points(0, 10))
+        etag = self.get_report()["ETag"]
+        self.sync(self.points(10, 20))
+        response = self.get_report(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(len(response.data["measurements"]), 20)
+
+    @responses.activate
+    def test_no_etag_when_data_is_fetched(self):
+        self.add_response(self.points(0, 10))
+        # the asset isn't synced by the background sync
+        self.assertFalse(self.get_report().has_header("ETag"))
+        self.sync(self.points(0, 10))
+        request = APIRequestFactory().get("/", {"refresh": "true"})
+        force_authenticate(request, user=self.account.user)
+        response = views.AssetDataView.as_view()(
+            request, siteId="12440", assetId=self.asset.motionAssetId
+        )
+        self.assertFalse(response.has_header("ETag"))
+
+    def test_sites_not_modified(self):
+        response = self.get(views.SiteView, "/api/abb/site/")
+        etag = response["ETag"]
+        with mock.patch.object(api.AbbApi, "get_sites") as get_sites:
+            cached = self.get(
+                views.SiteView, "/api/abb/site/", {"HTTP_IF_NONE_MATCH": etag}
+            )
+        self.assertEqual(cached.status_code, 304)
+        get_sites.assert_not_called()
+        # unchanged sites keep their version
+        raw_site = {"siteId": "12440", "siteName": "Depuratore"}
+        api.save_sites(self.account, [raw_site])
+        response = self.get(
+            views.SiteView, "/api/abb/site/", {"HTTP_IF_NONE_MATCH": etag}
+        )
+        self.assertEqual(response.status_code, 304)
+        api.save_sites(self.account, [{**raw_site, "siteName": "Depuratore Nord"}])
+        response = self.get(
+            views.SiteView, "/api/abb/site/", {"HTTP_IF_NONE_MATCH": etag}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["sites"][0]["siteName"], "Depuratore Nord")
+
+    def test_assets_etag_per_user(self):
+        response = self.get(views.AssetView, "/api/abb/site/12440/", siteId="12440")
+        self.assertEqual(response.status_code, 200)
+        other = User.objects.create_user(username="other", password="other")
+        models.Account.objects.create(user=other, username="abb2", password="abb")
+        request = APIRequestFactory().get(
+            "/api/abb/site/12440/", HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        force_authenticate(request, user=other)
+        with mock.patch.object(api.AbbApi, "get_motionassets", return_value=[]):
+            response = views.AssetView.as_view()(request, siteId="12440")
+        self.assertEqual(response.status_code, 200)
+
+
+class ResponseCacheTest(AssetMeasurementsStoreTest):
+    def setUp(self):
+        super().setUp()
+        cache.reset_stats()
+
+    def get_sites(self, user: User = None):
+        request = APIRequestFactory().get("/api/abb/site/")
+        force_authenticate(request, user=user or self.account.user)
+        return views.SiteView.as_view()(request)
+
+    def test_sites_cached(self):
+        self.assertEqual(self.get_sites().status_code, 200)
+        with mock.patch.object(api.AbbApi, "get_sites") as get_sites:
+            response = self.get_sites()
+        get_sites.assert_not_called()
+        self.assertEqual(response.data["sites"][0]["siteName"], "Depuratore")
+        self.assertEqual(cache.get_stats(), {"sites": {"hits": 1, "misses": 1}})
+
+    @responses.activate
+    def test_force_reload_invalidates(self):
+        self.get_sites()
+        generation = cache.get_generation(self.account.pk)
+        # the same sites: their version doesn't change, the cache is dropped
+        responses.add(
+            responses.GET,
+            f"{api.API_URL}/Site",
+            json={"payload": [{"siteId": "12440", "siteName": "Depuratore"}]},
+        )
+        api.AbbApi(self.account).get_sites(force_reload=True)
+        self.assertNotEqual(cache.get_generation(self.account.pk), generation)
+        self.get_sites()
+        self.assertEqual(cache.get_stats(), {"sites": {"hits": 0, "misses": 2}})
+
+    @responses.activate
+    def test_sync_invalidates_report(self):
+        self.add_response(self.points(0, 10))
+        self.asset.synced_at = self.to_date
+        self.asset.save()
+        abb_api = api.AbbApi(self.account)
+        abb_api.sync_asset_measurements(
+            self.asset.motionAssetId, self.from_date, self.to_date
+        )
+        request = APIRequestFactory().get("/api/abb/site/12440/asset/e197cdae/")
+        force_authenticate(request, user=self.account.user)
+        view = views.AssetDataView.as_view()
+        self.assertEqual(
+            len(view(request, "12440", "e197cdae").data["measurements"]), 10
+        )
+        self.add_response(self.points(10, 20))
+        generation = cache.get_generation(self.account.pk)
+        abb_api.sync_asset_measurements(
+            self.asset.motionAssetId, self.from_date, self.to_date
+        )
+        self.assertNotEqual(cache.get_generation(self.account.pk), generation)
+        self.assertEqual(
+            len(view(request, "12440", "e197cdae").data["measurements"]), 20
+        )
+
+    def test_keyed_by_account(self):
+        self.get_sites()
+        other = User.objects.create_user(username="other", password="other")
+        account = models.Account.objects.create(
+            user=other,
+            username="abb2",
+            password="abb",
+            token="token",
+            token_expiration=self.account.token_expiration,
+        )
+        self.assertEqual(self.get_sites(other).data["sites"], [])
+        self.assertEqual(cache.get_stats(), {"sites": {"hits": 0, "misses": 2}})
+        account.sites.add(self.asset.site)
+        cache.invalidate(account)
+        self.assertEqual(len(self.get_sites(other).data["sites"]), 1)
+
+    def test_disabled_by_ttl(self):
+        with self.settings(ABB_CACHE_TTLS={"sites": 0}):
+            self.get_sites()
+            self.get_sites()
+        self.assertEqual(cache.get_stats(), {})
+
+    def test_stats_view(self):
+        self.get_sites()
+        request = APIRequestFactory().get("/api/abb/cache/stats/")
+        force_authenticate(request, user=self.account.user)
+        self.assertEqual(views.CacheStatsView.as_view()(request).status_code, 403)
+        admin = User.objects.create_user(username="admin", is_staff=True)
+        force_authenticate(request, user=admin)
+        response = views.CacheStatsView.as_view()(request)
+        self.assertEqual(
+            response.data, {"endpoints": {"sites": {"hits": 0, "misses": 1}}}
+        )
+
+
+class AccountIsolationTest(AssetMeasurementsStoreTest):
+    """the measurements stored for an account are not served to the others"""
+
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create_user(username="other", password="other")
+        self.other = models.Account.objects.create(
+            user=user,
+            username="abb2",
+            password="abb",
+            token="token",
+            token_expiration=self.account.token_expiration,
+        )
+
+    def store(self):
+        """store the measurements of the asset for the account"""
+        self.add_response(self.points(0, 10))
+        api.sync_asset_measurements(
+            self.account, self.asset, self.from_date, self.to_date
+        )
+        models.MotionAsset.objects.filter(pk=self.asset.pk).update(
+            synced_at=self.to_date
+        )
+
+    @responses.activate
+    def test_report_not_found(self):
+        self.store()
+        calls = len(responses.calls)
+        request = APIRequestFactory().get("/api/abb/site/12440/asset/e197cdae/")
+        force_authenticate(request, user=self.other.user)
+        response = views.AssetDataView.as_view()(
+            request, siteId="12440", assetId="e197cdae"
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn("ETag", response)
+
+        client = APIClient()
+        client.credentials(
+            HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.other.user)}"
+        )
+        for query in ("", "?stream=true", "?summary=true"):
+            response = client.get(f"/api/abb/site/12440/asset/e197cdae/{query}")
+            self.assertEqual(response.status_code, 404, query)
+        self.assertEqual(len(responses.calls), calls)
+
+    @responses.activate
+    def test_store_lookups_filtered(self):
+        self.store()
+        other = api.AbbApi(self.other)
+        for get_report in (
+            other.get_asset_report,
+            other.stream_asset_report,
+            other.get_asset_summary,
+        ):
+            with self.assertRaises(models.MotionAsset.DoesNotExist):
+                get_report("e197cdae")
+        with self.assertRaises(models.MotionAsset.DoesNotExist):
+            other.get_asset_range_report("e197cdae", self.from_date, self.to_date)
+        self.assertEqual(list(other.get_motionassets("12440")), [])
+        self.assertEqual(
+            async_to_sync(async_api.get_site_reports)(self.other, "12440"), []
+        )
+        query = {"summary": False}
+        self.assertIsNone(views.get_asset_report_version(self.other, "e197cdae", query))
+        self.assertIsNotNone(
+            views.get_asset_report_version(self.account, "e197cdae", query)
+        )
+
+
+@override_settings(ABB_FETCH_WINDOW_DAYS=7, ABB_API_RETRY_BACKOFF=0)
+class ChunkedFetchTest(TestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+        user = User.objects.create_user(username="test", password="test")
+        self.account = models.Account.objects.create(
+            user=user,
+            username="abb",
+            password="abb",
+            token="token",
+            token_expiration=datetime.now(timezone.utc) + timedelta(hours=1),
+        )
+        site = models.Site.objects.create(siteId="12440", siteName="Depuratore")
+        self.account.sites.add(site)
+        self.asset = models.MotionAsset.objects.create(
+            motionAssetId="e197cdae", assetId="30879", assetName="coclea", site=site
+        )
+        self.start = datetime(2022, 1, 1, tzinfo=timezone.utc)
+        # failures left for the requests starting at the "from" param
+        self.failures = {}
+        self.in_flight = self.max_in_flight = 0
+
+    def range_response(self, url: str) -> tuple[int, dict]:
+        """status and body of a request, with a point per hour in its range"""
+        params = {
+            key: values[0] for key, values in parse_qs(urlparse(url).query).items()
+        }
+        if self.failures.get(params["from"]):
+            self.failures[params["from"]] -= 1
+            return 503, {}
+        start, end = (
+            datetime.strptime(params[key], api.FMT_DT).replace(tzinfo=timezone.utc)
+            for key in ("from", "to")
+        )
+        first = start + timedelta(seconds=-start.timestamp() % 3600)
+        hours = range(int((end - first).total_seconds() // 3600) + 1)
+        if start > end:
+            return 200, {"payload": []}
+        return 200, measurement_payload(
+            {
+                int(type_id): [(first + timedelta(hours=h), 1.0) for h in hours]
+                for type_id in params["measurementTypeIds"].split(",")
+            }
+        )
+
+    def add_range_response(self):
+        def callback(request):
+            status, body = self.range_response(request.url)
+            return status, {}, json.dumps(body)
+
+        responses.add_callback(
+            responses.GET, f"{api.API_URL}/Measurement", callback=callback
+        )
+
+    def stored_hours(self) -> int:
+        timestamps = models.MotionAssetMeasurement.objects.values_list(
+            "timestamp", flat=True
+        )
+        self.assertEqual(
+            len(timestamps), len(set(timestamps)) * len(api.MEASUREMENT_TYPES)
+        )
+        return len(set(timestamps))
+
+    def test_split_range(self):
+        windows = api.split_range(self.start, self.start + timedelta(days=20), [31])
+        self.assertEqual(
+            [(w.start, w.end) for w in windows],
+            [
+                (self.start, self.start + timedelta(days=7, seconds=-1)),
+                (
+                    self.start + timedelta(days=7),
+                    self.start + timedelta(days=14, seconds=-1),
+                ),
+                (self.start + timedelta(days=14), self.start + timedelta(days=20)),
+            ],
+        )
+        self.assertEqual(windows[0].type_ids, (31,))
+
+    @responses.activate
+    def test_range_fetched_in_windows(self):
+        self.add_range_response()
+        stored = api.sync_asset_measurements(
+            self.account, self.asset, self.start, self.start + timedelta(days=30)
+        )
+        self.assertEqual(len(responses.calls), 5)
+        self.assertEqual(self.stored_hours(), 30 * 24 + 1)
+        self.assertEqual(stored, (30 * 24 + 1) * len(api.MEASUREMENT_TYPES))
+        self.assertEqual(self.asset.synced_from, self.start)
+
+    @responses.activate
+    def test_failed_window_retried_alone(self):
+        self.add_range_response()
+        second = (self.start + timedelta(days=7)).strftime(api.FMT_DT)
+        self.failures[second] = 2
+        with self.assertLogs("abb.abb_api", "WARNING"):
+            api.sync_asset_measurements(
+                self.account, self.asset, self.start, self.start + timedelta(days=30)
+            )
+        self.assertEqual(len(responses.calls), 7)
+        self.assertEqual(self.stored_hours(), 30 * 24 + 1)
+
+    @responses.activate
+    def test_failed_window_raises(self):
+        self.add_range_response()
+        second = (self.start + timedelta(days=7)).strftime(api.FMT_DT)
+        self.failures[second] = 3
+        with self.assertLogs("abb.abb_api", "WARNING"), self.assertRaises(
+            requests.HTTPError
+        ):
+            api.sync_asset_measurements(
+                self.account, self.asset, self.start, self.start + timedelta(days=30)
+            )
+        self.assertIsNone(self.asset.synced_from)
+
+    @responses.activate
+    def test_backfill_before_stored(self):
+        self.add_range_response()
+        api.sync_asset_measurements(
+            self.account,
+            self.asset,
+            self.start + timedelta(days=14),
+            self.start + timedelta(days=21),
+        )
+        stored = api.sync_asset_measurements(
+            self.account, self.asset, self.start, self.start + timedelta(days=21)
+        )
+        # two windows up to the first stored point, nothing after the last one
+        self.assertEqual(len(responses.calls), 3)
+        last = self.start + timedelta(days=14, seconds=-1)
+        self.assertEqual(
+            max(
+                parse_qs(urlparse(call.request.url).query)["to"][0]
+                for call in responses.calls[1:]
+            ),
+            last.strftime(api.FMT_DT),
+        )
+        self.assertEqual(stored, 14 * 24 * len(api.MEASUREMENT_TYPES))
+        self.assertEqual(self.stored_hours(), 21 * 24 + 1)
+        self.asset.refresh_from_db()
+        self.assertEqual(self.asset.synced_from, self.start)
+
+    def test_stitch_drops_repeated_points(self):
+        def window(hours):
+            return api.parse_asset_measurements(
+                measurement_payload(
+                    {31: [(self.start + timedelta(hours=h), float(h)) for h in hours]}
+                )
+            )
+
+        points = api.stitch_measurements([window(range(5)), None, window(range(4, 8))])
+        self.assertEqual([point.value for _, point in points], list(range(8)))
+
+    def test_async_windows(self):
+        async def handler(request: httpx.Request) -> httpx.Response:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            await asyncio.sleep(0.01)
+            self.in_flight -= 1
+            status, body = self.range_response(str(request.url))
+            return httpx.Response(status, json=body)
+
+        async def run():
+            client = httpx.AsyncClient(
+                base_url=api.API_URL, transport=httpx.MockTransport(handler)
+            )
+            async with async_api.AsyncAbbApi(self.account, client, 3) as abb:
+                return await abb.sync_asset_measurements(
+                    self.asset.motionAssetId,
+                    self.start,
+                    self.start + timedelta(days=60),
+                )
+
+        self.failures[self.start.strftime(api.FMT_DT)] = 1
+        with self.assertLogs("abb.async_api", "WARNING"):
+            async_to_sync(run)()
+        self.assertEqual(self.max_in_flight, 3)
+        self.assertEqual(self.stored_hours(), 60 * 24 + 1)
+
+    def get_report(self, **params):
+        request = APIRequestFactory().get("/api/abb/site/12440/asset/e197cdae/", params)
+        force_authenticate(request, user=self.account.user)
+        return views.AssetDataView.as_view()(
+            request, siteId="12440", assetId=self.asset.motionAssetId
+        )
+
+    @responses.activate
+    def test_range_report_view(self):
+        self.add_range_response()
+        response = self.get_report(**{"from": "2022-01-01", "to": "2022-01-10"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["measurements"]), 10 * 24)
+        self.assertNotIn("ETag", response)
+        # once synced, the report is versioned and read from the store
+        models.MotionAsset.objects.filter(pk=self.asset.pk).update(
+            synced_at=datetime.now(timezone.utc)
+        )
+        calls = len(responses.calls)
+        response = self.get_report(**{"from": "2022-01-01", "to": "2022-01-10"})
+        self.assertEqual(len(responses.calls), calls)
+        self.assertIn("ETag", response)
+        response = self.get_report(**{"from": "2022-01-03", "to": "2022-01-03"})
+        self.assertEqual(len(response.data["measurements"]), 24)
+
+    def test_range_query_validation(self):
+        invalid = [
+            {"to": "2022-01-10"},
+            {"from": "2022-01-10", "to": "2022-01-01"},
+            {"from": "2022-01-01", "month": 1, "year": 2022},
+            {"from": "2020-01-01", "to": "2022-01-01"},
+        ]
+        for params in invalid:
+            with self.subTest(params=params):
+                self.assertEqual(self.get_report(**params).status_code, 400)
+
+
+@override_settings(ABB_PROFILING=True)
+class ProfilingTest(AssetMeasurementsStoreTest):
+    def profile(self, view, url: str, params: dict = None, **kwargs):
+        """the response of the view profiled and its log line"""
+
+        def get_response(request):
+            response = view(request, **kwargs)
+            if hasattr(response, "render"):
+                response.render()
+            return response
+
+        request = APIRequestFactory().get(url, params)
+        force_authenticate(request, user=self.account.user)
+        with self.assertLogs("abb.profiling", "INFO") as logs:
+            response = profiling.ProfilingMiddleware(get_response)(request)
+        return response, json.loads(logs.records[0].getMessage())
+
+    @responses.activate
+    def test_report_profiled(self):
+        self.add_response(self.points(0, 10))
+        response, line = self.profile(
+            views.AssetDataView.as_view(),
+            "/api/abb/site/12440/asset/e197cdae/",
+            siteId="12440",
+            assetId=self.asset.motionAssetId,
+        )
+        self.assertEqual(response.status_code, 200)
+        metrics = [
+            metric.split(";")[0] for metric in response["Server-Timing"].split(", ")
+        ]
+        self.assertEqual(metrics, ["db", "abb", "serialize", "render", "total"])
+        self.assertIn("abb;dur=", response["Server-Timing"])
+        self.assertIn('desc="1 calls"', response["Server-Timing"])
+        self.assertEqual(line["path"], "/api/abb/site/12440/asset/e197cdae/")
+        self.assertEqual(line["status"], 200)
+        self.assertGreater(line["db"]["queries"], 0)
+        [call] = line["abb"]
+        self.assertTrue(call["url"].startswith(f"{api.API_URL}/Measurement?"))
+        self.assertEqual((call["method"], call["status"]), ("GET", 200))
+
+    @responses.activate
+    @override_settings(ABB_FETCH_WINDOW_DAYS=7)
+    def test_window_calls_profiled(self):
+        self.add_response(self.points(0, 10))
+
+        def view(request):
+            api.sync_asset_measurements(
+                self.account, self.asset, self.from_date, self.to_date
+            )
+            return JsonResponse({})
+
+        _, line = self.profile(view, "/")
+        self.assertEqual(len(line["abb"]), len(responses.calls))
+        self.assertGreater(len(line["abb"]), 1)
+
+    def test_assets_queries_constant(self):
+        def queries() -> int:
+            _, line = self.profile(
+                views.AssetView.as_view(), "/api/abb/site/12440/", siteId="12440"
+            )
+            return line["db"]["queries"]
+
+        few = queries()
+        for i in range(10):
+            models.MotionAsset.objects.create(
+                motionAssetId=f"asset-{i}", assetId=str(i), site=self.asset.site
+            )
+        cache.get_cache().clear()
+        self.assertEqual(queries(), few)
+
+    def test_disabled(self):
+        with self.settings(ABB_PROFILING=False), self.assertRaises(MiddlewareNotUsed):
+            profiling.ProfilingMiddleware(lambda request: None)
+
+
+class MetricsTest(AssetMeasurementsStoreTest):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        # the sites may be served by an async view, which authenticates the JWT
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.account.user)}"
+        )
+
+    def sample(self, name: str, **labels) -> float:
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    @responses.activate
+    def test_upstream_calls_by_function(self):
+        responses.add(
+            responses.GET,
+            f"{api.API_URL}/Site",
+            json={"payload": [{"siteId": "12440", "siteName": "Depuratore"}]},
+        )
+        labels = {"function": "get_sites", "status": "200"}
+        calls = self.sample("abb_upstream_request_duration_seconds_count", **labels)
+        sizes = self.sample("abb_upstream_response_bytes_count", function="get_sites")
+        api.AbbApi(self.account).get_sites(force_reload=True)
+        self.assertEqual(
+            self.sample("abb_upstream_request_duration_seconds_count", **labels),
+            calls + 1,
+        )
+        self.assertEqual(
+            self.sample("abb_upstream_response_bytes_count", function="get_sites"),
+            sizes + 1,
+        )
+
+    @responses.activate
+    def test_streamed_calls_by_function(self):
+        start = datetime(2022, 1, 1, tzinfo=timezone.utc)
+        responses.add(
+            responses.GET,
+            f"{api.API_URL}/Measurement",
+            json=measurement_payload({7: [(start, 1.0), (start, 2.0)]}),
+        )
+        labels = {"function": "stream_asset_measurements", "status": "200"}
+        calls = self.sample("abb_upstream_request_duration_seconds_count", **labels)
+        others = self.sample(
+            "abb_upstream_request_duration_seconds_count",
+            function="other",
+            status="200",
+        )
+        points = api.stream_asset_measurements(self.account, "e197cdae")
+        self.assertEqual(len(list(points)), 2)
+        self.assertEqual(
+            self.sample("abb_upstream_request_duration_seconds_count", **labels),
+            calls + 1,
+        )
+        self.assertEqual(
+            self.sample(
+                "abb_upstream_request_duration_seconds_count",
+                function="other",
+                status="200",
+            ),
+            others,
+        )
+
+    @responses.activate
+    def test_token_retry_and_refresh(self):
+        responses.add(responses.GET, f"{api.API_URL}/Site", status=401)
+        responses.add(responses.GET, f"{api.API_URL}/Site", json={"payload": []})
+        responses.add(
+            responses.POST,
+            f"{api.API_URL}/Auth/ConnectAccount",
+            json={"payload": {"accessToken": "new", "expiration": 3600}},
+        )
+        retries = self.sample("abb_token_retries_total")
+        refreshes = self.sample("abb_token_refreshes_total")
+        logins = self.sample(
+            "abb_upstream_request_duration_seconds_count",
+            function="get_access_token",
+            status="200",
+        )
+        api.AbbApi(self.account).get_sites(force_reload=True)
+        self.assertEqual(self.sample("abb_token_retries_total"), retries + 1)
+        self.assertEqual(self.sample("abb_token_refreshes_total"), refreshes + 1)
+        self.assertEqual(
+            self.sample(
+                "abb_upstream_request_duration_seconds_count",
+                function="get_access_token",
+                status="200",
+            ),
+            logins + 1,
+        )
+
+    def test_views_and_cache(self):
+        labels = {"view": "site", "method": "GET", "status": "200"}
+        requests = self.sample("abb_view_request_duration_seconds_count", **labels)
+        hits = self.sample("abb_cache_requests_total", endpoint="sites", result="hit")
+        misses = self.sample(
+            "abb_cache_requests_total", endpoint="sites", result="miss"
+        )
+        for _ in range(2):
+            self.assertEqual(self.client.get("/api/abb/site/").status_code, 200)
+        self.assertEqual(
+            self.sample("abb_view_request_duration_seconds_count", **labels),
+            requests + 2,
+        )
+        self.assertGreater(self.sample("abb_view_response_bytes_sum", view="site"), 0)
+        self.assertEqual(
+            self.sample("abb_cache_requests_total", endpoint="sites", result="hit"),
+            hits + 1,
+        )
+        self.assertEqual(
+            self.sample("abb_cache_requests_total", endpoint="sites", result="miss"),
+            misses + 1,
+        )
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION="Bearer secret")
+        with override_settings(ABB_METRICS_TOKEN="secret"):
+            response = client.get("/api/abb/metrics/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], CONTENT_TYPE_LATEST)
+        self.assertIn(
+            b'abb_view_request_duration_seconds_count{method="GET",status="200",'
+            b'view="site"}',
+            response.content,
+        )
+
+    @override_settings(ABB_METRICS_TOKEN="secret")
+    def test_metrics_token(self):
+        client = APIClient()
+        self.assertEqual(client.get("/api/abb/metrics/").status_code, 403)
+        client.credentials(HTTP_AUTHORIZATION="Bearer wrong")
+        self.assertEqual(client.get("/api/abb/metrics/").status_code, 403)
+        client.credentials(HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(client.get("/api/abb/metrics/").status_code, 200)
+
+    @override_settings(ABB_METRICS_TOKEN="")
+    def test_metrics_without_token(self):
+        client = APIClient()
+        self.assertEqual(client.get("/api/abb/metrics/").status_code, 403)
+        client.credentials(HTTP_AUTHORIZATION="Bearer ")
+        self.assertEqual(client.get("/api/abb/metrics/").status_code, 403)
+
+
+@override_settings(ABB_FLEET_WORKERS=2)
+class FleetReportTest(TransactionTestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+        user = User.objects.create_user(username="test", password="test")
+        self.account = models.Account.objects.create(
+            user=user,
+            username="abb",
+            password="abb",
+            token="token",
+            token_expiration=datetime.now(timezone.utc) + timedelta(hours=1),
+        )
+        site = models.Site.objects.create(siteId="12440", siteName="Depuratore")
+        self.account.sites.add(site)
+        self.from_date, self.to_date = api.get_last_complete_month()
+        self.asset = models.MotionAsset.objects.create(
+            motionAssetId="e197cdae", assetId="30879", assetName="coclea", site=site
+        )
+        # synced without measurements in the month
+        models.MotionAsset.objects.create(
+            motionAssetId="empty",
+            assetId="1",
+            assetName="empty",
+            site=site,
+            synced_at=self.to_date,
+            synced_from=self.from_date,
+        )
+        other = models.Site.objects.create(siteId="other", siteName="Other")
+        models.MotionAsset.objects.create(motionAssetId="other", site=other)
+
+    def add_response(self):
+        points = {
+            type_id: [
+                (self.from_date + timedelta(hours=i), float(i)) for i in range(10)
+            ]
+            for type_id in api.MEASUREMENT_TYPES.values()
+        }
+        responses.add(
+            responses.GET,
+            f"{api.API_URL}/Measurement",
+            json=measurement_payload(points),
+        )
+
+    @responses.activate
+    def test_fleet_reports(self):
+        self.add_response()
+        report = fleet.compute_fleet_reports([self.account])
+        month, year = api.get_report_month()
+        self.assertEqual((report.month, report.year), (month, year))
+        self.assertEqual(
+            [(row.motionAssetId, row.status) for row in report.rows],
+            [("e197cdae", fleet.COMPUTED), ("empty", fleet.NO_DATA)],
+        )
+        self.assertEqual((report.computed, report.no_data), (1, 1))
+        expected = api.get_stored_asset_report(self.asset, self.from_date, self.to_date)
+        self.assertEqual(report.rows[0].report, expected.report)
+        self.assertEqual(report.rows[0].start_date, expected.start_date)
+        snapshot = models.MotionAssetReport.objects.get(asset=self.asset)
+        self.assertEqual(len(snapshot.measurements), 10)
+
+        # the stored report is read back, without fetching the measurements
+        calls = len(responses.calls)
+        report = fleet.compute_fleet_reports([self.account])
+        self.assertEqual(len(responses.calls), calls)
+        self.assertEqual(report.rows[0].status, fleet.STORED)
+        self.assertEqual(report.rows[0].report, expected.report)
+
+    def test_failed_asset_reported(self):
+        with mock.patch.object(
+            api.AbbApi, "sync_asset_measurements", side_effect=ValueError("down")
+        ), self.assertLogs("abb.fleet", "ERROR"):
+            report = fleet.compute_fleet_reports([self.account])
+        self.assertEqual(report.rows[0].status, fleet.ERROR)
+        self.assertEqual(report.rows[0].error, "down")
+        self.assertEqual(report.rows[1].status, fleet.NO_DATA)
+
+    @responses.activate
+    def test_command(self):
+        self.add_response()
+        out = StringIO()
+        call_command("abb_fleet_reports", "abb", stdout=out)
+        self.assertIn("1 computed, 0 stored, 1 without data, 0 errors", out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command("abb_fleet_reports", "missing", stdout=StringIO())
+
+    @responses.activate
+    def test_view(self):
+        self.add_response()
+        client = APIClient()
+        client.force_authenticate(user=self.account.user)
+        response = client.get("/api/abb/fleet/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["computed"], 1)
+        row = response.json()["rows"][0]
+        self.assertEqual(row["motionAssetId"], "e197cdae")
+        self.assertEqual(row["report"]["avg_acc_x"], 4.5)
+        self.assertEqual(client.get("/api/abb/fleet/?all=true").status_code, 403)
+
+
+class SyncUpsertTest(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username="test", password="test")
+        self.account = models.Account.objects.create(
+            user=user, username="abb", password="abb"
+        )
+
+    def assets_payload(self, count: int, name: str = "motor") -> list[dict]:
+        return [
+            {
+                "baseInfo": {
+                    "motionAssetId": f"asset-{i}",
+                    "assetId": str(i),
+                    "assetTypeId": "1",
+                    "assetTypeVersion": None,
+                    "assetType": "Motor",
+                    "assetFamily": None,
+                    "assetName": f"{name} {i}",
+                    "baseAPI": 1,
+                    "description": "coclea",
+                    "siteId": str(i % 3),
+                    "siteName": f"site {i % 3}",
+                    "organizationName": "Acque Veronesi",
+                    "assetOwner": "marco@piccolisergio.it",
+                    "serialNumber": f"S{i}",
+                    "assetGroupId": 17705,
+                },
+                "assetProperties": [],
+            }
+            for i in range(count)
+        ]
+
+    def sites_payload(self, count: int, city: str = "Verona") -> list[dict]:
+        return [
+            {
+                "siteId": str(i),
+                "siteName": f"site {i}",
+                "country": "ITALY",
+                "countryCode": "IT",
+                "address": "località Serragli 1",
+                "city": city,
+                "latitude": "45.07167",
+                "longitude": "11.35701",
+            }
+            for i in range(count)
+        ]
+
+    def count_queries(self, func, *args) -> int:
+        with CaptureQueriesContext(connection) as queries:
+            func(*args)
+        return len(queries)
+
+    def test_motionassets_constant_queries(self):
+        few = self.count_queries(api.save_motionassets, self.assets_payload(5))
+        models.MotionAsset.objects.all().delete()
+        models.Site.objects.all().delete()
+        many = self.count_queries(api.save_motionassets, self.assets_payload(50))
+        self.assertEqual(few, many)
+        self.assertEqual(models.MotionAsset.objects.count(), 50)
+        self.assertEqual(models.Site.objects.count(), 3)
+        # updates take the same number of queries
+        updated = self.count_queries(
+            api.save_motionassets, self.assets_payload(50, name="pump")
+        )
+        self.assertEqual(updated, many)
+        asset = models.MotionAsset.objects.get(pk="asset-7")
+        self.assertEqual(asset.assetName, "pump 7")
+        self.assertEqual(asset.site_id, "1")
+
+    def test_sites_constant_queries(self):
+        few = self.count_queries(api.save_sites, self.account, self.sites_payload(5))
+        models.Site.objects.all().delete()
+        many = self.count_queries(api.save_sites, self.account, self.sites_payload(50))
+        self.assertEqual(few, many)
+        self.assertEqual(self.account.sites.count(), 50)
+        updated = self.count_queries(
+            api.save_sites, self.account, self.sites_payload(60, city="Padova")
+        )
+        self.assertEqual(updated, many + 1)  # the update of the existing rows
+        self.assertEqual(self.account.sites.count(), 60)
+        self.assertEqual(models.Site.objects.get(pk="3").city, "Padova")
+
+    def test_unchanged_rows_not_updated(self):
+        api.save_sites(self.account, self.sites_payload(5))
+        updated_at = models.Site.objects.get(pk="3").updated_at
+        with CaptureQueriesContext(connection) as queries:
+            api.save_sites(self.account, self.sites_payload(5))
+        self.assertFalse([q for q in queries if q["sql"].startswith("UPDATE")])
+        api.save_sites(self.account, self.sites_payload(5, city="Padova"))
+        self.assertGreater(models.Site.objects.get(pk="3").updated_at, updated_at)
+
+
+class TokenManagerTest(TransactionTestCase):
+    def setUp(self):
+        user = User.objects.create_user(username="test", password="test")
+        self.account = models.Account.objects.create(
+            user=user,
+            username="abb",
+            password="abb",
+            token="old",
+            token_expiration=datetime.now(timezone.utc) + timedelta(hours=1),
+        )
+        responses.add(
+            responses.POST,
+            f"{api.API_URL}/Auth/ConnectAccount",
+            json={"payload": {"accessToken": "new", "expiration": 3600}},
+        )
+
+    def expire_token(self, delta: timedelta = timedelta(0)):
+        models.Account.objects.filter(pk=self.account.pk).update(
+            token_expiration=datetime.now(timezone.utc) + delta
+        )
+        self.account.refresh_from_db()
+
+    @responses.activate
+    def test_valid_token_not_refreshed(self):
+        self.assertEqual(api.update_token_if_needed(self.account), "old")
+        self.assertEqual(len(responses.calls), 0)
+
+    @responses.activate
+    def test_refreshed_ahead_of_expiration(self):
+        self.expire_token(api.TOKEN_REFRESH_MARGIN - timedelta(seconds=1))
+        self.assertEqual(api.update_token_if_needed(self.account), "new")
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.token, "new")
+
+    @responses.activate
+    def test_rejected_token_refreshed(self):
+        token = api.update_token_if_needed(self.account, rejected_token="old")
+        self.assertEqual(token, "new")
+        self.assertEqual(len(responses.calls), 1)
+
+    @responses.activate
+    def test_token_refreshed_by_another_worker_reused(self):
+        self.expire_token()
+        # the copy of another worker, which already refreshed the token
+        models.Account.objects.filter(pk=self.account.pk).update(
+            token="other",
+            token_expiration=datetime.now(timezone.utc) + timedelta(hours=1),
+        )
+        self.assertEqual(api.update_token_if_needed(self.account), "other")
+        self.assertEqual(len(responses.calls), 0)
+
+    @responses.activate
+    def test_single_refresh_for_concurrent_threads(self):
+        self.expire_token()
+        tokens = []
+
+        def refresh(account):
+            tokens.append(api.update_token_if_needed(account))
+            connection.close()
+
+        # each thread has its own stale copy of the account
+        accounts = [models.Account.objects.get(pk=self.account.pk) for _ in range(4)]
+        threads = [threading.Thread(target=refresh, args=(a,)) for a in accounts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(tokens, ["new"] * 4)
+        self.assertEqual(len(responses.calls), 1)
+
+
+class RateLimiterTest(TestCase):
+    @mock.patch("abb.abb_api.time")
+    def test_calls_spaced_by_rate(self, mock_time):
+        mock_time.monotonic.return_value = 100.0
+        limiter = api.RateLimiter(rate=2, burst=2)
+        for _ in range(4):
+            limiter.acquire()
+        # the burst is free, then each call waits for its slot
+        waits = [call.args[0] for call in mock_time.sleep.call_args_list]
+        self.assertEqual(waits, [0.5, 1.0])
+
+
+class BackgroundSyncTest(TransactionTestCase):
+    def setUp(self):
+        resilience.reset_breakers()
+        user = User.objects.create_user(username="test", password="test")
+        self.account = models.Account.objects.create(
+            user=user,
+            username="abb",
+            password="abb",
+            token="token",
+            token_expiration=datetime.now(timezone.utc) + timedelta(hours=1),
+        )
+        self.from_date, _ = api.get_last_complete_month()
+        responses.add(
+            responses.GET,
+            f"{api.API_URL}/Site",
+            json={"payload": [{"siteId": "12440", "siteName": "Depuratore"}]},
+        )
+        responses.add(
+            responses.GET,
+            f"{api.API_URL}/InstalledBase/Site/1/12440",
+            json={
+                "payload": [
+                    {
+                        "baseInfo": {
+                            "motionAssetId": "e197cdae",
+                            "assetId": "30879",
+                            "assetName": "coclea",
+                            "siteId": "12440",
+                            "siteName": "Depuratore",
+                        }
+                    }
+                ]
+            },
+        )
+        responses.add(
+            responses.GET,
+            f"{api.API_URL}/Subscription/All",
+            json={
+                "payload": [
+                    {
+                        "motionAssetId": "e197cdae",
+                        "serialNumber": "1204200136",
+                        "contractNumber": "20210901-4693441",
+                        "startDate": "0001-01-01T00:00:00",
+                        "expirationDate": "1970-01-01T00:00:00Z",
+                        "isTrial": True,
+                        "trialPeriodEndDate": "2022-02-28T23:59:59.999Z",
+                        "featureList": ["Condition monitoring"],
+                    }
+                ]
+            },
+        )
+
+    @responses.activate
+    def test_sync_all(self):
+        responses.add(
+            responses.GET,
+            f"{api.API_URL}/Measurement",
+            json=measurement_payload(
+                {
+                    type_id: [
+                        (self.from_date + timedelta(hours=i), 1.0) for i in range(5)
+                    ]
+                    for type_id in api.MEASUREMENT_TYPES.values()
+                }
+            ),
+        )
+        result = sync.sync_all(workers=2, rate_limit=100)
+        self.assertEqual(result, sync.SyncResult(1, 1, 5 * len(api.MEASUREMENT_TYPES)))
+        asset = models.MotionAsset.objects.get(pk="e197cdae")
+        self.assertEqual(asset.sync_status, models.MotionAsset.SYNC_OK)
+        self.assertIsNotNone(asset.synced_at)
+        self.assertTrue(self.account.sites.filter(pk="12440").exists())
+        # the subscriptions are served from the cache
+        calls = len(responses.calls)
+        subscriptions = api.AbbApi(self.account).get_subscriptions()
+        self.assertEqual(len(responses.calls), calls)
+        self.assertEqual(
+            [subscription.motionAssetId for subscription in subscriptions],
+            ["e197cdae"],
+        )
+
+    @responses.activate
+    @override_settings(ABB_API_RETRY_BACKOFF=0)
+    def test_version_changes_with_data_only(self):
+        responses.add(
+            responses.GET,
+            f"{api.API_URL}/Measurement",
+            json=measurement_payload(
+                {
+                    type_id: [(self.from_date, 1.0)]
+                    for type_id in api.MEASUREMENT_TYPES.values()
+                }
+            ),
+        )
+
+        def version():
+            asset = models.MotionAsset.objects.select_related("site").get(pk="e197cdae")
+            return api.get_report_version(asset).key
+
+        sync.sync_all(workers=2, rate_limit=100)
+        synced = version()
+        self.assertEqual(sync.sync_all(workers=2, rate_limit=100).points, 0)
+        self.assertEqual(version(), synced)
+
+        responses.replace(responses.GET, f"{api.API_URL}/Measurement", status=503)
+        with self.assertLogs("abb.sync", "ERROR"):
+            sync.sync_all(workers=2, rate_limit=100)
+        failed = models.MotionAsset.objects.get(pk="e197cdae").updated_at
+        with self.assertLogs("abb.sync", "ERROR"):
+            sync.sync_all(workers=2, rate_limit=100)
+        asset = models.MotionAsset.objects.get(pk="e197cdae")
+        self.assertEqual(asset.updated_at, failed)
+        self.assertEqual(asset.sync_status, models.MotionAsset.SYNC_ERROR)
+
+    @responses.activate
+    @override_settings(ABB_API_RETRY_BACKOFF=0)
+    def test_failure_recorded_on_asset(self):
+        responses.add(responses.GET, f"{api.API_URL}/Measurement", status=503)
+        with self.assertLogs("abb.sync", "ERROR"):
+            result = sync.sync_all(workers=2, rate_limit=100)
+        self.assertEqual(result.errors, 1)
+        asset = models.MotionAsset.objects.get(pk="e197cdae")
+        self.assertEqual(asset.sync_status, models.MotionAsset.SYNC_ERROR)
+        self.assertIn("503", asset.sync_error)
+        self.assertIsNone(asset.synced_at)
+
+    def test_command_survives_errors(self):
+        results = [
+            RuntimeError("connection lost"),
+            sync.SyncResult(1),
+            KeyboardInterrupt,
+        ]
+        out = StringIO()
+        with mock.patch.object(sync, "sync_all", side_effect=results) as sync_all:
+            with self.assertLogs("abb.management.commands.abb_sync", "ERROR"):
+                call_command("abb_sync", "--interval", "0", stdout=out)
+        self.assertEqual(sync_all.call_count, 3)
+        self.assertIn("Synced 0 assets of 1 accounts", out.getvalue())
+        with mock.patch.object(sync, "sync_all", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                call_command("abb_sync", "--once", stdout=StringIO())
+
+    @responses.activate
+    def test_synced_asset_report_read_locally(self):
+        responses.add(
+            responses.GET,
+            f"{api.API_URL}/Measurement",
+            json=measurement_payload(
+                {
+                    type_id: [(self.from_date, 1.0)]
+                    for type_id in api.MEASUREMENT_TYPES.values()
+                }
+            ),
+        )
+        sync.sync_all(workers=2, rate_limit=100)
+        now = datetime.now(timezone.utc)
+        month_start, _ = api.get_month_range(now.month, now.year)
+        asset = models.MotionAsset.objects.get(pk="e197cdae")
+        models.MotionAssetMeasurement.objects.bulk_create(
+            models.MotionAssetMeasurement(
+                asset=asset, measurementTypeId=type_id, timestamp=month_start, value=2.0
+            )
+            for type_id in api.MEASUREMENT_TYPES.values()
+        )
+        calls = len(responses.calls)
+        report = api.AbbApi(self.account).get_asset_report(
+            "e197cdae", month=now.month, year=now.year
+        )
+        self.assertEqual(len(responses.calls), calls)
+        self.assertEqual(report.report.max_tot_time, 2.0)
+
+    @responses.activate
+    def test_month_before_synced_from_fetched(self):
+        responses.add(
+            responses.GET,
+            f"{api.API_URL}/Measurement",
+            json=measurement_payload(
+                {
+                    type_id: [(self.from_date, 1.0)]
+                    for type_id in api.MEASUREMENT_TYPES.values()
+                }
+            ),
+        )
+        sync.sync_all(workers=2, rate_limit=100)
+        asset = models.MotionAsset.objects.get(pk="e197cdae")
+        self.assertEqual(asset.synced_from, self.from_date)
+        older = (self.from_date - timedelta(days=60)).replace(day=1)
+        self.assertIsNone(api.get_report_version(asset, older.month, older.year))
+        responses.add(
+            responses.GET,
+            f"{api.API_URL}/Measurement",
+            json=measurement_payload(
+                {type_id: [(older, 3.0)] for type_id in api.MEASUREMENT_TYPES.values()}
+            ),
+        )
+        calls = len(responses.calls)
+        report = api.AbbApi(self.account).get_asset_report(
+            "e197cdae", month=older.month, year=older.year
+        )
+        self.assertGreater(len(responses.calls), calls)
+        self.assertEqual(report.report.max_tot_time, 3.0)
+
+        models.MotionAssetReport.objects.all().delete()
+        models.MotionAssetMeasurement.objects.filter(timestamp=older).delete()
+        models.MotionAsset.objects.filter(pk=asset.pk).update(
+            synced_from=self.from_date
+        )
+
+        async def get_report():
+            async with async_api.AsyncAbbApi(self.account) as abb:
+                return await abb.get_asset_report(
+                    "e197cdae", month=older.month, year=older.year
+                )
+
+        calls = len(responses.calls)
+        with mock.patch.object(async_api, "create_client", self.create_client):
+            report = async_to_sync(get_report)()
+        self.assertTrue(self.upstream)
+        self.assertEqual(len(responses.calls), calls)
+        self.assertEqual(report.report.max_tot_time, 3.0)
+
+    def create_client(self) -> httpx.AsyncClient:
+        async def handler(request: httpx.Request) -> httpx.Response:
+            self.upstream.append(request)
+            older = datetime.fromisoformat(request.url.params["from"]).replace(
+                tzinfo=timezone.utc
+            )
+            return httpx.Response(
+                200,
+                json=measurement_payload(
+                    {
+                        type_id: [(older, 3.0)]
+                        for type_id in api.MEASUREMENT_TYPES.values()
+                    }
+                ),
+            )
+
+        self.upstream = []
+        return httpx.AsyncClient(
+            base_url=api.API_URL, transport=httpx.MockTransport(handler)
+        )
+
+
+@override_settings(ABB_API_RETRY_BACKOFF=0, ABB_BREAKER_FAILURES=3)
+class ResilienceTest(AssetMeasurementsStoreTest):
+    def setUp(self):
+        super().setUp()
+        resilience.reset_breakers()
+        cache.reset_stats()
+        views.ABB_APIS.clear()
+        self.api = api.AbbApi(self.account)
+
+    def add_failure(self, url: str = "/Measurement", status: int = 503):
+        responses.add(responses.GET, f"{api.API_URL}{url}", status=status)
+
+    @override_settings(ABB_API_RETRY_BACKOFF=1, ABB_API_RETRY_MAX_BACKOFF=3)
+    def test_backoff_jittered(self):
+        for attempt, ceiling in enumerate((1, 2, 3, 3)):
+            delays = [resilience.get_backoff(attempt) for _ in range(50)]
+            self.assertTrue(all(0 <= delay <= ceiling for delay in delays))
+            self.assertGreater(len(set(delays)), 1)
+
+    @responses.activate
+    def test_idempotent_requests_retried(self):
+        self.add_failure("/Subscription/All")
+        self.add_failure("/Subscription/All", 429)
+        responses.add(
+            responses.GET, f"{api.API_URL}/Subscription/All", json={"payload": []}
+        )
+        with self.assertLogs("abb.abb_api", "WARNING") as logs:
+            self.assertEqual(self.api.get_subscriptions(), [])
+        self.assertEqual(len(responses.calls), 3)
+        self.assertEqual(len(logs.records), 2)
+        # the token request isn't idempotent
+        responses.add(responses.POST, f"{api.API_URL}/Auth/ConnectAccount", status=503)
+        with self.assertRaises(requests.HTTPError):
+            api.get_access_token("abb", "abb")
+        self.assertEqual(len(responses.calls), 4)
+
+    @responses.activate
+    def test_client_errors_not_retried(self):
+        self.add_failure(status=404)
+        with self.assertRaises(requests.HTTPError):
+            self.api.get_asset_measurements(self.asset.assetId)
+        self.assertEqual(len(responses.calls), 1)
+        self.assertFalse(resilience.get_breaker(self.account.pk).is_open)
+
+    @responses.activate
+    def test_breaker_fails_fast(self):
+        self.add_failure()
+        with self.assertLogs("abb.abb_api", "WARNING"), self.assertRaises(
+            requests.HTTPError
+        ):
+            self.api.get_asset_measurements(self.asset.assetId)
+        self.assertEqual(len(responses.calls), 3)
+        self.assertTrue(resilience.get_breaker(self.account.pk).is_open)
+        with self.assertRaises(resilience.CircuitOpenError):
+            self.api.get_asset_measurements(self.asset.assetId)
+        self.assertEqual(len(responses.calls), 3)
+        # the breakers are per account
+        self.assertFalse(resilience.get_breaker(self.account.pk + 1).is_open)
+
+    def test_breaker_trial_call(self):
+        breaker = resilience.CircuitBreaker(2, 0.05)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        time.sleep(0.06)
+        # a single trial call, a failed one opens the breaker again
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertTrue(breaker.allow())
+        self.assertTrue(breaker.allow())
+
+    def test_async_breaker_fails_fast(self):
+        calls = []
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            calls.append(request)
+            return httpx.Response(503)
+
+        async def run():
+            client = httpx.AsyncClient(
+                base_url=api.API_URL, transport=httpx.MockTransport(handler)
+            )
+            async with async_api.AsyncAbbApi(self.account, client) as abb:
+                with self.assertRaises(httpx.HTTPStatusError):
+                    await abb.get_asset_measurements(self.asset.assetId)
+                with self.assertRaises(resilience.CircuitOpenError):
+                    await abb.get_asset_measurements(self.asset.assetId)
+
+        with self.assertLogs("abb.async_api", "WARNING"):
+            async_to_sync(run)()
+        self.assertEqual(len(calls), 3)
+
+    @responses.activate
+    def test_stale_report_served(self):
+        self.add_response(self.points(0, 10))
+        report = self.api.get_asset_range_report(
+            self.asset.motionAssetId, self.from_date, self.to_date
+        )
+        self.assertFalse(report.stale)
+        responses.reset()
+        self.add_failure()
+        with mock.patch("abb.abb_api.refresh_in_background") as refresh:
+            with self.assertLogs("abb.abb_api", "WARNING"):
+                report = self.api.get_asset_range_report(
+                    self.asset.motionAssetId, self.from_date, self.to_date
+                )
+            self.assertTrue(report.stale)
+            self.assertEqual(len(report.measurements), 10)
+            refresh.assert_called_once_with(
+                self.account, self.asset, self.from_date, self.to_date
+            )
+            # the breaker is open, the stored data is served without calls
+            header = self.api.get_asset_summary(
+                self.asset.motionAssetId,
+                from_date=self.from_date,
+                to_date=self.to_date,
+            )
+        self.assertTrue(header.stale)
+        self.assertEqual(len(responses.calls), 3)
+
+    def get_report(self, **params):
+        request = APIRequestFactory().get("/api/abb/site/12440/asset/e197cdae/", params)
+        force_authenticate(request, user=self.account.user)
+        return views.AssetDataView.as_view()(
+            request, siteId="12440", assetId=self.asset.motionAssetId
+        )
+
+    @responses.activate
+    @mock.patch("abb.abb_api.refresh_in_background")
+    def test_stale_report_not_cached(self, refresh):
+        params = {
+            "from": self.from_date.date().isoformat(),
+            "to": self.from_date.date().isoformat(),
+        }
+        self.add_failure()
+        with self.assertLogs("abb.abb_api", "WARNING"):
+            response = self.get_report(**params)
+        self.assertEqual(response.status_code, 503)
+        models.MotionAssetMeasurement.objects.bulk_create(
+            models.MotionAssetMeasurement(
+                asset=self.asset,
+                measurementTypeId=type_id,
+                timestamp=self.from_date,
+                value=1.0,
+            )
+            for type_id in api.MEASUREMENT_TYPES.values()
+        )
+        for _ in range(2):
+            response = self.get_report(**params)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.data["stale"])
+        self.assertEqual(cache.get_stats(), {"report": {"hits": 0, "misses": 3}})
+        self.assertEqual(refresh.call_count, 2)
+
+    def test_refresh_deduplicated(self):
+        started, release = threading.Event(), threading.Event()
+        runs = []
+
+        def refresh(value):
+            runs.append(value)
+            started.set()
+            release.wait(5)
+
+        first = resilience.refresh_in_background("key", refresh, 1)
+        started.wait(5)
+        self.assertIs(resilience.refresh_in_background("key", refresh, 2), first)
+        release.set()
+        first.result(5)
+        resilience.refresh_in_background("key", refresh, 3).result(5)
+        self.assertEqual(runs, [1, 3])
+
+
+# the URLs of the app with its async views, routed by AsyncViewsTest
+urlpatterns = [path("api/abb/", include(abb_urls.get_urlpatterns(True)))]
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncViewsTest(AssetMeasurementsStoreTest):
+    def setUp(self):
+        super().setUp()
+        resilience.reset_breakers()
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.account.user)}"
+        )
+        self.upstream = []
+        self.upstream_status = 200
+        patcher = mock.patch("abb.async_api.create_client", self.create_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_client(self) -> httpx.AsyncClient:
+        async def handler(request: httpx.Request) -> httpx.Response:
+            self.upstream.append(request)
+            if self.upstream_status != 200:
+                return httpx.Response(self.upstream_status)
+            return httpx.Response(200, json=measurement_payload(self.points(0, 10)))
+
+        return httpx.AsyncClient(
+            base_url=api.API_URL, transport=httpx.MockTransport(handler)
+        )
+
+    def get_sync(self, view, path: str, **kwargs):
+        request = APIRequestFactory().get(path)
+        force_authenticate(request, user=self.account.user)
+        return view.as_view()(request, **kwargs)
+
+    def test_views_routed(self):
+        for url in ("/api/abb/site/", "/api/abb/site/12440/", "/api/abb/asset/"):
+            with self.subTest(url=url):
+                self.assertTrue(asyncio.iscoroutinefunction(resolve(url).func))
+
+    def test_same_data_as_sync_views(self):
+        response = self.client.get("/api/abb/site/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/json")
+        expected = self.get_sync(views.SiteView, "/api/abb/site/")
+        self.assertEqual(response.json(), json.loads(renderers.dumps(expected.data)))
+        self.assertEqual(response["ETag"], expected["ETag"])
+
+        response = self.client.get("/api/abb/site/12440/")
+        expected = self.get_sync(
+            views.AssetView, "/api/abb/site/12440/", siteId="12440"
+        )
+        self.assertEqual(response.json(), json.loads(renderers.dumps(expected.data)))
+        self.assertEqual(response.json()["assets"][0]["motionAssetId"], "e197cdae")
+        # the entries of the cache are shared by both
+        self.assertEqual(cache.get_stats()["assets"]["hits"], 1)
+
+    def test_authentication(self):
+        response = APIClient().get("/api/abb/site/")
+        self.assertEqual(response.status_code, 401)
+        self.assertIn("Bearer", response["WWW-Authenticate"])
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION="Bearer wrong")
+        self.assertEqual(client.get("/api/abb/site/").status_code, 401)
+        user = User.objects.create_user(username="other", password="other")
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(user)}")
+        response = client.get("/api/abb/site/")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"msg": "Invalid ABB user account"})
+        self.assertEqual(self.client.post("/api/abb/site/").status_code, 405)
+
+    @responses.activate
+    def test_report_fetched_with_async_client(self):
+        url = "/api/abb/site/12440/asset/e197cdae/"
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["measurements"]), 10)
+        self.assertFalse(response.json()["stale"])
+        self.assertGreater(len(self.upstream), 0)
+        # no blocking call was made
+        self.assertEqual(len(responses.calls), 0)
+        calls = len(self.upstream)
+        # the report of the closed month is now versioned by its snapshot
+        response = self.client.get(url)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(self.upstream), calls)
+        response = self.client.get(url, {"summary": True})
+        self.assertEqual(response.json()["report"]["max_tot_time"], 9.0)
+        self.assertNotIn("measurements", response.json())
+
+    def test_report_stream(self):
+        iter_report_ndjson = views.iter_report_ndjson
+        threads = set()
+
+        def iter_lines(*args):
+            for line in iter_report_ndjson(*args):
+                threads.add(threading.get_ident())
+                yield line
+
+        with mock.patch.object(views, "iter_report_ndjson", iter_lines):
+            response = self.client.get(
+                "/api/abb/site/12440/asset/e197cdae/", {"stream": True}
+            )
+            lines = b"".join(response.streaming_content).splitlines()
+        # serialized on a worker thread, not in the event loop of the request
+        self.assertEqual(len(threads), 1)
+        self.assertNotIn(threading.get_ident(), threads)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(len(lines), 11)
+        self.assertEqual(json.loads(lines[0])["report"]["max_tot_time"], 9.0)
+
+    @override_settings(ABB_API_RETRY_BACKOFF=0)
+    def test_report_errors(self):
+        response = self.client.get("/api/abb/site/12440/asset/unknown/")
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(
+            "/api/abb/site/12440/asset/e197cdae/", {"month": 13, "year": 2022}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("month", response.json())
+        self.upstream_status = 503
+        with self.assertLogs("abb.async_api", "WARNING"):
+            response = self.client.get("/api/abb/site/12440/asset/e197cdae/")
+        self.assertEqual(response.status_code, 503)
+
+    def test_middlewares_async_capable(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        self.assertTrue(
+            asyncio.iscoroutinefunction(metrics.MetricsMiddleware(get_response))
+        )
+        with override_settings(ABB_PROFILING=True):
+            middleware = profiling.ProfilingMiddleware(get_response)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        request = APIRequestFactory().get("/api/abb/site/")
+        request.resolver_match = None
+        with self.assertLogs("abb.profiling", "INFO"):
+            response = async_to_sync(middleware)(request)
+        self.assertIn("total;dur=", response["Server-Timing"])
+        self.assertFalse(
+            asyncio.iscoroutinefunction(
+                metrics.MetricsMiddleware(lambda request: HttpResponse())
+            )
+        )
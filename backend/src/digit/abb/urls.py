@@ -1,14 +1,41 @@
+from django.conf import settings
 from django.urls import path
 
-from . import views
-
-urlpatterns = [
-    path("asset/", views.AssetView.as_view(), name="asset"),
-    path(
-        "site/<str:siteId>/asset/<str:assetId>/",
-        views.AssetDataView.as_view(),
-        name="asset_info",
-    ),
-    path("site/<str:siteId>/", views.AssetView.as_view(), name="site_assets"),
-    path("site/", views.SiteView.as_view(), name="site"),
-]
+from . import async_views, views
+
+
+def get_urlpatterns(async_views_enabled: bool) -> list:
+    """
+    the URLs of the app, with the sites, assets and asset reports served by
+    the async views of abb.async_views if async_views_enabled
+    """
+    if async_views_enabled:
+        site_view = async_views.sites
+        asset_view = async_views.assets
+        asset_data_view = async_views.asset_data
+    else:
+        site_view = views.SiteView.as_view()
+        asset_view = views.AssetView.as_view()
+        asset_data_view = views.AssetDataView.as_view()
+
+    return [
+        path("asset/", asset_view, name="asset"),
+        path(
+            "site/<str:siteId>/asset/<str:assetId>/",
+            asset_data_view,
+            name="asset_info",
+        ),
+        path(
+            "site/<str:siteId>/reports/",
+            views.SiteReportsView.as_view(),
+            name="site_reports",
+        ),
+        path("site/<str:siteId>/", asset_view, name="site_assets"),
+        path("site/", site_view, name="site"),
+        path("fleet/", views.FleetReportsView.as_view(), name="fleet_reports"),
+        path("cache/stats/", views.CacheStatsView.as_view(), name="cache_stats"),
+        path("metrics/", views.MetricsView.as_view(), name="metrics"),
+    ]
+
+
+urlpatterns = get_urlpatterns(settings.ABB_ASYNC_VIEWS)
@@ -1,13 +1,41 @@
+import hashlib
+import hmac
 import os
 
+from functools import wraps
+from itertools import chain, islice
+from typing import Any, Callable, Iterable, Iterator, Optional, Union
+
+import requests
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.utils.http import http_date, quote_etag
+from prometheus_client import CONTENT_TYPE_LATEST
 
 from rest_framework.views import APIView
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import BasePermission, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 
-from abb import abb_api as abb, serializers
+from abb import (
+    abb_api as abb,
+    async_api,
+    cache,
+    fleet,
+    metrics,
+    models,
+    renderers,
+    resilience,
+    serializers,
+)
 
 RELOAD = os.getenv("READ_DATA_FROM_ABB_CLOUD", False)
 
@@ -15,6 +43,9 @@ ABB_APIS = {
     # user: abb_api
 }
 
+# measurements sent per chunk of a streamed report
+NDJSON_BATCH_SIZE = 1000
+
 
 class MissingAbbUserException(Exception):
     pass
@@ -31,9 +62,128 @@ def get_user_abb_api(user) -> abb.AbbApi:
     return ABB_APIS[username]
 
 
+def get_etag(request, version: abb.DataVersion) -> str:
+    """ETag of the response to request computed from the data version"""
+    key = "\n".join(
+        (
+            version.key,
+            str(request.user.pk),
+            request.get_full_path(),
+            request.META.get("HTTP_ACCEPT", ""),
+        )
+    )
+    return quote_etag(hashlib.md5(key.encode(), usedforsecurity=False).hexdigest())
+
+
+def conditional(get):
+    """
+    Decorator of the get method of the views defining get_data_version.
+    Responses have the ETag and the Last-Modified of the version of their
+    data and must be revalidated by the clients: a request with a matching
+    If-None-Match or If-Modified-Since gets a 304 before the data is fetched
+    from the ABB cloud or serialized. Without a version the view is called
+    as usual, with no validators.
+    """
+
+    @wraps(get)
+    def wrapper(view, request, *args, **kwargs):
+        version = None if RELOAD else view.get_data_version(request, *args, **kwargs)
+        view.data_version = version
+        if version is None:
+            return get(view, request, *args, **kwargs)
+        etag, last_modified = get_validators(request, version)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = get(view, request, *args, **kwargs)
+        return set_validators(response, etag, last_modified)
+
+    return wrapper
+
+
+def get_validators(request, version: abb.DataVersion) -> tuple[str, Optional[int]]:
+    """the ETag and the Last-Modified timestamp of the response to request"""
+    last_modified = version.modified and int(version.modified.timestamp())
+    return get_etag(request, version), last_modified
+
+
+def set_validators(response, etag: str, last_modified: Optional[int]):
+    """add the validators to a successful response, which must be revalidated"""
+    if response.status_code in (200, 304):
+        response.headers.setdefault("ETag", etag)
+        if last_modified:
+            response.headers.setdefault("Last-Modified", http_date(last_modified))
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ("Authorization",))
+    return response
+
+
+def cached(
+    view: APIView,
+    account: models.Account,
+    endpoint: str,
+    params: dict,
+    compute: Callable[[], Any],
+    reload: bool = False,
+) -> Any:
+    """
+    the data computed by compute, cached for the account unless it's
+    reloaded from the ABB cloud. The data version of a conditional view is
+    part of the key, so a cached response always matches its ETag.
+    """
+    if RELOAD or reload:
+        return compute()
+    version = getattr(view, "data_version", None)
+    params = {**params, "version": version and version.key}
+    return cache.get_or_set(account, endpoint, params, compute, is_fresh)
+
+
+def is_fresh(data) -> bool:
+    """
+    the data has no report computed from stale measurements, which is left
+    out of the cache so the next request gets the refreshed ones
+    """
+    if not isinstance(data, dict):
+        return True
+    reports = data.get("reports", [data])
+    return not any(report.get("stale") for report in reports)
+
+
+def ndjson_line(data) -> bytes:
+    return renderers.dumps(data) + b"\n"
+
+
+def iter_report_ndjson(
+    header: abb.AssetReportHeader, points: Iterable[abb.CombinedPoint]
+) -> Iterator[bytes]:
+    """
+    the report as NDJSON: a line with the header, then one per measurement.
+    The header is serialized before the first chunk is requested, the
+    measurements are serialized as they are merged.
+    """
+    yield ndjson_line(
+        renderers.serialize(serializers.AssetReportHeaderSerializer, header)
+    )
+    points = iter(points)
+    while batch := list(islice(points, NDJSON_BATCH_SIZE)):
+        yield b"".join(
+            ndjson_line(renderers.serialize(serializers.CombinedPointSerializer, point))
+            for point in batch
+        )
+
+
 class AssetView(APIView):
     permission_classes = [IsAuthenticated]
 
+    def get_data_version(
+        self, request, siteId: str = None
+    ) -> Optional[abb.DataVersion]:
+        if not request.user.account.exists():
+            return None
+        return abb.get_motionassets_version(siteId)
+
+    @conditional
     def get(self, request, siteId: str = None):
         try:
             api = get_user_abb_api(request.user)
@@ -41,14 +191,27 @@ class AssetView(APIView):
             return Response(
                 {"msg": "Invalid ABB user account"}, status=status.HTTP_400_BAD_REQUEST
             )
-        assets = api.get_motionassets(siteId, force_reload=RELOAD)
-        serializer = serializers.AssetsSerializer({"assets": assets})
-        return Response(serializer.data)
+        data = cached(
+            self,
+            api.account,
+            "assets",
+            {"siteId": siteId},
+            lambda: renderers.serialize(
+                serializers.AssetsSerializer,
+                {"assets": api.get_motionassets(siteId, force_reload=RELOAD)},
+            ),
+        )
+        return Response(data)
 
 
 class SiteView(APIView):
     permission_classes = [IsAuthenticated]
 
+    def get_data_version(self, request) -> Optional[abb.DataVersion]:
+        account = request.user.account.first()
+        return account and abb.get_sites_version(account)
+
+    @conditional
     def get(self, request):
         try:
             api = get_user_abb_api(request.user)
@@ -56,14 +219,47 @@ class SiteView(APIView):
             return Response(
                 {"msg": "Invalid ABB user account"}, status=status.HTTP_400_BAD_REQUEST
             )
-        sites = api.get_sites(force_reload=RELOAD)
-        serializer = serializers.SitesSerializer({"sites": sites})
-        return Response(serializer.data)
+        data = cached(
+            self,
+            api.account,
+            "sites",
+            {},
+            lambda: renderers.serialize(
+                serializers.SitesSerializer,
+                {"sites": api.get_sites(force_reload=RELOAD)},
+            ),
+        )
+        return Response(data)
+
+
+def get_report_query(
+    request, serializer_class=serializers.ReportQuerySerializer
+) -> Optional[dict]:
+    """
+    the validated report query of a request whose data can be versioned,
+    None if it's invalid or asks to reload the data
+    """
+    query = serializer_class(data=request.query_params)
+    if not query.is_valid() or query.validated_data["refresh"]:
+        return None
+    if not request.user.account.exists():
+        return None
+    return query.validated_data
 
 
 class AssetDataView(APIView):
     permission_classes = [IsAuthenticated]
 
+    def get_data_version(
+        self, request, siteId: str, assetId: str
+    ) -> Optional[abb.DataVersion]:
+        query = get_report_query(request, serializers.AssetReportQuerySerializer)
+        account = request.user.account.first()
+        if query is None or account is None:
+            return None
+        return get_asset_report_version(account, assetId, query)
+
+    @conditional
     def get(self, request, siteId: str, assetId: str):
         try:
             api = get_user_abb_api(request.user)
@@ -71,6 +267,258 @@ class AssetDataView(APIView):
             return Response(
                 {"msg": "Invalid ABB user account"}, status=status.HTTP_400_BAD_REQUEST
             )
-        measurements = api.get_asset_report(assetId)
-        serializer = serializers.AssetReportSerializer(measurements)
-        return Response(serializer.data)
+        query = serializers.AssetReportQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        if query.validated_data["stream"]:
+            return self.stream(api, assetId, query.validated_data)
+        try:
+            data = cached(
+                self,
+                api.account,
+                "report",
+                get_report_cache_params(assetId, query.validated_data),
+                lambda: self.report(api, assetId, query.validated_data),
+                reload=query.validated_data["refresh"],
+            )
+        except models.MotionAsset.DoesNotExist:
+            return Response(
+                {"msg": "Asset not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+        except abb.NoMeasurementsError:
+            return Response(
+                {"msg": "No measurements found"}, status=status.HTTP_404_NOT_FOUND
+            )
+        except requests.RequestException as e:
+            if not resilience.is_upstream_failure(e):
+                raise
+            return Response(
+                {"msg": "ABB cloud unavailable"},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            )
+        return Response(data)
+
+    def report(self, api: abb.AbbApi, assetId: str, query: dict) -> dict:
+        if query["summary"]:
+            header = api.get_asset_summary(
+                assetId,
+                month=query.get("month"),
+                year=query.get("year"),
+                force_reload=query["refresh"],
+                from_date=query.get("from_date"),
+                to_date=query.get("to_date"),
+            )
+            return serialize_report(header, query)
+        if "from_date" in query:
+            measurements = api.get_asset_range_report(
+                assetId,
+                query["from_date"],
+                query["to_date"],
+                force_reload=query["refresh"],
+            )
+        else:
+            measurements = api.get_asset_report(
+                assetId,
+                month=query.get("month"),
+                year=query.get("year"),
+                force_reload=query["refresh"],
+            )
+        return serialize_report(measurements, query)
+
+    def stream(self, api: abb.AbbApi, assetId: str, query: dict):
+        try:
+            header, points = api.stream_asset_report(
+                assetId,
+                month=query.get("month"),
+                year=query.get("year"),
+                force_reload=query["refresh"],
+                from_date=query.get("from_date"),
+                to_date=query.get("to_date"),
+            )
+        except models.MotionAsset.DoesNotExist:
+            return Response(
+                {"msg": "Asset not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+        except abb.NoMeasurementsError:
+            return Response(
+                {"msg": "No measurements found"}, status=status.HTTP_404_NOT_FOUND
+            )
+        except requests.RequestException as e:
+            if not resilience.is_upstream_failure(e):
+                raise
+            return Response(
+                {"msg": "ABB cloud unavailable"},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            )
+        lines = iter_report_ndjson(header, points)
+        # serialize the header now, while the DB can still be used
+        first = next(lines)
+        return StreamingHttpResponse(
+            chain((first,), lines), content_type="application/x-ndjson"
+        )
+
+
+def get_asset_report_version(
+    account: models.Account, assetId: str, query: dict
+) -> Optional[abb.DataVersion]:
+    """
+    version of the data of the report of the asset of the account asked by a
+    valid query
+    """
+    try:
+        asset = abb.get_account_asset(account, assetId)
+    except models.MotionAsset.DoesNotExist:
+        return None
+    if "from_date" in query:
+        return abb.get_range_report_version(asset, query["from_date"], query["to_date"])
+    return abb.get_report_version(asset, query.get("month"), query.get("year"))
+
+
+def get_report_cache_params(assetId: str, query: dict) -> dict:
+    """the params of the cached report of the asset asked by a valid query"""
+    month, year = abb.get_report_month(query.get("month"), query.get("year"))
+    return {
+        "assetId": assetId,
+        "month": month,
+        "year": year,
+        "from": query.get("from_date"),
+        "to": query.get("to_date"),
+        "summary": query["summary"],
+        "max_points": query.get("max_points"),
+        "downsample": query["downsample"],
+    }
+
+
+def serialize_report(
+    report: Union[abb.AssetReport, abb.AssetReportHeader], query: dict
+) -> dict:
+    """the data of a report or of its header, downsampled as asked by the query"""
+    if isinstance(report, abb.AssetReportHeader):
+        return renderers.serialize(serializers.AssetReportHeaderSerializer, report)
+    if "max_points" in query:
+        report = abb.downsample_report(report, query["max_points"], query["downsample"])
+    return renderers.serialize(serializers.AssetReportSerializer, report)
+
+
+class SiteReportsView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get_data_version(self, request, siteId: str) -> Optional[abb.DataVersion]:
+        query = get_report_query(request)
+        if query is None:
+            return None
+        return abb.get_site_reports_version(
+            siteId, query.get("month"), query.get("year")
+        )
+
+    @conditional
+    def get(self, request, siteId: str):
+        try:
+            api = get_user_abb_api(request.user)
+        except MissingAbbUserException:
+            return Response(
+                {"msg": "Invalid ABB user account"}, status=status.HTTP_400_BAD_REQUEST
+            )
+        query = serializers.ReportQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        month, year = abb.get_report_month(
+            query.validated_data.get("month"), query.validated_data.get("year")
+        )
+        data = cached(
+            self,
+            api.account,
+            "site_reports",
+            {
+                "siteId": siteId,
+                "month": month,
+                "year": year,
+                "max_points": query.validated_data.get("max_points"),
+                "downsample": query.validated_data["downsample"],
+            },
+            lambda: self.reports(api, siteId, query.validated_data),
+            reload=query.validated_data["refresh"],
+        )
+        return Response(data)
+
+    def reports(self, api: abb.AbbApi, siteId: str, query: dict) -> dict:
+        reports = async_to_sync(async_api.get_site_reports)(
+            api.account,
+            siteId,
+            month=query.get("month"),
+            year=query.get("year"),
+            force_reload=query["refresh"],
+        )
+        if "max_points" in query:
+            reports = [
+                abb.downsample_report(report, query["max_points"], query["downsample"])
+                for report in reports
+            ]
+        return renderers.serialize(
+            serializers.SiteReportsSerializer, {"reports": reports}
+        )
+
+
+class CacheStatsView(APIView):
+    """hits and misses of the cache of the ABB views in this process"""
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({"endpoints": cache.get_stats()})
+
+
+class HasMetricsToken(BasePermission):
+    """the bearer token is settings.ABB_METRICS_TOKEN, nobody has it if unset"""
+
+    def has_permission(self, request, view):
+        if not settings.ABB_METRICS_TOKEN:
+            return False
+        return hmac.compare_digest(
+            request.headers.get("Authorization", ""),
+            f"Bearer {settings.ABB_METRICS_TOKEN}",
+        )
+
+
+class MetricsView(APIView):
+    """metrics of all the worker processes, in the Prometheus text format"""
+
+    # the scraper sends the metrics token, not a user JWT
+    authentication_classes = []
+    permission_classes = [HasMetricsToken]
+
+    def get(self, request):
+        return HttpResponse(metrics.generate(), content_type=CONTENT_TYPE_LATEST)
+
+
+class FleetReportsView(APIView):
+    """
+    reports of all the assets of the user's account for a month, computed on
+    the process pool of abb.fleet, with a summary row per asset
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        query = serializers.FleetReportQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        if query.validated_data["all"]:
+            if not request.user.is_staff:
+                return Response(
+                    {"msg": "Only staff can compute the reports of all the accounts"},
+                    status=status.HTTP_403_FORBIDDEN,
+                )
+            accounts = list(models.Account.objects.all())
+        else:
+            account = request.user.account.first()
+            if account is None:
+                return Response(
+                    {"msg": "Invalid ABB user account"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            accounts = [account]
+        report = fleet.compute_fleet_reports(
+            accounts,
+            query.validated_data.get("month"),
+            query.validated_data.get("year"),
+            force_reload=query.validated_data["refresh"],
+        )
+        return Response(renderers.serialize(serializers.FleetReportSerializer, report))
@@ -13,4 +13,24 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings.dev")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from abb import async_api  # noqa: E402
+
+
+async def application(scope, receive, send):
+    """
+    the Django application, which serves only HTTP, answering the lifespan
+    events of the server too: the shared ABB cloud client of the worker is
+    closed when the server shuts down
+    """
+    if scope["type"] != "lifespan":
+        return await django_application(scope, receive, send)
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await async_api.close_client()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
@@ -50,6 +50,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "abb.profiling.ProfilingMiddleware",
+    "abb.metrics.MetricsMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -142,10 +144,111 @@ CORS_ORIGIN_ALLOW_ALL = True
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
         "rest_framework_simplejwt.authentication.JWTAuthentication",
-    )
+    ),
+    "DEFAULT_RENDERER_CLASSES": (
+        "abb.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ),
 }
 
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=60),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
 }
+
+# base URL of the ABB cloud API, pointed to benchmarks/abb_simulator.py for
+# load tests
+ABB_API_URL = os.getenv("ABB_API_URL", "https://api.conditionmonitoring.motion.abb.com")
+
+# HTTP client used for the ABB cloud API: max number of keep-alive connections
+# kept open per process and (connect, read) timeouts in seconds
+ABB_API_POOL_SIZE = int(os.getenv("ABB_API_POOL_SIZE", 10))
+ABB_API_CONNECT_TIMEOUT = float(os.getenv("ABB_API_CONNECT_TIMEOUT", 5))
+ABB_API_READ_TIMEOUT = float(os.getenv("ABB_API_READ_TIMEOUT", 30))
+# max number of concurrent requests made by the async client and for the
+# windows of a long measurement range
+ABB_API_MAX_CONCURRENCY = int(os.getenv("ABB_API_MAX_CONCURRENCY", 8))
+# idempotent requests failing transiently are retried up to ABB_API_RETRIES
+# times, after a random wait of at most ABB_API_RETRY_BACKOFF seconds doubled
+# at every attempt, capped at ABB_API_RETRY_MAX_BACKOFF
+ABB_API_RETRIES = int(os.getenv("ABB_API_RETRIES", 2))
+ABB_API_RETRY_BACKOFF = float(os.getenv("ABB_API_RETRY_BACKOFF", 0.5))
+ABB_API_RETRY_MAX_BACKOFF = float(os.getenv("ABB_API_RETRY_MAX_BACKOFF", 8))
+# circuit breaker of each account: after ABB_BREAKER_FAILURES failed requests
+# in a row its requests fail fast for ABB_BREAKER_RESET seconds
+ABB_BREAKER_FAILURES = int(os.getenv("ABB_BREAKER_FAILURES", 5))
+ABB_BREAKER_RESET = float(os.getenv("ABB_BREAKER_RESET", 30))
+# threads fetching in the background the measurements served stale while the
+# ABB cloud is failing
+ABB_REFRESH_WORKERS = int(os.getenv("ABB_REFRESH_WORKERS", 2))
+# measurement ranges longer than ABB_FETCH_WINDOW_DAYS are fetched in windows
+# of that many days, each retried on its own
+ABB_FETCH_WINDOW_DAYS = int(os.getenv("ABB_FETCH_WINDOW_DAYS", 31))
+# longest range of days of an asset report
+ABB_REPORT_MAX_DAYS = int(os.getenv("ABB_REPORT_MAX_DAYS", 366))
+
+# background sync (manage.py abb_sync): seconds between two runs, number of
+# worker threads, max requests per second made for each ABB account and age
+# in seconds after which synced data is refreshed again by the views
+ABB_SYNC_INTERVAL = int(os.getenv("ABB_SYNC_INTERVAL", 300))
+ABB_SYNC_WORKERS = int(os.getenv("ABB_SYNC_WORKERS", 4))
+ABB_SYNC_RATE_LIMIT = float(os.getenv("ABB_SYNC_RATE_LIMIT", 5))
+ABB_SYNC_MAX_AGE = int(os.getenv("ABB_SYNC_MAX_AGE", 2 * ABB_SYNC_INTERVAL))
+# processes computing the reports of the fleet, 0 for one per core
+ABB_FLEET_WORKERS = int(os.getenv("ABB_FLEET_WORKERS", 0))
+
+# serve the sites, the assets and the asset reports with the native async
+# views of abb.async_views, which don't hold a thread while waiting on the ABB
+# cloud, instead of the DRF ones. Meant for the ASGI server. They authenticate
+# the JWT themselves and answer JSON only: the DRF permissions, throttling and
+# content negotiation don't apply to them.
+ABB_ASYNC_VIEWS = os.getenv("ABB_ASYNC_VIEWS", "false").lower() == "true"
+
+# report the DB queries, the ABB cloud calls and the serialization time of
+# each request in its Server-Timing header and in the abb.profiling log
+ABB_PROFILING = os.getenv("ABB_PROFILING", "false").lower() == "true"
+
+# bearer token required to scrape /api/abb/metrics/, disabled if empty. With
+# several worker processes PROMETHEUS_MULTIPROC_DIR must be set, see
+# abb.metrics
+ABB_METRICS_TOKEN = os.getenv("ABB_METRICS_TOKEN", "")
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {
+        # one JSON line per request
+        "abb.profiling": {"handlers": ["console"], "level": "INFO", "propagate": False}
+    },
+}
+
+# serialize the ABB views responses with the fast path of abb.renderers,
+# encoding them with orjson when installed
+ABB_FAST_JSON = os.getenv("ABB_FAST_JSON", "true").lower() == "true"
+
+# cache of the data of the ABB views, per account: "locmem" keeps it in each
+# process, "file" in ABB_CACHE_DIR, which the abb-sync service must share to
+# invalidate it when it stores new data
+ABB_CACHE_BACKEND = os.getenv("ABB_CACHE_BACKEND", "locmem")
+ABB_CACHE_DIR = os.getenv("ABB_CACHE_DIR", "/tmp/digit-abb-cache")
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "abb": {
+        "BACKEND": {
+            "locmem": "django.core.cache.backends.locmem.LocMemCache",
+            "file": "django.core.cache.backends.filebased.FileBasedCache",
+        }[ABB_CACHE_BACKEND],
+        "LOCATION": ABB_CACHE_DIR if ABB_CACHE_BACKEND == "file" else "abb",
+        "OPTIONS": {"MAX_ENTRIES": int(os.getenv("ABB_CACHE_MAX_ENTRIES", 1000))},
+    },
+}
+# seconds the data of each endpoint is cached, 0 disables the cache
+ABB_CACHE_TTLS = {
+    "sites": int(os.getenv("ABB_CACHE_TTL_SITES", 300)),
+    "assets": int(os.getenv("ABB_CACHE_TTL_ASSETS", 300)),
+    "report": int(os.getenv("ABB_CACHE_TTL_REPORT", 600)),
+    "site_reports": int(os.getenv("ABB_CACHE_TTL_SITE_REPORTS", 600)),
+    # refreshed by abb_sync, they expire if it stops
+    "subscriptions": int(os.getenv("ABB_CACHE_TTL_SUBSCRIPTIONS", ABB_SYNC_MAX_AGE)),
+}
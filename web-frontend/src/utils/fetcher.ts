@@ -5,7 +5,10 @@ type FetchRequestArgs = {
 
 export default function fetcher(args: FetchRequestArgs) {
     const { url, token } = args;
+    // revalidate the cached response with its ETag, the backend answers
+    // 304 if the data didn't change
     return fetch(url, {
         headers: { 'Authorization': `Bearer ${token}` },
+        cache: 'no-cache',
     }).then((r) => r.json());
 }
\ No newline at end of file